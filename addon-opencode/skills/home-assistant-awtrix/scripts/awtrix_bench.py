@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Callable
+
+import awtrix_emulator
+import awtrix_fs
+from awtrix_emulator import AwtrixEmulator, DeviceProfile
+
+SCENARIOS = ("keepalive", "upload", "list", "delete", "sync", "backup", "coldstart")
+COLDSTART_COMMANDS = (("status",), ("list", "/ICONS"))
+# Nothing `status` or a single `list` runs needs these; importing one at module level shows up here first.
+COLDSTART_FORBIDDEN = (
+    "asyncio",
+    "concurrent.futures",
+    "dataclasses",
+    "hashlib",
+    "subprocess",
+    "tarfile",
+    "urllib.request",
+    "uuid",
+    "venv",
+    "zipfile",
+)
+
+
+@dataclasses.dataclass
+class Result:
+    name: str
+    ops: int
+    seconds: float
+    nbytes: int = 0
+    resets: int = 0
+    peak_connections: int = 0
+    error: str | None = None
+    notes: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def ops_per_sec(self) -> float:
+        return self.ops / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.nbytes / self.seconds / 1e6 if self.seconds else 0.0
+
+
+def repeat(fn: Callable[[], object], count: int) -> int:
+    for _ in range(count):
+        fn()
+    return 0
+
+
+NOTES: list[str] = []
+
+
+def run_cli(*argv: str) -> None:
+    args = awtrix_fs.build_parser().parse_args(list(argv))
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+            code = args.func(args)
+    finally:
+        # Keep the adaptive concurrency summary so the table can show where each run settled.
+        NOTES.extend(line for line in stderr.getvalue().splitlines() if line.startswith("concurrency "))
+    if code:
+        raise RuntimeError(f"awtrix_fs {' '.join(argv)} exited with {code}")
+
+
+def concurrency_args(args: argparse.Namespace) -> tuple[str, ...]:
+    fixed = ("--concurrency", str(args.concurrency)) if args.concurrency else ()
+    return (*fixed, "--max-concurrency", str(args.max_concurrency))
+
+
+def icon_files(count: int, size: int) -> dict[str, bytes]:
+    return {f"/ICONS/{i:04}.gif": bytes([i % 256]) * size for i in range(count)}
+
+
+def measure(name: str, device: AwtrixEmulator, fn: Callable[[], int], ops: int) -> Result:
+    NOTES.clear()
+    start = time.perf_counter()
+    error = None
+    try:
+        nbytes = fn()
+    except RuntimeError as exc:
+        nbytes, error = 0, str(exc)
+    seconds = time.perf_counter() - start
+    return Result(name, ops, seconds, nbytes, device.stats.resets, device.stats.peak_connections, error, list(NOTES))
+
+
+def bench_keepalive(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    # Raw connection reuse: no think time or flash writes, only the per-connection accept delay.
+    profile = dataclasses.replace(profile, latency=0.0, write_bandwidth=0, max_connections=0)
+    with AwtrixEmulator(profile, {"/ICONS/x.gif": b"x"}) as device:
+        host = device.host
+        client = awtrix_fs.AwtrixClient(host)
+        scenarios: list[tuple[str, Callable[[], object], Callable[[], object]]] = [
+            ("status", lambda: urllib.request.urlopen(f"http://{host}/status").read(), client.status),
+            ("list", lambda: urllib.request.urlopen(f"http://{host}/list?dir=%2FICONS").read(), lambda: client.list_dir("/ICONS", refresh=True)),
+            ("get", lambda: urllib.request.urlopen(f"http://{host}/ICONS/x.gif").read(), lambda: client.read_file("/ICONS/x.gif")),
+        ]
+        results = []
+        for name, before, after in scenarios:
+            results.append(measure(f"{name} urlopen", device, lambda: repeat(before, args.requests), args.requests))
+            results.append(measure(f"{name} pooled", device, lambda: repeat(after, args.requests), args.requests))
+        return results
+
+
+def bench_upload(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    files = icon_files(args.files, args.size)
+    with AwtrixEmulator(profile) as device:
+        client = awtrix_fs.AwtrixClient(device.host)
+
+        def upload() -> int:
+            for path, data in files.items():
+                client.upload_bytes(path, data)
+            return sum(map(len, files.values()))
+
+        return [measure("upload", device, upload, len(files))]
+
+
+def bench_list(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    with AwtrixEmulator(profile, icon_files(args.files, args.size)) as device:
+        client = awtrix_fs.AwtrixClient(device.host)
+
+        def listing() -> int:
+            start = device.stats.bytes_out
+            for _ in range(args.requests):
+                client.list_dir("/ICONS", refresh=True)
+            return device.stats.bytes_out - start
+
+        return [measure("list", device, listing, args.requests)]
+
+
+def bench_delete(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    with AwtrixEmulator(profile, icon_files(args.files, args.size)) as device:
+
+        def delete() -> int:
+            run_cli("--host", device.host, *concurrency_args(args), "--index-ttl", "0", "delete", "--glob", "/ICONS/*")
+            return 0
+
+        return [measure("delete", device, delete, args.files)]
+
+
+def bench_sync(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    files = icon_files(args.files, args.size)
+    with tempfile.TemporaryDirectory() as local, AwtrixEmulator(profile) as device:
+        for path, data in files.items():
+            with open(os.path.join(local, os.path.basename(path)), "wb") as fp:
+                fp.write(data)
+        argv = ("--host", device.host, *concurrency_args(args), "--index-ttl", "0", "sync", local, "/ICONS")
+
+        def sync() -> int:
+            run_cli(*argv)
+            return sum(map(len, files.values()))
+
+        cold = measure("sync (cold)", device, sync, len(files))
+        warm = measure("sync (warm)", device, lambda: run_cli(*argv) or 0, 0)
+        return [cold, warm]
+
+
+def bench_backup(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    files = icon_files(args.files, args.size)
+    with tempfile.TemporaryDirectory() as out, AwtrixEmulator(profile, files) as device:
+
+        def backup() -> int:
+            run_cli("--host", device.host, *concurrency_args(args), "backup", os.path.join(out, "backup.tar"))
+            return sum(map(len, files.values()))
+
+        return [measure("backup", device, backup, len(files))]
+
+
+def import_profile(argv: list[str]) -> tuple[float, float, set[str]]:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "awtrix_fs.py")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", script, *argv], capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f"awtrix_fs {' '.join(argv)} exited with {proc.returncode}")
+    total, modules = 0.0, set()
+    for line in proc.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indent><module>"; unindented rows are top-level imports.
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match:
+            modules.add(match[3])
+            if not match[2]:
+                total += int(match[1]) / 1000
+    return total, wall, modules
+
+
+def bench_coldstart(profile: DeviceProfile, args: argparse.Namespace) -> list[Result]:
+    results = []
+    with AwtrixEmulator(profile, icon_files(4, 64)) as device:
+        for command in COLDSTART_COMMANDS:
+            # Best of several runs: the budget is about what gets imported, not scheduler noise.
+            runs = [import_profile(["--host", device.host, *command]) for _ in range(args.coldstart_runs)]
+            imports = min(total for total, _, _ in runs)
+            loaded = set.union(*(modules for _, _, modules in runs))
+            result = Result(f"coldstart {command[0]}", len(runs), sum(wall for _, wall, _ in runs))
+            result.notes.append(
+                f"imports {imports:.1f} ms (budget {args.import_budget_ms:g} ms), "
+                f"process {statistics.median(wall for _, wall, _ in runs) * 1000:.1f} ms median"
+            )
+            problems = [f"imports {', '.join(sorted(loaded & set(COLDSTART_FORBIDDEN)))}"] if loaded & set(COLDSTART_FORBIDDEN) else []
+            if imports > args.import_budget_ms:
+                problems.append(f"imports took {imports:.1f} ms, over the {args.import_budget_ms:g} ms budget")
+            result.error = "; ".join(problems) or None
+            results.append(result)
+    return results
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark awtrix_fs against the in-memory AWTRIX emulator")
+    p.add_argument("scenarios", nargs="*", metavar="SCENARIO", help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    p.add_argument("--requests", type=int, default=200, help="Requests per keepalive/list scenario (default: 200)")
+    p.add_argument("--files", type=int, default=50, help="Files per upload/delete/sync/backup scenario (default: 50)")
+    p.add_argument("--size", type=int, default=2048, help="Bytes per file (default: 2048)")
+    p.add_argument("--concurrency", type=int, help="Fixed awtrix_fs --concurrency for delete/sync/backup (default: adaptive)")
+    p.add_argument("--max-concurrency", type=int, default=awtrix_fs.AIMD_MAX_CONCURRENCY, help="awtrix_fs --max-concurrency for adaptive runs")
+    p.add_argument("--coldstart-runs", type=int, default=5, help="Processes started per coldstart command (default: 5)")
+    p.add_argument(
+        "--import-budget-ms",
+        type=float,
+        default=120.0,
+        help="Largest acceptable import time for coldstart commands, best of --coldstart-runs (default: 120)",
+    )
+    p.add_argument("--json", action="store_true", help="Print results as JSON")
+    awtrix_emulator.add_profile_args(p)
+    args = p.parse_args()
+    unknown = sorted(set(args.scenarios) - set(SCENARIOS))
+    if unknown:
+        p.error(f"unknown scenario: {', '.join(unknown)}")
+
+    profile = awtrix_emulator.profile_from_args(args)
+    benches: dict[str, Callable[[DeviceProfile, argparse.Namespace], list[Result]]] = {
+        "keepalive": bench_keepalive,
+        "upload": bench_upload,
+        "list": bench_list,
+        "delete": bench_delete,
+        "sync": bench_sync,
+        "backup": bench_backup,
+        "coldstart": bench_coldstart,
+    }
+    results: list[Result] = []
+    # Keep sync manifests and directory indexes away from the real cache.
+    with tempfile.TemporaryDirectory() as cache:
+        os.environ["AWTRIX_FS_CACHE_DIR"] = cache
+        for name in args.scenarios or SCENARIOS:
+            results += benches[name](profile, args)
+
+    failed = any(r.error for r in results)
+    if args.json:
+        print(json.dumps([{**dataclasses.asdict(r), "ops_per_sec": r.ops_per_sec, "mb_per_sec": r.mb_per_sec} for r in results], indent=2))
+        return 1 if failed else 0
+    print(f"{'scenario':16} {'ops':>6} {'seconds':>8} {'ops/s':>8} {'MB/s':>7} {'resets':>6} {'peak conns':>10}")
+    for r in results:
+        print(f"{r.name:16} {r.ops:6} {r.seconds:8.3f} {r.ops_per_sec:8.1f} {r.mb_per_sec:7.3f} {r.resets:6} {r.peak_connections:10}")
+        for note in r.notes:
+            print(f"{'':16} {note}")
+        if r.error:
+            print(f"{'':16} failed: {r.error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import posixpath
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DIRS = ("/ICONS", "/MELODIES", "/PALETTES", "/CUSTOMAPPS")
+SCREEN_WIDTH = 32
+SCREEN_HEIGHT = 8
+
+
+# Defaults are rough figures for an Ulanzi TC001 on a busy 2.4 GHz network; override them per benchmark.
+@dataclass
+class DeviceProfile:
+    flash_bytes: int = 1024 * 1024
+    block_size: int = 4096
+    # Network round trip plus web-server think time, paid by every request (concurrently).
+    latency: float = 0.015
+    # LittleFS write speed in bytes/s. There is one flash chip, so writes are serialized. 0 = unlimited.
+    write_bandwidth: float = 128 * 1024
+    # Sockets beyond this many are reset, as lwIP does when it runs out of connections. 0 = unlimited.
+    max_connections: int = 4
+    accept_delay: float = 0.005
+
+
+@dataclass
+class DeviceStats:
+    requests: dict[str, int] = field(default_factory=dict)
+    bytes_in: int = 0
+    bytes_out: int = 0
+    resets: int = 0
+    reboots: int = 0
+    peak_connections: int = 0
+
+
+def _parse_multipart(body: bytes, content_type: str) -> tuple[dict[str, str], list[tuple[str, bytes]]]:
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise ValueError("multipart body without boundary")
+    fields: dict[str, str] = {}
+    files: list[tuple[str, bytes]] = []
+    for part in body.split(b"--" + match.group(1).encode())[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, content = part.partition(b"\r\n\r\n")
+        if content.endswith(b"\r\n"):
+            content = content[:-2]
+        name = re.search(rb'[; ]name="([^"]*)"', head)
+        filename = re.search(rb'filename="([^"]*)"', head)
+        if filename:
+            files.append((filename.group(1).decode(), content))
+        elif name:
+            fields[name.group(1).decode()] = content.decode()
+    return fields, files
+
+
+class AwtrixEmulator:
+    def __init__(self, profile: DeviceProfile | None = None, files: dict[str, bytes] | None = None, bind: str = "127.0.0.1", port: int = 0) -> None:
+        self.profile = profile or DeviceProfile()
+        self.files: dict[str, bytes] = dict(files or {})
+        self.dirs: set[str] = {"/", *DEFAULT_DIRS}
+        for path in self.files:
+            self._add_parents(path)
+        self.stats = DeviceStats()
+        self.lock = threading.Lock()
+        self._flash = threading.Lock()
+        self._connections = 0
+        self._server = _EmulatorServer((bind, port), self)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def host(self) -> str:
+        address, port = self._server.server_address[:2]
+        return f"{address}:{port}"
+
+    def __enter__(self) -> "AwtrixEmulator":
+        return self.start()
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
+
+    def start(self) -> "AwtrixEmulator":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _add_parents(self, path: str) -> None:
+        parent = posixpath.dirname(path)
+        while parent not in self.dirs:
+            self.dirs.add(parent)
+            parent = posixpath.dirname(parent)
+
+    def _footprint(self, size: int) -> int:
+        return -(-size // self.profile.block_size) * self.profile.block_size
+
+    def used_bytes(self) -> int:
+        with self.lock:
+            return sum(self._footprint(len(data)) for data in self.files.values())
+
+    def status(self) -> dict[str, object]:
+        return {"totalBytes": self.profile.flash_bytes, "usedBytes": self.used_bytes(), "mode": "STA", "ssid": "emulator", "ip": 16777343}
+
+    def list_dir(self, dir_path: str) -> list[dict[str, str]]:
+        base = dir_path.rstrip("/") or "/"
+        with self.lock:
+            entries = [
+                {"type": "dir", "size": "0", "name": posixpath.basename(d)} for d in sorted(self.dirs) if d != "/" and posixpath.dirname(d) == base
+            ]
+            entries += [
+                {"type": "file", "size": str(len(data)), "name": posixpath.basename(path)}
+                for path, data in sorted(self.files.items())
+                if posixpath.dirname(path) == base
+            ]
+        return entries
+
+    def write(self, path: str, data: bytes) -> None:
+        with self.lock:
+            grow = self._footprint(len(data)) - self._footprint(len(self.files.get(path, b"")))
+            free = self.profile.flash_bytes - sum(self._footprint(len(d)) for d in self.files.values())
+        if grow > free:
+            raise OSError(f"No space left on device: need {grow} bytes, have {free}")
+        if self.profile.write_bandwidth:
+            with self._flash:
+                time.sleep(len(data) / self.profile.write_bandwidth)
+        with self.lock:
+            self.files[path] = data
+            self._add_parents(path)
+
+    def screen(self) -> list[int]:
+        # A dot sweeping the matrix twice a second, so watchers and recorders see changing frames.
+        tick = int(time.monotonic() * 2)
+        pixels = [0x000000] * (SCREEN_WIDTH * SCREEN_HEIGHT)
+        pixels[tick % len(pixels)] = 0xFF8000
+        return pixels
+
+
+class _EmulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], device: AwtrixEmulator) -> None:
+        self.device = device
+        super().__init__(address, _EmulatorHandler)
+
+    def process_request(self, request: socket.socket, client_address: tuple[str, int]) -> None:  # type: ignore[override]
+        device = self.device
+        with device.lock:
+            limit = device.profile.max_connections
+            if limit and device._connections >= limit:
+                device.stats.resets += 1
+                refuse = True
+            else:
+                device._connections += 1
+                device.stats.peak_connections = max(device.stats.peak_connections, device._connections)
+                refuse = False
+        if refuse:
+            # SO_LINGER 0 turns close() into a RST, which is what clients see from an overloaded ESP32.
+            request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            request.close()
+            return
+        super().process_request(request, client_address)
+
+    def handle_error(self, request: socket.socket, client_address: tuple[str, int]) -> None:  # type: ignore[override]
+        # Clients giving up on a socket are part of the workload, not emulator bugs.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def process_request_thread(self, request: socket.socket, client_address: tuple[str, int]) -> None:  # type: ignore[override]
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.device.lock:
+                self.device._connections -= 1
+
+
+class _EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: _EmulatorServer
+
+    def setup(self) -> None:
+        time.sleep(self.server.device.profile.accept_delay)
+        super().setup()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _begin(self) -> bytes:
+        device = self.server.device
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            body = bytearray(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        with device.lock:
+            device.stats.requests[self.command] = device.stats.requests.get(self.command, 0) + 1
+            device.stats.bytes_in += len(body)
+        time.sleep(device.profile.latency)
+        return bytes(body)
+
+    def _reply(self, status: int, body: bytes, content_type: str = "text/plain") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.device.lock:
+            self.server.device.stats.bytes_out += len(body)
+
+    def _json(self, payload: object) -> None:
+        self._reply(200, json.dumps(payload).encode(), "application/json")
+
+    def _form(self, body: bytes) -> tuple[dict[str, str], list[tuple[str, bytes]]]:
+        return _parse_multipart(body, self.headers.get("Content-Type", ""))
+
+    def do_GET(self) -> None:
+        self._begin()
+        device = self.server.device
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path == "/status":
+            self._json(device.status())
+        elif parts.path == "/version":
+            self._reply(200, b"0.98")
+        elif parts.path == "/list":
+            self._json(device.list_dir(urllib.parse.parse_qs(parts.query).get("dir", ["/"])[0]))
+        elif parts.path == "/api/screen":
+            self._json(device.screen())
+        else:
+            data = device.files.get(urllib.parse.unquote(parts.path))
+            if data is None:
+                self._reply(404, b"Not Found")
+            else:
+                self._reply(200, data, "application/octet-stream")
+
+    def do_POST(self) -> None:
+        body = self._begin()
+        device = self.server.device
+        if self.path == "/api/reboot":
+            with device.lock:
+                device.stats.reboots += 1
+            self._reply(200, b"OK")
+            return
+        if self.path != "/edit":
+            self._reply(404, b"Not Found")
+            return
+        _, files = self._form(body)
+        if not files:
+            self._reply(400, b"BAD ARGS")
+            return
+        try:
+            for path, data in files:
+                device.write(path, data)
+        except OSError as exc:
+            self._reply(500, str(exc).encode())
+            return
+        self._reply(200, b"OK")
+
+    def do_PUT(self) -> None:
+        fields, _ = self._form(self._begin())
+        device = self.server.device
+        path = fields.get("path", "")
+        if self.path != "/edit" or not path.startswith("/"):
+            self._reply(400, b"BAD PATH")
+            return
+        if "src" in fields:
+            # Decide under the lock, reply after it: _reply takes the lock again to count bytes_out.
+            with device.lock:
+                found = path in device.files
+                if found:
+                    device.files[fields["src"]] = device.files.pop(path)
+                    device._add_parents(fields["src"])
+            if not found:
+                self._reply(404, b"FILE NOT EXISTS")
+                return
+        else:
+            device.write(path, b"")
+        self._reply(200, b"OK")
+
+    def do_DELETE(self) -> None:
+        fields, _ = self._form(self._begin())
+        device = self.server.device
+        path = fields.get("path", "")
+        with device.lock:
+            found = device.files.pop(path, None) is not None
+        if not found:
+            self._reply(404, b"FILE NOT EXISTS")
+            return
+        self._reply(200, b"OK")
+
+
+def add_profile_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--flash-kb", type=int, default=1024, help="Flash size in KiB (default: 1024)")
+    p.add_argument("--latency-ms", type=float, default=15.0, help="Delay added to every request (default: 15)")
+    p.add_argument("--write-kbps", type=float, default=128.0, help="Flash write bandwidth in KiB/s, 0 = unlimited (default: 128)")
+    p.add_argument("--max-connections", type=int, default=4, help="Reset sockets beyond this many, 0 = unlimited (default: 4)")
+    p.add_argument("--accept-delay-ms", type=float, default=5.0, help="Delay per new connection (default: 5)")
+
+
+def profile_from_args(args: argparse.Namespace) -> DeviceProfile:
+    return DeviceProfile(
+        flash_bytes=args.flash_kb * 1024,
+        latency=args.latency_ms / 1000,
+        write_bandwidth=args.write_kbps * 1024,
+        max_connections=args.max_connections,
+        accept_delay=args.accept_delay_ms / 1000,
+    )
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Run an in-memory AWTRIX 3 HTTP filesystem emulator")
+    p.add_argument("--bind", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    p.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    add_profile_args(p)
+    p.add_argument("--icons", type=int, default=0, help="Pre-populate /ICONS with this many 1 KiB files")
+    args = p.parse_args()
+
+    profile = profile_from_args(args)
+    files = {f"/ICONS/{i}.gif": bytes(1024) for i in range(args.icons)}
+    with AwtrixEmulator(profile, files, bind=args.bind, port=args.port) as device:
+        print(device.host, flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        stats = device.stats
+        print(f"requests {stats.requests}, in {stats.bytes_in} B, out {stats.bytes_out} B, resets {stats.resets}, peak connections {stats.peak_connections}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,20 +1,57 @@
 #!/usr/bin/env python3
 import argparse
+import array
+import contextvars
+import errno
+import http.client
 import json
+import math
 import os
-import subprocess
+import posixpath
+import re
+import socket
+import ssl
 import sys
-import urllib.error
+import threading
+import time
 import urllib.parse
-import urllib.request
-import venv
-from dataclasses import dataclass
-from io import BytesIO
-from typing import Iterable
-from uuid import uuid4
+import weakref
+from collections import deque
+from io import BytesIO, StringIO
+from typing import TYPE_CHECKING, Awaitable, BinaryIO, Callable, Iterable, Iterator, NamedTuple, TypeVar
+
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import Executor
+
+    import awtrix_image
 
 
 LAMETRIC_THUMB_URL = "https://developer.lametric.com/content/apps/icon_thumbs/{id}"
+LAMETRIC_CACHE_MAX_BYTES = 32 * 1024 * 1024
+LAMETRIC_CACHE_MAX_AGE = 7 * 24 * 3600
+JPEG_CONVERSION_KEY = "jpeg:q95"
+# How far into a JPEG to look for its frame header before giving up on streaming it unchanged.
+LAMETRIC_SNIFF_LIMIT = 64 * 1024
+GIF_CONVERSION_KEY = "gif"
+LITTLEFS_BLOCK_SIZE = 4096
+FS_INDEX_TTL = 60.0
+SCREEN_WIDTH = 32
+SCREEN_HEIGHT = 8
+SCREEN_IDLE_AFTER = 10.0
+SCREEN_STREAM_KEEPALIVE = 5.0
+SCREEN_WATCH_SAMPLES = 4096
+AIMD_MAX_CONCURRENCY = 6
+AIMD_DECREASE = 0.5
+# A response slower than this multiple of the fastest one seen (per method) means requests are queueing on the device.
+AIMD_LATENCY_FACTOR = 2.0
+AIMD_LATENCY_SLACK = 0.005
+AIMD_PROBE_SLOWDOWN = 16
+AIMD_RETRIES = 3
+AIMD_BACKOFF = 0.05
+AIMD_REPORT_MIN_REQUESTS = 8
+
+T = TypeVar("T")
 
 
 def eprint(*args: object) -> None:
@@ -27,20 +64,346 @@ def require_leading_slash(path: str) -> str:
     return path
 
 
-def _http_request(method: str, url: str, headers: dict[str, str] | None = None, body: bytes | None = None) -> bytes:
-    req = urllib.request.Request(url, data=body, method=method)
-    if headers:
-        for k, v in headers.items():
-            req.add_header(k, v)
+class MultipartFile(NamedTuple):
+    field_name: str
+    filename: str
+    content_type: str
+    data: bytes | None = None
+    path: str | None = None
+    # Read once while the request is sent; `length` must be exact because the device needs a Content-Length.
+    stream: "LametricDownload | BinaryIO | None" = None
+    length: int = 0
+
+    @property
+    def size(self) -> int:
+        if self.stream is not None:
+            return self.length
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return len(self.data or b"")
+
+
+class MultipartBody:
+    def __init__(self, boundary: str, segments: list[bytes | MultipartFile], chunk_size: int = 64 * 1024) -> None:
+        self.boundary = boundary
+        self.chunk_size = chunk_size
+        self._segments = segments
+        # Sizes are fixed here because Content-Length is sent before any file is read.
+        self._sizes = [len(seg) if isinstance(seg, bytes) else seg.size for seg in segments]
+        self._length = sum(self._sizes)
+        self._streamed = False
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def blocking(self) -> bool:
+        return any(not isinstance(seg, bytes) and seg.stream is not None for seg in self._segments)
+
+    @property
+    def replayable(self) -> bool:
+        return not self._streamed
+
+    def _pieces(self) -> Iterator[bytes]:
+        for seg, size in zip(self._segments, self._sizes):
+            if isinstance(seg, bytes):
+                yield seg
+            elif seg.stream is not None:
+                self._streamed = True
+                sent = 0
+                while sent < seg.length:
+                    chunk = seg.stream.read(min(self.chunk_size, seg.length - sent))
+                    if not chunk:
+                        raise RuntimeError(f"{seg.filename}: source ended after {sent} of {seg.length} bytes")
+                    sent += len(chunk)
+                    yield chunk
+            elif seg.path is None:
+                yield seg.data or b""
+            else:
+                expected, sent = size, 0
+                with open(seg.path, "rb") as f:
+                    while chunk := f.read(self.chunk_size):
+                        sent += len(chunk)
+                        yield chunk
+                if sent != expected:
+                    raise RuntimeError(f"{seg.path} changed size during upload ({expected} -> {sent} bytes)")
+
+    def __iter__(self) -> Iterator[bytes]:
+        # Coalesce small pieces so short forms go out in one write; large pieces pass through without copying.
+        buf = bytearray()
+        for piece in self._pieces():
+            if len(buf) + len(piece) <= self.chunk_size:
+                buf += piece
+                continue
+            if buf:
+                yield bytes(buf)
+                buf.clear()
+            if len(piece) >= self.chunk_size:
+                yield piece
+            else:
+                buf += piece
+        if buf:
+            yield bytes(buf)
+
+
+def _encode_multipart(fields: dict[str, str], files: Iterable[MultipartFile]) -> MultipartBody:
+    from uuid import uuid4
+
+    boundary = f"----awtrixfs-{uuid4().hex}"
+    segments: list[bytes | MultipartFile] = []
+    pending: list[str] = []
+
+    for name, value in fields.items():
+        pending.append(f"--{boundary}\r\n")
+        pending.append(f'Content-Disposition: form-data; name="{name}"\r\n\r\n')
+        pending.append(f"{value}\r\n")
+
+    for f in files:
+        pending.append(f"--{boundary}\r\n")
+        pending.append(
+            f'Content-Disposition: form-data; name="{f.field_name}"; filename="{f.filename}"\r\n'
+            f"Content-Type: {f.content_type}\r\n\r\n"
+        )
+        segments.append("".join(pending).encode("utf-8"))
+        segments.append(f)
+        pending = ["\r\n"]
+
+    pending.append(f"--{boundary}--\r\n")
+    segments.append("".join(pending).encode("utf-8"))
+    return MultipartBody(boundary, segments)
+
+
+def _replayable(body: bytes | MultipartBody | None) -> bool:
+    return not isinstance(body, MultipartBody) or body.replayable
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    def connect(self) -> None:
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    def connect(self) -> None:
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class RequestTiming:
+    # perf_counter() marks, curl style: each is measured from `started`.
+    __slots__ = ("started", "reused", "connected", "sent", "first_byte")
+
+    def __init__(self, started: float, reused: bool = False) -> None:
+        self.started = started
+        self.reused = reused
+        self.connected: float | None = None
+        self.sent: float | None = None
+        self.first_byte: float | None = None
+
+
+_TRACE_ENDPOINTS = ("/status", "/list", "/edit", "/version", "/api/")
+
+
+def _trace_endpoint(method: str, target: str) -> str:
+    path = target.split("?", 1)[0]
+    for prefix in _TRACE_ENDPOINTS:
+        if path == prefix or (prefix.endswith("/") and path.startswith(prefix)):
+            return f"{method} {path}"
+    return f"{method} <file>"
+
+
+class RequestTracer:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fp = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        # endpoint -> (total ms, first-byte ms or None when no response arrived, failed)
+        self._samples: dict[str, list[tuple[float, float | None, bool]]] = {}
+
+    def record(
+        self,
+        origin: str,
+        method: str,
+        target: str,
+        request_bytes: int,
+        timing: RequestTiming,
+        status: int | None = None,
+        response_bytes: int = 0,
+        error: BaseException | None = None,
+    ) -> None:
+        now = time.perf_counter()
+
+        def ms(mark: float | None) -> float | None:
+            return None if mark is None else round((mark - timing.started) * 1000, 3)
+
+        entry = {
+            "ts": round(time.time(), 3),
+            "host": urllib.parse.urlsplit(origin).netloc,
+            "method": method,
+            "path": urllib.parse.unquote(target),
+            "status": status,
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+            "reused": timing.reused,
+            "connect_ms": ms(timing.connected),
+            "sent_ms": ms(timing.sent),
+            "first_byte_ms": ms(timing.first_byte),
+            "total_ms": ms(now),
+        }
+        if error is not None:
+            entry["error"] = str(error) or type(error).__name__
+        failed = error is not None or (status or 0) >= 400
+        line = json.dumps(entry)
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+            self._samples.setdefault(_trace_endpoint(method, target), []).append(
+                (entry["total_ms"], entry["first_byte_ms"], failed)  # type: ignore[arg-type]
+            )
+
+    def close(self) -> None:
+        if self._fp is not sys.stderr:
+            self._fp.close()
+        if not self._samples:
+            return
+        width = max(len("endpoint"), *map(len, self._samples))
+        eprint(f"{'endpoint':{width}} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'ttfb p50':>8}")
+        for endpoint, samples in sorted(self._samples.items()):
+            totals = [total for total, _, _ in samples]
+            first = [fb for _, fb, _ in samples if fb is not None]
+            errors = sum(1 for *_, failed in samples if failed)
+            ttfb = f"{_percentile(first, 50):8.1f}" if first else f"{'-':>8}"
+            eprint(
+                f"{endpoint:{width}} {len(samples):6} {errors:6} {_percentile(totals, 50):8.1f} {_percentile(totals, 90):8.1f} "
+                f"{_percentile(totals, 99):8.1f} {max(totals):8.1f} {ttfb}"
+            )
+
+
+_TRACER: RequestTracer | None = None
+
+
+def _trace(
+    origin: str,
+    method: str,
+    target: str,
+    body: bytes | MultipartBody | None,
+    timing: RequestTiming,
+    status: int | None = None,
+    response_bytes: int = 0,
+    error: BaseException | None = None,
+) -> None:
+    if _TRACER is not None:
+        _TRACER.record(origin, method, target, len(body) if body is not None else 0, timing, status, response_bytes, error)
+
+
+class _ConnectionPool:
+    _RETRYABLE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+    def __init__(self, origin: str, size: int = 2, timeout: float = 30) -> None:
+        parts = urllib.parse.urlsplit(origin)
+        self.origin = origin
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname or ""
+        self._port = parts.port
+        self._timeout = timeout
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._https:
+            return _HTTPSConnection(self._host, self._port, timeout=self._timeout)
+        return _HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+    def _checkout(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def request(self, method: str, target: str, headers: dict[str, str] | None = None, body: bytes | MultipartBody | None = None) -> tuple[int, str, bytes]:
+        with self._slots:
+            while True:
+                conn, reused = self._checkout()
+                timing = RequestTiming(time.perf_counter(), reused)
+                try:
+                    if not reused:
+                        conn.connect()
+                        timing.connected = time.perf_counter()
+                    conn.request(method, target, body=body, headers=headers or {})
+                    timing.sent = time.perf_counter()
+                    resp = conn.getresponse()
+                    timing.first_byte = time.perf_counter()
+                    payload = resp.read()
+                except self._RETRYABLE as exc:
+                    conn.close()
+                    _trace(self.origin, method, target, body, timing, error=exc)
+                    # The device dropped an idle keep-alive socket before reading the request; reconnect once.
+                    if reused and _replayable(body):
+                        continue
+                    raise
+                except BaseException as exc:
+                    conn.close()
+                    _trace(self.origin, method, target, body, timing, error=exc)
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._checkin(conn)
+                _trace(self.origin, method, target, body, timing, resp.status, len(payload))
+                return resp.status, resp.reason, payload
+
+
+_POOLS: dict[str, _ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _pool_for(origin: str) -> _ConnectionPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(origin)
+        if pool is None:
+            pool = _POOLS[origin] = _ConnectionPool(origin)
+        return pool
+
+
+# Per-device request count and body bytes (sent, received), keyed by netloc; fleet runs report the difference.
+_TRAFFIC: dict[str, tuple[int, int, int]] = {}
+_TRAFFIC_LOCK = threading.Lock()
+
+
+def _count_traffic(netloc: str, sent: int, received: int) -> None:
+    with _TRAFFIC_LOCK:
+        requests, total_sent, total_received = _TRAFFIC.get(netloc, (0, 0, 0))
+        _TRAFFIC[netloc] = (requests + 1, total_sent + sent, total_received + received)
+
+
+def _http_request(method: str, url: str, headers: dict[str, str] | None = None, body: bytes | MultipartBody | None = None) -> bytes:
+    parts = urllib.parse.urlsplit(url)
+    target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+    pool = _pool_for(f"{parts.scheme}://{parts.netloc}")
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return resp.read()
-    except urllib.error.HTTPError as exc:
-        payload = exc.read()
-        msg = payload.decode("utf-8", errors="replace").strip()
-        raise RuntimeError(f"HTTP {exc.code} {method} {url}: {msg or exc.reason}") from exc
-    except urllib.error.URLError as exc:
+        status, reason, payload = pool.request(method, target, headers=headers, body=body)
+    except (OSError, http.client.HTTPException) as exc:
         raise RuntimeError(f"Request failed {method} {url}: {exc}") from exc
+    _count_traffic(parts.netloc, len(body) if body is not None else 0, len(payload))
+    _raise_for_status(method, url, status, reason, payload)
+    return payload
+
+
+def _raise_for_status(method: str, url: str, status: int, reason: str, payload: bytes) -> None:
+    if status >= 400:
+        msg = payload.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"HTTP {status} {method} {url}: {msg or reason}")
 
 
 def _http_get_json(url: str) -> object:
@@ -48,43 +411,268 @@ def _http_get_json(url: str) -> object:
     return json.loads(raw.decode("utf-8", errors="strict"))
 
 
-def _parse_content_type(value: str | None) -> str:
-    if not value:
-        return ""
-    return value.split(";", 1)[0].strip().lower()
+def _concurrency_state_path(origin: str) -> str:
+    return os.path.join(_cache_dir("concurrency"), f"{_host_slug(origin)}.json")
 
 
-@dataclass(frozen=True)
-class MultipartFile:
-    field_name: str
-    filename: str
-    content_type: str
-    data: bytes
+class ConcurrencyController:
+    # AIMD: one more in-flight request per window of healthy responses, half as many after a reset or timeout.
+    def __init__(self, origin: str, fixed: int | None = None, maximum: int = AIMD_MAX_CONCURRENCY) -> None:
+        import asyncio
 
+        self.origin = origin
+        self.adaptive = fixed is None
+        self.maximum = max(1, fixed or maximum)
+        if fixed is None:
+            # Start where the last run against this device settled.
+            saved = _load_json_file(_concurrency_state_path(origin), {})
+            initial = float(saved.get("limit", 2)) if isinstance(saved, dict) else 2.0
+        else:
+            initial = float(fixed)
+        self.limit = min(float(self.maximum), max(1.0, initial))
+        self.peak = self.limit
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.cuts = 0
+        self.started = time.monotonic()
+        self._fastest: dict[str, float] = {}
+        self._last_cut = 0.0
+        self._cut_at = float(self.maximum)
+        self._cond = asyncio.Condition()
 
-def _encode_multipart(fields: dict[str, str], files: Iterable[MultipartFile]) -> tuple[bytes, str]:
-    boundary = f"----awtrixfs-{uuid4().hex}"
-    chunks: list[bytes] = []
+    @property
+    def window(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> float:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.window)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, method: str, started: float, healthy: bool | None) -> None:
+        latency = time.monotonic() - started
+        async with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if healthy:
+                self._healthy(method, latency)
+            elif healthy is False:
+                self._congested(started)
+            self._cond.notify_all()
+
+    def _healthy(self, method: str, latency: float) -> None:
+        fastest = min(latency, self._fastest.get(method, latency))
+        self._fastest[method] = fastest
+        if self.adaptive and latency <= AIMD_LATENCY_FACTOR * fastest + AIMD_LATENCY_SLACK:
+            # Approach the level of the last failure slowly, so a device at its limit is not reset every few requests.
+            step = 1 / self.limit if self.limit + 1 < self._cut_at else 1 / (self.limit * AIMD_PROBE_SLOWDOWN)
+            self.limit = min(float(self.maximum), self.limit + step)
+            self.peak = max(self.peak, self.limit)
+
+    def _congested(self, started: float) -> None:
+        self.failures += 1
+        # Requests sent before the last cut belong to the same burst; cutting again for each would collapse to 1.
+        if self.adaptive and started >= self._last_cut:
+            self._cut_at = self.limit
+            self.limit = max(1.0, self.limit * AIMD_DECREASE)
+            self._last_cut = time.monotonic()
+            self.cuts += 1
+
+    def finish(self) -> None:
+        if not self.adaptive or self.requests < AIMD_REPORT_MIN_REQUESTS:
+            return
+        elapsed = time.monotonic() - self.started
+        _save_json_file(_concurrency_state_path(self.origin), {"limit": round(self.limit, 2), "updated": int(time.time())})
+        eprint(
+            f"concurrency {urllib.parse.urlsplit(self.origin).netloc}: {self.requests} requests at "
+            f"{self.requests / elapsed if elapsed else 0:.1f} req/s, settled at {self.window} in flight "
+            f"(peak {int(self.peak)}, {self.cuts} cuts, {self.failures} retried)"
+        )
 
-    def add(s: str) -> None:
-        chunks.append(s.encode("utf-8"))
 
-    for name, value in fields.items():
-        add(f"--{boundary}\r\n")
-        add(f'Content-Disposition: form-data; name="{name}"\r\n\r\n')
-        add(f"{value}\r\n")
+class _AsyncConnectionPool:
+    def __init__(self, origin: str, controller: ConcurrencyController, timeout: float = 30) -> None:
+        import asyncio
+
+        parts = urllib.parse.urlsplit(origin)
+        self.origin = origin
+        self.controller = controller
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname or ""
+        self._port = parts.port or (443 if self._https else 80)
+        self._host_header = parts.netloc
+        self._timeout = timeout
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._closed = False
+
+    async def _connect(self) -> "tuple[asyncio.StreamReader, asyncio.StreamWriter]":
+        import asyncio
+
+        ssl_ctx = ssl.create_default_context() if self._https else None
+        try:
+            return await asyncio.open_connection(self._host, self._port, ssl=ssl_ctx)
+        except OSError as exc:
+            # asyncio reports a reset during connect (an ESP32 out of sockets) as a plain OSError.
+            if exc.errno in (errno.ECONNRESET, errno.ECONNABORTED) and not isinstance(exc, ConnectionError):
+                raise ConnectionResetError(exc.errno, exc.strerror or str(exc)) from exc
+            raise
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.controller.finish()
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def request(self, method: str, target: str, headers: dict[str, str] | None = None, body: bytes | MultipartBody | None = None) -> tuple[int, str, bytes]:
+        import asyncio
+
+        attempt = 0
+        while True:
+            started = await self.controller.acquire()
+            healthy: bool | None = None
+            try:
+                result = await self._request_once(method, target, headers, body)
+                healthy = True
+                return result
+            except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                # Resets and timeouts mean the device is overloaded: shrink the window, back off and retry.
+                healthy = False
+                if attempt == AIMD_RETRIES or not _replayable(body):
+                    raise
+            finally:
+                await self.controller.release(method, started, healthy)
+            await asyncio.sleep(AIMD_BACKOFF * 2**attempt)
+            attempt += 1
+
+    async def _request_once(
+        self, method: str, target: str, headers: dict[str, str] | None, body: bytes | MultipartBody | None
+    ) -> tuple[int, str, bytes]:
+        import asyncio
+
+        while True:
+            timing = RequestTiming(time.perf_counter(), bool(self._idle))
+            try:
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    conn = await asyncio.wait_for(self._connect(), self._timeout)
+                    timing.connected = time.perf_counter()
+            except BaseException as exc:
+                _trace(self.origin, method, target, body, timing, error=exc)
+                raise
+            try:
+                status, reason, payload, keep_alive = await asyncio.wait_for(
+                    self._exchange(conn, method, target, headers or {}, body, timing), self._timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                conn[1].close()
+                _trace(self.origin, method, target, body, timing, error=exc)
+                # The device dropped an idle keep-alive socket before reading the request; reconnect once.
+                if timing.reused and _replayable(body):
+                    continue
+                raise
+            except BaseException as exc:
+                conn[1].close()
+                _trace(self.origin, method, target, body, timing, error=exc)
+                raise
+            _trace(self.origin, method, target, body, timing, status, len(payload))
+            # Idle sockets still count against the device's connection limit, so keep no more than the window.
+            if keep_alive and len(self._idle) < self.controller.window:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+            return status, reason, payload
+
+    async def _exchange(
+        self,
+        conn: "tuple[asyncio.StreamReader, asyncio.StreamWriter]",
+        method: str,
+        target: str,
+        headers: dict[str, str],
+        body: bytes | MultipartBody | None,
+        timing: RequestTiming,
+    ) -> tuple[int, str, bytes, bool]:
+        reader, writer = conn
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self._host_header}", "Connection: keep-alive"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        if "content-length" not in {k.lower() for k in headers} and (body is not None or method in ("POST", "PUT", "DELETE")):
+            lines.append(f"Content-Length: {len(body or b'')}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        chunks = iter([body] if isinstance(body, bytes) else body or ())
+        if isinstance(body, MultipartBody) and body.blocking:
+            # Streamed parts come from another socket; keep those reads off the event loop.
+            while (chunk := await _run_in_executor(None, next, chunks, None)) is not None:
+                writer.write(chunk)
+                await writer.drain()
+        else:
+            for chunk in chunks:
+                writer.write(chunk)
+                await writer.drain()
+        await writer.drain()
+        timing.sent = time.perf_counter()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Remote end closed connection without response")
+        timing.first_byte = time.perf_counter()
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+        resp_headers: dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            resp_headers[key.strip().lower()] = value.strip()
+
+        connection = resp_headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+        if method == "HEAD" or int(status) in (204, 304):
+            payload = b""
+        elif resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            parts: list[bytes] = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            payload = b"".join(parts)
+        elif "content-length" in resp_headers:
+            payload = await reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            payload = await reader.read()
+            keep_alive = False
+        return int(status), reason, payload, keep_alive
+
+
+_ASYNC_POOLS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, _AsyncConnectionPool]]" = weakref.WeakKeyDictionary()
+
+
+def _async_pool_for(origin: str, concurrency: int | None, maximum: int) -> _AsyncConnectionPool:
+    import asyncio
+
+    pools = _ASYNC_POOLS.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(origin)
+    if pool is None:
+        pool = pools[origin] = _AsyncConnectionPool(origin, ConcurrencyController(origin, concurrency, maximum))
+    return pool
 
-    for f in files:
-        add(f"--{boundary}\r\n")
-        add(
-            f'Content-Disposition: form-data; name="{f.field_name}"; filename="{f.filename}"\r\n'
-            f"Content-Type: {f.content_type}\r\n\r\n"
-        )
-        chunks.append(f.data)
-        add("\r\n")
 
-    add(f"--{boundary}--\r\n")
-    return b"".join(chunks), boundary
+def _parse_content_type(value: str | None) -> str:
+    if not value:
+        return ""
+    return value.split(";", 1)[0].strip().lower()
 
 
 def _content_type_for_path(path: str) -> str:
@@ -98,18 +686,112 @@ def _content_type_for_path(path: str) -> str:
     return "application/octet-stream"
 
 
-def _ensure_pillow() -> None:
+def _cache_dir(*parts: str) -> str:
+    root = os.environ.get(
+        "AWTRIX_FS_CACHE_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"),
+    )
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _host_slug(host: str) -> str:
+    netloc = urllib.parse.urlsplit(host if "://" in host else f"http://{host}").netloc
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", netloc) or "default"
+
+
+def _load_json_file(path: str, default: object) -> object:
     try:
-        import PIL  # noqa: F401
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        eprint(f"Ignoring corrupt state file {path}")
+        return default
+
+
+def _tmp_path(path: str) -> str:
+    # Unique per writer, so threads and processes saving the same file never rename each other's temp file away.
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
 
-        return
-    except Exception:
-        pass
 
-    venv_dir = os.environ.get(
+def _save_json_file(path: str, data: object) -> None:
+    tmp = _tmp_path(path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _device_state_path(host: str) -> str:
+    # Last known content hash of every file this tool wrote to (or read from) the device, keyed by remote path.
+    return os.path.join(_cache_dir("sync"), f"{_host_slug(host)}.json")
+
+
+_DEVICE_STATES: dict[str, dict[str, dict[str, object]]] = {}
+
+
+def _device_state(host: str) -> dict[str, dict[str, object]]:
+    # One shared copy per host, so every client mutation invalidates what sync and restore later trust.
+    state = _DEVICE_STATES.get(host)
+    if state is None:
+        state = _DEVICE_STATES[host] = _load_json_file(_device_state_path(host), {})  # type: ignore[assignment]
+    return state
+
+
+def _save_device_state(host: str) -> None:
+    _save_json_file(_device_state_path(host), _device_state(host))
+
+
+def _sha256_file(path: str) -> str:
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pillow_venv_dir() -> str:
+    return os.environ.get(
         "AWTRIX_FS_VENV_DIR",
-        os.path.join(os.path.dirname(os.path.dirname(__file__)), ".venv"),
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".venv"),
     )
+
+
+def _venv_site_packages(venv_dir: str) -> str:
+    if os.name == "nt":
+        return os.path.join(venv_dir, "Lib", "site-packages")
+    return os.path.join(venv_dir, "lib", f"python{sys.version_info.major}.{sys.version_info.minor}", "site-packages")
+
+
+def _pillow_marker_path(venv_dir: str) -> str:
+    return os.path.join(venv_dir, "awtrix-fs-pillow.json")
+
+
+def _activate_pillow_venv(venv_dir: str) -> bool:
+    marker = _load_json_file(_pillow_marker_path(venv_dir), None)
+    if not isinstance(marker, dict) or marker.get("python") != f"{sys.version_info.major}.{sys.version_info.minor}":
+        return False
+    site_dir = str(marker.get("site_packages", ""))
+    if not os.path.isdir(site_dir):
+        return False
+    if site_dir not in sys.path:
+        sys.path.insert(0, site_dir)
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def provision_pillow(upgrade: bool = False) -> str:
+    import subprocess
+    import venv
+
+    venv_dir = _pillow_venv_dir()
     venv_python = os.path.join(venv_dir, "bin", "python")
     venv_pip = os.path.join(venv_dir, "bin", "pip")
 
@@ -117,30 +799,69 @@ def _ensure_pillow() -> None:
         eprint(f"Creating venv at {venv_dir} for Pillow...")
         venv.EnvBuilder(with_pip=True, clear=False).create(venv_dir)
 
-    eprint("Pillow is required for PNG/JPEG -> JPG conversion; installing into venv...")
+    eprint("Installing Pillow into venv...")
     try:
-        subprocess.check_call([venv_pip, "install", "Pillow"])
+        subprocess.check_call([venv_pip, "install", *(["--upgrade"] if upgrade else []), "Pillow"])
     except Exception as exc:
         raise RuntimeError(
             f"Failed to install Pillow into venv at {venv_dir}. "
             f"Try: {venv_pip} install Pillow"
         ) from exc
 
+    site_dir = _venv_site_packages(venv_dir)
+    if not os.path.isdir(site_dir):
+        raise RuntimeError(f"Installed Pillow but failed to locate site-packages in {venv_dir}")
+    if site_dir not in sys.path:
+        sys.path.insert(0, site_dir)
+    import PIL
+
+    _save_json_file(
+        _pillow_marker_path(venv_dir),
+        {
+            "python": f"{sys.version_info.major}.{sys.version_info.minor}",
+            "site_packages": site_dir,
+            "pillow": PIL.__version__,
+        },
+    )
+    return PIL.__version__
+
+
+def _pillow_importable() -> bool:
     try:
-        site_dir = (
-            subprocess.check_output(
-                [venv_python, "-c", "import site; print(site.getsitepackages()[0])"],
-                text=True,
-            )
-            .strip()
-        )
-        if site_dir and site_dir not in sys.path:
-            sys.path.insert(0, site_dir)
-    except Exception as exc:
-        raise RuntimeError(f"Installed Pillow but failed to locate site-packages in {venv_dir}") from exc
+        import PIL  # noqa: F401
+
+        return True
+    except Exception:
+        pass
+    # Steady state: the marker written by provision_pillow() points straight at site-packages, no subprocesses.
+    return _activate_pillow_venv(_pillow_venv_dir())
 
 
-def _convert_to_jpeg(image_bytes: bytes) -> bytes:
+_PILLOW_ERROR: Exception | None = None
+_PILLOW_LOCK = threading.Lock()
+
+
+def _ensure_pillow() -> None:
+    global _PILLOW_ERROR
+    if _pillow_importable():
+        return
+    # Fleet runs convert on several threads at once; only one of them may build the shared venv.
+    with _PILLOW_LOCK:
+        if _pillow_importable():
+            return
+        if _PILLOW_ERROR is not None:
+            # Provisioning already failed in this process; retrying per image would rerun venv and pip every time.
+            raise RuntimeError(f"Pillow is not available: {_PILLOW_ERROR}")
+
+        eprint("Pillow is required for PNG/JPEG -> JPG conversion (run the 'setup' command ahead of time to avoid this delay)")
+        try:
+            provision_pillow()
+        except Exception as exc:
+            _PILLOW_ERROR = exc
+            raise
+
+
+def _pillow_encode(image_bytes: bytes, image_format: str, **options: object) -> bytes:
     _ensure_pillow()
     from PIL import Image  # type: ignore
 
@@ -153,15 +874,535 @@ def _convert_to_jpeg(image_bytes: bytes) -> bytes:
             rgb = bg.convert("RGB")
         else:
             rgb = img.convert("RGB")
+    out = BytesIO()
+    rgb.save(out, format=image_format, optimize=True, **options)
+    return out.getvalue()
+
+
+def _convert_to_jpeg(image_bytes: bytes) -> bytes:
+    import awtrix_image
+
+    try:
+        return awtrix_image.to_jpeg(image_bytes, quality=95)
+    except awtrix_image.UnsupportedImage:
+        pass
+    return _pillow_encode(image_bytes, "JPEG", quality=95)
+
+
+def _convert_to_gif(image_bytes: bytes) -> bytes:
+    import awtrix_image
+
+    try:
+        return awtrix_image.to_gif(image_bytes)
+    except awtrix_image.UnsupportedImage:
+        pass
+    return _pillow_encode(image_bytes, "GIF")
+
+
+def _pillow_animation(image_bytes: bytes, max_width: int, max_height: int) -> tuple["awtrix_image.Animation", tuple[int, int]]:
+    import awtrix_image
+
+    _ensure_pillow()
+    from PIL import Image, ImageSequence  # type: ignore
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        source_size = img.size
+        size = awtrix_image.fit_size(img.width, img.height, max_width, max_height)
+        frames: list[tuple[bytes, int]] = []
+        for frame in ImageSequence.Iterator(img):
+            rgba = frame.convert("RGBA")
+            if rgba.size != size:
+                rgba = rgba.resize(size, Image.BOX)
+            bg = Image.new("RGBA", size, (0, 0, 0, 255))
+            bg.alpha_composite(rgba)
+            frames.append((bg.convert("RGB").tobytes(), int(frame.info.get("duration") or 0)))
+    return awtrix_image.Animation(size[0], size[1], frames), source_size
+
+
+def _optimize_image(image_bytes: bytes, out_format: str, options: "awtrix_image.OptimizeOptions") -> bytes:
+    import awtrix_image
+
+    try:
+        return awtrix_image.optimize(image_bytes, out_format, options)
+    except awtrix_image.UnsupportedImage:
+        pass
+    anim, source_size = _pillow_animation(image_bytes, options.max_width, options.max_height)
+    original = image_bytes if (anim.width, anim.height) == source_size else b""
+    return awtrix_image.encode_optimized(anim, out_format, options, original=original)
+
+
+def _image_format_for_path(path: str) -> str | None:
+    return {".gif": "gif", ".jpg": "jpeg", ".jpeg": "jpeg"}.get(posixpath.splitext(path)[1].lower())
+
+
+def _content_length(value: str | None) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LametricDownload:
+    # One front-to-back read of an icon body, from disk or the network. A network body is copied into the cache
+    # as it streams through, and committed only once it has been read to the end.
+    def __init__(
+        self,
+        fp: BinaryIO,
+        content_type: str,
+        length: int | None,
+        cache_path: str | None = None,
+        commit: Callable[[str, str, int], None] | None = None,
+    ) -> None:
+        import hashlib
+
+        self.content_type = content_type
+        self.length = length
+        self._fp = fp
+        self._buffer = b""
+        self._received = 0
+        self._eof = False
+        self._cache_path = cache_path
+        self._copy = open(cache_path, "wb") if cache_path else None
+        self._digest = hashlib.sha256()
+        self._commit = commit
+
+    def _fill(self, size: int) -> bytes:
+        data = self._fp.read() if size < 0 else self._fp.read(size)
+        self._received += len(data)
+        self._eof = size < 0 or not data or (self.length is not None and self._received >= self.length)
+        if self._copy is not None:
+            self._copy.write(data)
+            self._digest.update(data)
+        return data
+
+    def peek(self, size: int) -> bytes:
+        while len(self._buffer) < size and not self._eof:
+            self._buffer += self._fill(size - len(self._buffer))
+        return self._buffer
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._buffer:
+            return b"" if self._eof else self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer + (b"" if self._eof else self._fill(-1)), b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self) -> None:
+        self._fp.close()
+        if self._copy is None or self._cache_path is None:
+            return
+        self._copy.close()
+        self._copy = None
+        if self._eof and self._commit and self.length in (None, self._received):
+            self._commit(self._cache_path, self._digest.hexdigest(), self._received)
+        else:
+            try:
+                os.remove(self._cache_path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "LametricDownload":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+class LametricCache:
+    def __init__(self, root: str | None = None, max_bytes: int = LAMETRIC_CACHE_MAX_BYTES, max_age: float = LAMETRIC_CACHE_MAX_AGE) -> None:
+        self.root = root or _cache_dir("lametric")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._blob_dir = os.path.join(self.root, "blobs")
+        os.makedirs(self._blob_dir, exist_ok=True)
+        self._index_path = os.path.join(self.root, "index.json")
+        index = _load_json_file(self._index_path, {})
+        self._icons: dict[str, dict[str, object]] = index.get("icons", {})  # type: ignore[union-attr]
+        self._blobs: dict[str, dict[str, float]] = index.get("blobs", {})  # type: ignore[union-attr]
+        self._lock = threading.Lock()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blob_dir, digest)
+
+    def _read_blob(self, digest: str) -> bytes | None:
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._blobs.setdefault(digest, {"size": len(data)})["atime"] = time.time()
+        return data
+
+    def _write_blob(self, data: bytes) -> str:
+        import hashlib
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            tmp = _tmp_path(path)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self._blobs[digest] = {"size": len(data), "atime": time.time()}
+        return digest
+
+    def _drop_blob(self, digest: str) -> None:
+        self._blobs.pop(digest, None)
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _save(self) -> None:
+        total = sum(int(b.get("size", 0)) for b in self._blobs.values())
+        for digest in sorted(self._blobs, key=lambda d: self._blobs[d].get("atime", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= int(self._blobs[digest].get("size", 0))
+            self._drop_blob(digest)
+        for icon_id in list(self._icons):
+            entry = self._icons[icon_id]
+            if entry.get("blob") not in self._blobs:
+                del self._icons[icon_id]
+                continue
+            derived: dict[str, dict[str, str]] = entry.get("derived", {})  # type: ignore[assignment]
+            entry["derived"] = {k: v for k, v in derived.items() if v.get("blob") in self._blobs}
+        referenced = {str(e["blob"]) for e in self._icons.values()}
+        referenced.update(d["blob"] for e in self._icons.values() for d in e["derived"].values())  # type: ignore[union-attr]
+        for digest in [d for d in self._blobs if d not in referenced]:
+            self._drop_blob(digest)
+        _save_json_file(self._index_path, {"icons": self._icons, "blobs": self._blobs})
+
+    def _open_blob(self, digest: str) -> BinaryIO | None:
+        try:
+            f = open(self._blob_path(digest), "rb")
+        except FileNotFoundError:
+            return None
+        self._blobs.setdefault(digest, {"size": os.fstat(f.fileno()).st_size})["atime"] = time.time()
+        return f
+
+    @staticmethod
+    def _stale(icon_id: str, entry: dict[str, object] | None, cached: BinaryIO | None, exc: OSError) -> "LametricDownload":
+        # Revalidation failed (offline, LaMetric down); the copy we already have beats no icon at all.
+        if entry is None or cached is None:
+            raise exc
+        eprint(f"warning: LaMetric {icon_id}: revalidation failed ({exc}); using the cached copy")
+        return LametricDownload(cached, str(entry["content_type"]), os.fstat(cached.fileno()).st_size)
+
+    def open(self, icon_id: str, refresh: bool = False) -> "LametricDownload":
+        import urllib.error
+        import urllib.request
+
+        with self._lock:
+            entry = self._icons.get(icon_id)
+            # Opened under the lock: eviction by another thread cannot pull the file out from under the handle.
+            cached = self._open_blob(str(entry["blob"])) if entry else None
+            if entry and cached is not None and not refresh and time.time() - float(entry.get("fetched", 0)) < self.max_age:
+                self._save()
+                return LametricDownload(cached, str(entry["content_type"]), os.fstat(cached.fileno()).st_size)
+
+        req = urllib.request.Request(LAMETRIC_THUMB_URL.format(id=icon_id), method="GET")
+        if entry and cached is not None:
+            if entry.get("etag"):
+                req.add_header("If-None-Match", str(entry["etag"]))
+            if entry.get("last_modified"):
+                req.add_header("If-Modified-Since", str(entry["last_modified"]))
+        try:
+            resp = urllib.request.urlopen(req, timeout=30)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304 and entry and cached is not None:
+                with self._lock:
+                    entry["fetched"] = time.time()
+                    self._save()
+                return LametricDownload(cached, str(entry["content_type"]), os.fstat(cached.fileno()).st_size)
+            return self._stale(icon_id, entry, cached, exc)
+        except OSError as exc:
+            return self._stale(icon_id, entry, cached, exc)
+        except BaseException:
+            if cached is not None:
+                cached.close()
+            raise
+        if cached is not None:
+            cached.close()
 
-        out = BytesIO()
-        rgb.save(out, format="JPEG", quality=95, optimize=True)
-        return out.getvalue()
+        content_type = _parse_content_type(resp.headers.get("content-type"))
+        etag, last_modified = resp.headers.get("etag"), resp.headers.get("last-modified")
+
+        def commit(tmp_path: str, digest: str, size: int) -> None:
+            with self._lock:
+                os.replace(tmp_path, self._blob_path(digest))
+                self._blobs[digest] = {"size": size, "atime": time.time()}
+                previous = self._icons.get(icon_id, {})
+                self._icons[icon_id] = {
+                    "blob": digest,
+                    "content_type": content_type,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "fetched": time.time(),
+                    "derived": previous.get("derived", {}) if previous.get("blob") == digest else {},
+                }
+                self._save()
+
+        tmp_path = _tmp_path(os.path.join(self._blob_dir, f".{icon_id}"))
+        return LametricDownload(resp, content_type, _content_length(resp.headers.get("content-length")), tmp_path, commit)
+
+    def derive(self, icon_id: str, key: str, produce: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            derived: dict[str, dict[str, str]] = self._icons.get(icon_id, {}).get("derived", {})  # type: ignore[assignment]
+            hit = derived.get(key)
+            data = self._read_blob(hit["blob"]) if hit else None
+            if data is not None:
+                self._save()
+                return data
+        data = produce()
+        with self._lock:
+            if icon_id in self._icons:
+                self._icons[icon_id].setdefault("derived", {})[key] = {"blob": self._write_blob(data)}  # type: ignore[index]
+                self._save()
+        return data
+
+
+_LAMETRIC_CACHE: LametricCache | None = None
+_LAMETRIC_CACHE_LOCK = threading.Lock()
+
+
+def _lametric_cache() -> LametricCache:
+    # One instance per process: fleet runs import from several threads, and each copy would overwrite the others' index.
+    global _LAMETRIC_CACHE
+    with _LAMETRIC_CACHE_LOCK:
+        if _LAMETRIC_CACHE is None:
+            _LAMETRIC_CACHE = LametricCache()
+        return _LAMETRIC_CACHE
+
+
+class FlashLedger:
+    def __init__(self, block_size: int = LITTLEFS_BLOCK_SIZE, drift_limit: int = 16 * LITTLEFS_BLOCK_SIZE) -> None:
+        self.block_size = block_size
+        self.drift_limit = drift_limit
+        self.seeded = False
+        self.total = 0
+        self.used = 0
+        # Upper bound on how far `used` may be from the device's real figure since the last /status.
+        self.drift = 0
+        self._sizes: dict[str, int] = {}
+        self._listed: set[str] = set()
+
+    @property
+    def free(self) -> int:
+        return max(0, self.total - self.used)
+
+    @property
+    def stale(self) -> bool:
+        return not self.seeded or self.drift > self.drift_limit
+
+    def seed(self, status: dict[str, object]) -> None:
+        self.total = _bytes_int(status.get("totalBytes"))
+        self.used = _bytes_int(status.get("usedBytes"))
+        self.drift = 0
+        self.seeded = True
+
+    def check(self, need: int, force: bool = False) -> None:
+        if not force and self.free > 0 and need > self.free:
+            raise RuntimeError(f"Not enough free space: need {need} bytes, have {self.free} bytes (use --force to try anyway)")
+
+    def _footprint(self, size: int) -> int:
+        return -(-size // self.block_size) * self.block_size
+
+    def known_size(self, path: str) -> int | None:
+        if path in self._sizes:
+            return self._sizes[path]
+        return 0 if posixpath.dirname(path) in self._listed else None
+
+    def observe(self, dir_path: str, entries: list[dict[str, str]]) -> None:
+        self._listed.add(dir_path.rstrip("/") or "/")
+        for entry in entries:
+            if entry.get("type") != "dir":
+                self._sizes[_entry_path(dir_path, entry)] = _bytes_int(entry.get("size"))
+
+    def uploaded(self, path: str, size: int) -> None:
+        previous = self.known_size(path)
+        self.used += self._footprint(size) - self._footprint(previous or 0)
+        self.drift += self.block_size if previous is None else self.block_size // 16
+        self._sizes[path] = size
+
+    def deleted(self, path: str) -> None:
+        previous = self.known_size(path)
+        self._sizes.pop(path, None)
+        if previous is None:
+            self.drift += 4 * self.block_size
+        else:
+            self.used = max(0, self.used - self._footprint(previous))
+            self.drift += self.block_size // 16
+
+    def renamed(self, old_path: str, new_path: str) -> None:
+        size = self._sizes.pop(old_path, None)
+        if size is not None:
+            self._sizes[new_path] = size
+        self.drift += self.block_size // 16
+
+
+class FsIndex:
+    def __init__(self, host: str, ttl: float = FS_INDEX_TTL, path: str | None = None) -> None:
+        self.host = host
+        self.ttl = ttl
+        self.path = path or os.path.join(_cache_dir("index"), f"{_host_slug(host)}.json")
+        data = _load_json_file(self.path, {})
+        self.dirs: dict[str, dict[str, object]] = data.get("dirs", {}) if isinstance(data, dict) else {}
+        self.dirty = False
+
+    @staticmethod
+    def _key(dir_path: str) -> str:
+        return dir_path.rstrip("/") or "/"
+
+    def lookup(self, dir_path: str) -> list[dict[str, str]] | None:
+        cached = self.dirs.get(self._key(dir_path))
+        if self.ttl <= 0 or not cached or time.time() - float(cached.get("fetched", 0)) >= self.ttl:  # type: ignore[arg-type]
+            return None
+        return [dict(e) for e in cached["entries"]]  # type: ignore[union-attr]
+
+    def store(self, dir_path: str, entries: list[dict[str, str]]) -> None:
+        self.dirs[self._key(dir_path)] = {"fetched": time.time(), "entries": [dict(e) for e in entries]}
+        self.dirty = True
+
+    def _entries(self, path: str) -> tuple[str, list[dict[str, str]] | None]:
+        dir_path = posixpath.dirname(path) or "/"
+        cached = self.dirs.get(dir_path)
+        return dir_path, cached["entries"] if cached else None  # type: ignore[return-value]
+
+    def _remove(self, path: str) -> dict[str, str] | None:
+        dir_path, entries = self._entries(path)
+        if entries is None:
+            return None
+        for i, entry in enumerate(entries):
+            if _entry_path(dir_path, entry) == path:
+                self.dirty = True
+                return entries.pop(i)
+        return None
+
+    def _add(self, path: str, entry: dict[str, str]) -> None:
+        _, entries = self._entries(path)
+        if entries is not None:
+            full_paths = any(e.get("name", "").startswith("/") for e in entries)
+            entries.append({**entry, "name": path if full_paths else posixpath.basename(path)})
+            self.dirty = True
+
+    def _created_dirs(self, dir_path: str) -> None:
+        # The firmware creates directories implicitly, so make sure every ancestor shows up in its cached parent.
+        while dir_path != "/":
+            parent, entries = self._entries(dir_path)
+            if entries is not None and any(_entry_path(parent, e) == dir_path for e in entries):
+                return
+            self._add(dir_path, {"type": "dir", "size": "0"})
+            dir_path = parent
+
+    def uploaded(self, path: str, size: int) -> None:
+        self._created_dirs(posixpath.dirname(path) or "/")
+        self._remove(path)
+        self._add(path, {"type": "file", "size": str(size)})
+
+    def deleted(self, path: str) -> None:
+        self._remove(path)
+        key = self._key(path)
+        for cached in [k for k in self.dirs if k == key or k.startswith(key + "/")]:
+            del self.dirs[cached]
+            self.dirty = True
+
+    def renamed(self, old_path: str, new_path: str) -> None:
+        entry = self._remove(old_path)
+        if entry is None or entry.get("type") == "dir":
+            self.deleted(old_path)
+            self.dirs.pop(posixpath.dirname(new_path) or "/", None)
+            self._created_dirs(posixpath.dirname(new_path) or "/")
+        else:
+            self.uploaded(new_path, _bytes_int(entry.get("size")))
+
+    def totals(self) -> dict[str, dict[str, int]]:
+        # Recursive bytes/files per cached directory; uncached subdirectories are not counted.
+        out: dict[str, dict[str, int]] = {}
+
+        def visit(dir_path: str) -> dict[str, int]:
+            if dir_path not in out:
+                total = out[dir_path] = {"bytes": 0, "files": 0}
+                for entry in self.dirs[dir_path]["entries"]:  # type: ignore[union-attr]
+                    path = _entry_path(dir_path, entry)
+                    if entry.get("type") != "dir":
+                        total["bytes"] += _bytes_int(entry.get("size"))
+                        total["files"] += 1
+                    elif path in self.dirs:
+                        sub = visit(path)
+                        total["bytes"] += sub["bytes"]
+                        total["files"] += sub["files"]
+            return out[dir_path]
+
+        for dir_path in self.dirs:
+            visit(dir_path)
+        return out
+
+    def save(self) -> None:
+        if self.dirty:
+            _save_json_file(self.path, {"host": self.host, "dirs": self.dirs, "totals": self.totals()})
+            self.dirty = False
+
+
+_INDEXES: dict[str, FsIndex] = {}
+
+
+def _fs_index(args: argparse.Namespace) -> FsIndex:
+    index = _INDEXES.get(args.host)
+    if index is None:
+        index = _INDEXES[args.host] = FsIndex(args.host, ttl=args.index_ttl)
+    return index
+
+
+def _decode_screen(payload: object) -> "array.array[int]":
+    # /api/screen returns SCREEN_WIDTH * SCREEN_HEIGHT packed 0xRRGGBB ints, row-major.
+    if not isinstance(payload, list) or len(payload) != SCREEN_WIDTH * SCREEN_HEIGHT:
+        raise RuntimeError(f"Unexpected /api/screen payload ({type(payload).__name__} of {len(payload) if isinstance(payload, list) else '?'})")
+    try:
+        return array.array("I", payload)
+    except (OverflowError, TypeError) as exc:
+        raise RuntimeError(f"Unexpected /api/screen payload: {exc}") from exc
 
 
-class AwtrixClient:
-    def __init__(self, host: str) -> None:
+class _AwtrixBase:
+    def __init__(self, host: str, index: FsIndex | None = None) -> None:
         self.base_url = host
+        self.ledger = FlashLedger()
+        self.index = index
+
+    def _uploaded(self, path: str, size: int) -> None:
+        self.ledger.uploaded(path, size)
+        if self.index is not None:
+            self.index.uploaded(path, size)
+        # The new content's hash is unknown here; callers that know it (sync, restore) record it afterwards.
+        _device_state(self.base_url).pop(path, None)
+
+    def _deleted(self, path: str) -> None:
+        self.ledger.deleted(path)
+        if self.index is not None:
+            self.index.deleted(path)
+        _device_state(self.base_url).pop(path, None)
+
+    def _renamed(self, old_path: str, new_path: str) -> None:
+        self.ledger.renamed(old_path, new_path)
+        if self.index is not None:
+            self.index.renamed(old_path, new_path)
+        state = _device_state(self.base_url)
+        moved = state.pop(old_path, None)
+        state.pop(new_path, None)
+        if moved is not None:
+            state[new_path] = moved
+
+    def _cached_listing(self, dir_path: str, refresh: bool) -> list[dict[str, str]] | None:
+        return None if refresh or self.index is None else self.index.lookup(dir_path)
+
+    def _listed(self, dir_path: str, entries: list[dict[str, str]], cached: bool) -> list[dict[str, str]]:
+        if not cached and self.index is not None:
+            self.index.store(dir_path, entries)
+        self.ledger.observe(dir_path, entries)
+        return entries
 
     @property
     def _origin(self) -> str:
@@ -169,84 +1410,744 @@ class AwtrixClient:
             return self.base_url.rstrip("/")
         return f"http://{self.base_url}".rstrip("/")
 
-    def status(self) -> dict[str, object]:
-        return _http_get_json(f"{self._origin}/status")  # type: ignore[return-value]
-
-    def list_dir(self, dir_path: str) -> list[dict[str, str]]:
+    @staticmethod
+    def _list_target(dir_path: str) -> str:
         require_leading_slash(dir_path)
-        url = f"{self._origin}/list?{urllib.parse.urlencode({'dir': dir_path})}"
-        return _http_get_json(url)  # type: ignore[return-value]
-
-    def upload_bytes(self, dest_path: str, data: bytes, content_type: str | None = None) -> None:
+        return f"/list?{urllib.parse.urlencode({'dir': dir_path})}"
+
+    @staticmethod
+    def _file_target(path: str) -> str:
+        return urllib.parse.quote(require_leading_slash(path))
+
+    @staticmethod
+    def _upload_form(
+        dest_path: str,
+        data: bytes | None,
+        content_type: str | None,
+        local_path: str | None = None,
+        stream: "LametricDownload | BinaryIO | None" = None,
+        length: int = 0,
+    ) -> tuple[MultipartBody, dict[str, str]]:
         dest_path = require_leading_slash(dest_path)
-        body, boundary = _encode_multipart(
-            fields={},
-            files=[
+        return _AwtrixBase._edit_form(
+            {},
+            [
                 MultipartFile(
                     field_name="data",
                     filename=dest_path,
                     content_type=content_type or _content_type_for_path(dest_path),
                     data=data,
+                    path=local_path,
+                    stream=stream,
+                    length=length,
                 )
             ],
         )
-        _http_request(
-            "POST",
-            f"{self._origin}/edit",
-            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
-            body=body,
-        )
+
+    @staticmethod
+    def _edit_form(fields: dict[str, str], files: Iterable[MultipartFile] = ()) -> tuple[MultipartBody, dict[str, str]]:
+        for value in fields.values():
+            require_leading_slash(value)
+        body = _encode_multipart(fields=fields, files=files)
+        return body, {"Content-Type": f"multipart/form-data; boundary={body.boundary}", "Content-Length": str(len(body))}
+
+
+class AwtrixClient(_AwtrixBase):
+    def _request(self, method: str, target: str, body: bytes | MultipartBody | None = None, headers: dict[str, str] | None = None) -> bytes:
+        return _http_request(method, f"{self._origin}{target}", headers=headers, body=body)
+
+    def _reconcile_if_stale(self) -> None:
+        if self.ledger.seeded and self.ledger.stale:
+            self.status()
+
+    def status(self) -> dict[str, object]:
+        st: dict[str, object] = _http_get_json(f"{self._origin}/status")  # type: ignore[assignment]
+        self.ledger.seed(st)
+        return st
+
+    def ensure_free(self, need: int, force: bool = False) -> None:
+        if not self.ledger.seeded or (self.ledger.drift and need > self.ledger.free - self.ledger.drift):
+            self.status()
+        self.ledger.check(need, force)
+
+    def list_dir(self, dir_path: str, refresh: bool = False) -> list[dict[str, str]]:
+        cached = self._cached_listing(dir_path, refresh)
+        if cached is not None:
+            return self._listed(dir_path, cached, cached=True)
+        entries: list[dict[str, str]] = _http_get_json(f"{self._origin}{self._list_target(dir_path)}")  # type: ignore[assignment]
+        return self._listed(dir_path, entries, cached=False)
+
+    def read_file(self, path: str) -> bytes:
+        return self._request("GET", self._file_target(path))
+
+    def upload_bytes(self, dest_path: str, data: bytes, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, data, content_type)
+        self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, len(data))
+        self._reconcile_if_stale()
+
+    def upload_file(self, dest_path: str, local_path: str, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, None, content_type, local_path=local_path)
+        self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, os.path.getsize(local_path))
+        self._reconcile_if_stale()
+
+    def upload_stream(self, dest_path: str, stream: "LametricDownload | BinaryIO", length: int, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, None, content_type, stream=stream, length=length)
+        self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, length)
+        self._reconcile_if_stale()
 
     def create_path(self, path: str) -> None:
-        path = require_leading_slash(path)
-        body, boundary = _encode_multipart(fields={"path": path}, files=[])
-        _http_request(
-            "PUT",
-            f"{self._origin}/edit",
-            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
-            body=body,
-        )
+        self._request("PUT", "/edit", *self._edit_form({"path": path}))
+        self._uploaded(path, 0)
 
     def rename(self, old_path: str, new_path: str) -> None:
-        old_path = require_leading_slash(old_path)
-        new_path = require_leading_slash(new_path)
-        body, boundary = _encode_multipart(fields={"path": old_path, "src": new_path}, files=[])
-        _http_request(
-            "PUT",
-            f"{self._origin}/edit",
-            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
-            body=body,
-        )
+        self._request("PUT", "/edit", *self._edit_form({"path": old_path, "src": new_path}))
+        self._renamed(old_path, new_path)
 
     def delete(self, path: str) -> None:
-        path = require_leading_slash(path)
-        body, boundary = _encode_multipart(fields={"path": path}, files=[])
-        _http_request(
-            "DELETE",
-            f"{self._origin}/edit",
-            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
-            body=body,
-        )
+        self._request("DELETE", "/edit", *self._edit_form({"path": path}))
+        self._deleted(path)
+        self._reconcile_if_stale()
+
+    def reboot(self) -> None:
+        self._request("POST", "/api/reboot", b"")
+
+    def screen(self) -> "array.array[int]":
+        return _decode_screen(_http_get_json(f"{self._origin}/api/screen"))
+
+
+class AsyncAwtrixClient(_AwtrixBase):
+    def __init__(
+        self, host: str, concurrency: int | None = None, index: FsIndex | None = None, max_concurrency: int = AIMD_MAX_CONCURRENCY
+    ) -> None:
+        super().__init__(host, index)
+        # None lets the pool's controller adapt between 1 and max_concurrency.
+        self.concurrency = max(1, concurrency) if concurrency is not None else None
+        self.max_concurrency = max(1, max_concurrency)
+        self._reconciling = False
+
+    @property
+    def workers(self) -> int:
+        return self.concurrency or self.max_concurrency
+
+    async def __aenter__(self) -> "AsyncAwtrixClient":
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        await self.aclose()
+
+    @property
+    def _pool(self) -> _AsyncConnectionPool:
+        # One pool (and therefore one concurrency controller) per device and event loop, shared by every client instance.
+        return _async_pool_for(self._origin, self.concurrency, self.max_concurrency)
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+    async def _request(self, method: str, target: str, body: bytes | MultipartBody | None = None, headers: dict[str, str] | None = None) -> bytes:
+        import asyncio
+
+        url = f"{self._origin}{target}"
+        try:
+            status, reason, payload = await self._pool.request(method, target, headers=headers, body=body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+            raise RuntimeError(f"Request failed {method} {url}: {exc or type(exc).__name__}") from exc
+        _count_traffic(urllib.parse.urlsplit(self._origin).netloc, len(body) if body is not None else 0, len(payload))
+        _raise_for_status(method, url, status, reason, payload)
+        return payload
+
+    async def _get_json(self, target: str) -> object:
+        raw = await self._request("GET", target, headers={"Accept": "application/json"})
+        return json.loads(raw.decode("utf-8", errors="strict"))
+
+    async def _reconcile_if_stale(self) -> None:
+        if self.ledger.seeded and self.ledger.stale and not self._reconciling:
+            self._reconciling = True
+            try:
+                await self.status()
+            finally:
+                self._reconciling = False
+
+    async def status(self) -> dict[str, object]:
+        st: dict[str, object] = await self._get_json("/status")  # type: ignore[assignment]
+        self.ledger.seed(st)
+        return st
+
+    async def ensure_free(self, need: int, force: bool = False) -> None:
+        if not self.ledger.seeded or (self.ledger.drift and need > self.ledger.free - self.ledger.drift):
+            await self.status()
+        self.ledger.check(need, force)
+
+    async def list_dir(self, dir_path: str, refresh: bool = False) -> list[dict[str, str]]:
+        cached = self._cached_listing(dir_path, refresh)
+        if cached is not None:
+            return self._listed(dir_path, cached, cached=True)
+        entries: list[dict[str, str]] = await self._get_json(self._list_target(dir_path))  # type: ignore[assignment]
+        return self._listed(dir_path, entries, cached=False)
+
+    async def read_file(self, path: str) -> bytes:
+        return await self._request("GET", self._file_target(path))
+
+    async def upload_bytes(self, dest_path: str, data: bytes, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, data, content_type)
+        await self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, len(data))
+        await self._reconcile_if_stale()
+
+    async def upload_file(self, dest_path: str, local_path: str, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, None, content_type, local_path=local_path)
+        await self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, os.path.getsize(local_path))
+        await self._reconcile_if_stale()
+
+    async def upload_stream(self, dest_path: str, stream: "LametricDownload | BinaryIO", length: int, content_type: str | None = None) -> None:
+        body, headers = self._upload_form(dest_path, None, content_type, stream=stream, length=length)
+        await self._request("POST", "/edit", body, headers)
+        self._uploaded(dest_path, length)
+        await self._reconcile_if_stale()
+
+    async def create_path(self, path: str) -> None:
+        await self._request("PUT", "/edit", *self._edit_form({"path": path}))
+        self._uploaded(path, 0)
+
+    async def rename(self, old_path: str, new_path: str) -> None:
+        await self._request("PUT", "/edit", *self._edit_form({"path": old_path, "src": new_path}))
+        self._renamed(old_path, new_path)
+
+    async def delete(self, path: str) -> None:
+        await self._request("DELETE", "/edit", *self._edit_form({"path": path}))
+        self._deleted(path)
+        await self._reconcile_if_stale()
+
+    async def reboot(self) -> None:
+        await self._request("POST", "/api/reboot", b"")
+
+    async def screen(self) -> "array.array[int]":
+        return _decode_screen(await self._get_json("/api/screen"))
 
 
 def cmd_status(args: argparse.Namespace) -> int:
+    # /status never consults listings, so leave the index file unread.
     client = AwtrixClient(args.host)
     st = client.status()
     print(json.dumps(st, indent=2, sort_keys=True))
     return 0
 
 
-def cmd_list(args: argparse.Namespace) -> int:
-    client = AwtrixClient(args.host)
-    entries = client.list_dir(args.dir)
-    if args.json:
-        print(json.dumps(entries, indent=2, sort_keys=True))
-        return 0
+async def _gather_settled(coros: Iterable[Awaitable[T]]) -> list[T | BaseException]:
+    import asyncio
+
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+
+async def _run_in_executor(pool: "Executor | None", func: Callable[..., T], *args: object) -> T:
+    import asyncio
+
+    # Unlike asyncio.to_thread, run_in_executor drops context variables; carry them so fleet output routing follows.
+    return await asyncio.get_running_loop().run_in_executor(pool, contextvars.copy_context().run, func, *args)
+
+
+def _raise_failures(action: str, results: list[object]) -> None:
+    failures = [r for r in results if isinstance(r, BaseException)]
+    for exc in failures:
+        eprint(f"Error: {exc}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(results)} {action} operations failed")
+
+
+def _entry_path(dir_path: str, entry: dict[str, str]) -> str:
+    name = entry.get("name", "")
+    # Some firmware builds report full paths instead of bare names.
+    return name if name.startswith("/") else posixpath.join(dir_path, name)
+
+
+async def _walk_tree(client: AsyncAwtrixClient, root: str = "/", refresh: bool = False) -> list[tuple[str, str, int]]:
+    import asyncio
+
+    found: list[tuple[str, str, int]] = []
+
+    async def visit(dir_path: str) -> None:
+        subdirs: list[str] = []
+        for entry in await client.list_dir(dir_path, refresh):
+            path = _entry_path(dir_path, entry)
+            kind = "dir" if entry.get("type") == "dir" else "file"
+            found.append((path, kind, _bytes_int(entry.get("size"))))
+            if kind == "dir":
+                subdirs.append(path)
+        await asyncio.gather(*(visit(d) for d in subdirs))
+
+    await visit(require_leading_slash(root))
+    return sorted(found)
+
+
+def _print_entries(entries: list[dict[str, str]]) -> None:
     for entry in entries:
         kind = entry.get("type", "?")
         name = entry.get("name", "?")
         size = entry.get("size", "")
         print(f"{kind:4} {size:>8} {name}")
+
+
+def cmd_list(args: argparse.Namespace) -> int:
+    dirs: list[str] = args.dir
+    results: list[list[dict[str, str]] | BaseException]
+    if len(dirs) == 1:
+        # One listing gains nothing from the event loop, so skip importing and starting asyncio for it.
+        results = [AwtrixClient(args.host, index=_fs_index(args)).list_dir(dirs[0])]
+    else:
+        import asyncio
+
+        async def run() -> list[list[dict[str, str]] | BaseException]:
+            async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+                return await _gather_settled(client.list_dir(d) for d in dirs)
+
+        results = asyncio.run(run())
+    listed = {d: r for d, r in zip(dirs, results) if not isinstance(r, BaseException)}
+    if args.json:
+        print(json.dumps(listed[dirs[0]] if len(dirs) == 1 and listed else listed, indent=2, sort_keys=True))
+    else:
+        for i, (d, entries) in enumerate(listed.items()):
+            if len(dirs) > 1:
+                if i:
+                    print()
+                print(f"{d}:")
+            _print_entries(entries)
+    _raise_failures("list", results)
+    return 0
+
+
+def _dir_totals(root: str, found: list[tuple[str, str, int]]) -> dict[str, tuple[int, int]]:
+    totals: dict[str, list[int]] = {root: [0, 0]}
+    totals.update((path, [0, 0]) for path, kind, _ in found if kind == "dir")
+    for path, kind, size in found:
+        parent = posixpath.dirname(path)
+        while kind == "file" and parent in totals:
+            totals[parent][0] += size
+            totals[parent][1] += 1
+            if parent == root:
+                break
+            parent = posixpath.dirname(parent)
+    return {path: (size, files) for path, (size, files) in totals.items()}
+
+
+def _walk_with_totals(args: argparse.Namespace) -> tuple[str, list[tuple[str, str, int]], dict[str, tuple[int, int]]]:
+    import asyncio
+
+    root = require_leading_slash(args.root.rstrip("/") or "/")
+
+    async def run() -> list[tuple[str, str, int]]:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            return await _walk_tree(client, root, refresh=args.refresh)
+
+    found = sorted(asyncio.run(run()), key=lambda item: item[0].split("/"))
+    return root, found, _dir_totals(root, found)
+
+
+def _depth(root: str, path: str) -> int:
+    return 0 if path == root else posixpath.relpath(path, root).count("/") + 1
+
+
+def cmd_tree(args: argparse.Namespace) -> int:
+    root, found, totals = _walk_with_totals(args)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "root": root,
+                    "entries": [{"path": path, "type": kind, "size": size} for path, kind, size in found],
+                    "totals": {path: {"bytes": size, "files": files} for path, (size, files) in totals.items()},
+                },
+                indent=2,
+                sort_keys=True,
+            )
+        )
+        return 0
+    size, files = totals[root]
+    print(f"{root} ({files} files, {size} bytes)")
+    for path, kind, size in found:
+        indent = "  " * _depth(root, path)
+        if kind == "dir":
+            print(f"{indent}{posixpath.basename(path)}/ ({totals[path][1]} files, {totals[path][0]} bytes)")
+        else:
+            print(f"{indent}{posixpath.basename(path)} ({size} bytes)")
+    return 0
+
+
+def cmd_du(args: argparse.Namespace) -> int:
+    root, _, totals = _walk_with_totals(args)
+    rows = [
+        (path, size, files)
+        for path, (size, files) in sorted(totals.items(), key=lambda item: item[0].split("/"))
+        if args.depth is None or _depth(root, path) <= args.depth
+    ]
+    if args.json:
+        print(json.dumps({path: {"bytes": size, "files": files} for path, size, files in rows}, indent=2, sort_keys=True))
+        return 0
+    for path, size, files in rows:
+        print(f"{size:10} {files:6}  {path}")
+    return 0
+
+
+def _ansi_cells(frame: "array.array[int]", previous: "array.array[int] | None") -> tuple[str, int]:
+    out: list[str] = []
+    changed = 0
+    cursor = -1
+    current = -1
+    for i, color in enumerate(frame):
+        if previous is not None and previous[i] == color:
+            continue
+        changed += 1
+        # Cursor moves and colour codes are only emitted when the next cell is not adjacent / not the same colour.
+        if i != cursor or i % SCREEN_WIDTH == 0:
+            y, x = divmod(i, SCREEN_WIDTH)
+            out.append(f"\x1b[{y + 1};{2 * x + 1}H")
+        if color != current:
+            out.append(f"\x1b[48;2;{color >> 16 & 0xFF};{color >> 8 & 0xFF};{color & 0xFF}m")
+            current = color
+        out.append("  ")
+        cursor = i + 1
+    return "".join(out), changed
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def _screen_rgb(frame: "array.array[int]") -> bytes:
+    packed = array.array("I", frame)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    # Little-endian 0x00RRGGBB words are B, G, R, 0 in memory; reorder with strided slices instead of per-pixel shifts.
+    raw = packed.tobytes()
+    step = packed.itemsize
+    rgb = bytearray(len(packed) * 3)
+    rgb[0::3] = raw[2::step]
+    rgb[1::3] = raw[1::step]
+    rgb[2::3] = raw[0::step]
+    return bytes(rgb)
+
+
+def _record_format(path: str) -> str:
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".gif":
+        return "gif"
+    if suffix in (".png", ".apng"):
+        return "png"
+    raise ValueError(f"--record needs a .gif, .png or .apng path: {path}")
+
+
+def _record_screen(client: AwtrixClient, args: argparse.Namespace) -> int:
+    import awtrix_image
+
+    out_format = _record_format(args.record)
+    if args.scale < 1:
+        raise ValueError("--scale must be at least 1")
+    interval = 1 / args.fps if args.fps > 0 else 0.0
+    polls = 0
+    latency_total = 0.0
+    # Only the frame waiting for its duration is held; everything before it is already encoded.
+    pending: array.array[int] | None = None
+    pending_at = 0.0
+    eprint(f"Recording {args.record} (Ctrl-C to stop)")
+    with open(args.record, "wb") as fp:
+        stream = awtrix_image.AnimationStream(fp, SCREEN_WIDTH, SCREEN_HEIGHT, out_format, scale=args.scale)
+        started = time.perf_counter()
+        try:
+            while not args.duration or time.perf_counter() - started < args.duration:
+                t0 = time.perf_counter()
+                frame = client.screen()
+                now = time.perf_counter()
+                polls += 1
+                latency_total += now - t0
+                if pending is None or frame != pending:
+                    if pending is not None:
+                        stream.add_frame(_screen_rgb(pending), round((now - pending_at) * 1000))
+                    pending, pending_at = frame, now
+                delay = t0 + interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pending is not None:
+                stream.add_frame(_screen_rgb(pending), max(1, round((time.perf_counter() - pending_at) * 1000)))
+            stream.close()
+    elapsed = time.perf_counter() - started
+    print(
+        f"recorded {polls} polls as {stream.frames} frames in {elapsed:.1f}s to {args.record} "
+        f"({os.path.getsize(args.record)} bytes, {SCREEN_WIDTH * args.scale}x{SCREEN_HEIGHT * args.scale}), "
+        f"latency avg {latency_total / polls * 1000 if polls else 0:.1f} ms"
+    )
+    return 0
+
+
+# One poller feeds every viewer: device requests depend on --fps only, never on the number of viewers.
+class ScreenHub:
+    def __init__(self, client: AwtrixClient, interval: float, scale: int) -> None:
+        self.client = client
+        self.interval = interval
+        self.scale = scale
+        self.frame: array.array[int] | None = None
+        self.version = 0
+        self.captured_at = 0.0
+        self.polls = 0
+        self.errors = 0
+        self.streams = 0
+        self.snapshots = 0
+        self.viewers = 0
+        self._demand = 0.0
+        self.stopping = False
+        self._cond = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._encoded: dict[str, tuple[int, bytes]] = {}
+
+    def _wanted(self) -> bool:
+        return self.stopping or self.viewers > 0 or time.monotonic() - self._demand < SCREEN_IDLE_AFTER
+
+    def poll_forever(self) -> None:
+        while True:
+            with self._cond:
+                # Nobody watching: stop polling the device until the next request arrives.
+                self._cond.wait_for(self._wanted)
+                if self.stopping:
+                    return
+            t0 = time.monotonic()
+            try:
+                frame: array.array[int] | None = self.client.screen()
+            except Exception as exc:
+                # This thread is the only source of frames; if it died, --serve would keep serving a frozen one.
+                eprint(f"Warning: screen poll failed: {exc}")
+                frame = None
+            with self._cond:
+                self.polls += 1
+                if frame is None:
+                    self.errors += 1
+                else:
+                    self.captured_at = time.monotonic()
+                    if frame != self.frame:
+                        self.frame = frame
+                        self.version += 1
+                self._cond.notify_all()
+            delay = t0 + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self) -> None:
+        with self._cond:
+            self.stopping = True
+            self._cond.notify_all()
+
+    def add_viewer(self, delta: int) -> None:
+        with self._cond:
+            self.viewers += delta
+            if delta > 0:
+                self.streams += 1
+            self._demand = time.monotonic()
+            self._cond.notify_all()
+
+    def fresh(self, timeout: float = 5.0) -> int:
+        max_age = max(2 * self.interval, 1.0)
+        with self._cond:
+            self._demand = time.monotonic()
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self.stopping or (self.frame is not None and time.monotonic() - self.captured_at <= max_age), timeout)
+            return self.version
+
+    def next_version(self, after: int, timeout: float) -> int:
+        with self._cond:
+            self._cond.wait_for(lambda: self.stopping or self.version != after, timeout)
+            return self.version
+
+    def encoded(self, kind: str) -> tuple[int, bytes] | None:
+        import awtrix_image
+
+        # Each frame is encoded at most once per format, by whichever viewer asks first.
+        with self._encode_lock:
+            with self._cond:
+                version, frame = self.version, self.frame
+            cached = self._encoded.get(kind)
+            if cached is not None and cached[0] == version:
+                return cached
+            if frame is None:
+                return None
+            width, height = SCREEN_WIDTH * self.scale, SCREEN_HEIGHT * self.scale
+            rgb = awtrix_image.upscale(SCREEN_WIDTH, SCREEN_HEIGHT, _screen_rgb(frame), self.scale)
+            data = awtrix_image.encode_jpeg(width, height, rgb, 90) if kind == "jpeg" else awtrix_image.encode_png(width, height, rgb)
+            self._encoded[kind] = (version, data)
+            return version, data
+
+
+def _parse_listen(value: str) -> tuple[str, int]:
+    host, sep, port = value.rpartition(":")
+    if not sep:
+        host, port = "", value
+    try:
+        return host.strip("[]"), int(port)
+    except ValueError:
+        raise ValueError(f"--serve expects [HOST]:PORT, got {value!r}") from None
+
+
+def _serve_screen(client: AwtrixClient, args: argparse.Namespace) -> int:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if args.scale < 1:
+        raise ValueError("--scale must be at least 1")
+    hub = ScreenHub(client, 1 / args.fps if args.fps > 0 else 0.0, args.scale)
+    page = (
+        "<!doctype html><title>AWTRIX {host}</title>"
+        '<body style="margin:0;background:#000"><img src="/stream.mjpg" style="width:100%;image-rendering:pixelated">'
+    ).format(host=args.host).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+        def _reply(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _snapshot(self, kind: str, content_type: str) -> None:
+            hub.fresh()
+            encoded = hub.encoded(kind)
+            if encoded is None:
+                self._reply(503, b"No frame from the device yet", "text/plain")
+                return
+            hub.snapshots += 1
+            self._reply(200, encoded[1], content_type)
+
+        def _stream(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            hub.add_viewer(1)
+            try:
+                hub.fresh()
+                self.wfile.write(b"--frame\r\n")
+                while not hub.stopping:
+                    encoded = hub.encoded("jpeg")
+                    if encoded is not None:
+                        version, data = encoded
+                        # The closing boundary goes out with the frame so browsers show it without waiting for the next one.
+                        self.wfile.write(
+                            f"Content-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n--frame\r\n"
+                        )
+                        self.wfile.flush()
+                    else:
+                        version = hub.version
+                    # An unchanged screen is re-sent every few seconds so proxies keep the connection open.
+                    hub.next_version(version, timeout=SCREEN_STREAM_KEEPALIVE)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                hub.add_viewer(-1)
+
+        def do_GET(self) -> None:
+            path = urllib.parse.urlsplit(self.path).path
+            if path == "/":
+                self._reply(200, page, "text/html; charset=utf-8")
+            elif path == "/stream.mjpg":
+                self._stream()
+            elif path == "/snapshot.jpg":
+                self._snapshot("jpeg", "image/jpeg")
+            elif path == "/snapshot.png":
+                self._snapshot("png", "image/png")
+            elif path == "/screen.json":
+                hub.fresh()
+                frame = hub.frame
+                self._reply(200, json.dumps(frame.tolist() if frame is not None else None).encode(), "application/json")
+            else:
+                self._reply(404, b"Not Found", "text/plain")
+
+    server = ThreadingHTTPServer(_parse_listen(args.serve), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=hub.poll_forever, daemon=True).start()
+    if args.duration:
+        threading.Timer(args.duration, server.shutdown).start()
+    listen_host, listen_port = server.server_address[:2]
+    eprint(f"Serving http://{listen_host}:{listen_port}/ (stream.mjpg, snapshot.jpg, snapshot.png, screen.json); Ctrl-C to stop")
+    started = time.monotonic()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.stop()
+        server.server_close()
+    elapsed = time.monotonic() - started
+    print(
+        f"served {hub.streams} streams and {hub.snapshots} snapshots in {elapsed:.1f}s "
+        f"from {hub.polls} device polls ({hub.errors} failed, {hub.version} distinct frames)"
+    )
+    return 0
+
+
+def cmd_screen(args: argparse.Namespace) -> int:
+    client = AwtrixClient(args.host, index=_fs_index(args))
+    if sum(1 for mode in (args.watch, args.record, args.serve) if mode) > 1:
+        raise ValueError("--watch, --record and --serve cannot be combined")
+    if args.record:
+        return _record_screen(client, args)
+    if args.serve:
+        return _serve_screen(client, args)
+    if not args.watch:
+        frame = client.screen()
+        if args.json:
+            print(json.dumps(frame.tolist()))
+        else:
+            cells, _ = _ansi_cells(frame, None)
+            print("\x1b[2J" + cells + f"\x1b[0m\x1b[{SCREEN_HEIGHT + 1};1H")
+        return 0
+
+    interval = 1 / args.fps if args.fps > 0 else 0.0
+    # Bounded, so an all-day --watch does not grow: fps comes from the last 20 frames, p95 from the last SCREEN_WATCH_SAMPLES.
+    latencies: deque[float] = deque(maxlen=SCREEN_WATCH_SAMPLES)
+    stamps: deque[float] = deque(maxlen=20)
+    frames = 0
+    latency_total = 0.0
+    previous: array.array[int] | None = None
+    out = sys.stdout
+    out.write("\x1b[2J\x1b[?25l")
+    started = time.perf_counter()
+    try:
+        while not args.duration or time.perf_counter() - started < args.duration:
+            t0 = time.perf_counter()
+            frame = client.screen()
+            now = time.perf_counter()
+            latencies.append(now - t0)
+            stamps.append(now)
+            frames += 1
+            latency_total += now - t0
+            # Only cells whose colour changed are repainted; identical frames cost one compare.
+            cells, changed = ("", 0) if previous is not None and frame == previous else _ansi_cells(frame, previous)
+            previous = frame
+            fps = (len(stamps) - 1) / (stamps[-1] - stamps[0]) if len(stamps) > 1 and stamps[-1] > stamps[0] else 0.0
+            out.write(
+                f"{cells}\x1b[0m\x1b[{SCREEN_HEIGHT + 2};1H\x1b[K"
+                f"{fps:5.1f} fps  latency {latencies[-1] * 1000:5.1f} ms  {changed:3} cells changed"
+            )
+            out.flush()
+            delay = t0 + interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.write(f"\x1b[0m\x1b[?25h\x1b[{SCREEN_HEIGHT + 3};1H")
+        out.flush()
+    elapsed = time.perf_counter() - started
+    print(
+        f"watched {frames} frames in {elapsed:.1f}s: {frames / elapsed if elapsed else 0:.1f} fps, "
+        f"latency avg {latency_total / frames * 1000 if frames else 0:.1f} ms, "
+        f"p95 {_percentile(list(latencies), 95) * 1000:.1f} ms"
+    )
     return 0
 
 
@@ -257,113 +2158,1197 @@ def _bytes_int(value: object) -> int:
         return 0
 
 
-def _print_space_delta(before: dict[str, object], after: dict[str, object]) -> None:
-    total = _bytes_int(after.get("totalBytes"))
-    used_before = _bytes_int(before.get("usedBytes"))
-    used_after = _bytes_int(after.get("usedBytes"))
-    free_after = max(0, total - used_after)
-    print(f"flash: used {used_before} -> {used_after} bytes; free now {free_after} bytes (total {total})")
+def _print_space_delta(used_before: int, ledger: FlashLedger) -> None:
+    estimated = " (estimated)" if ledger.drift else ""
+    print(f"flash: used {used_before} -> {ledger.used} bytes; free now {ledger.free} bytes (total {ledger.total}){estimated}")
+
+
+def _optimize_options(args: argparse.Namespace) -> "awtrix_image.OptimizeOptions | None":
+    if not args.optimize:
+        return None
+    import awtrix_image
+
+    match = re.fullmatch(r"(\d+)x(\d+)", args.max_size)
+    if not match or not int(match[1]) or not int(match[2]):
+        raise ValueError(f"--max-size must be WIDTHxHEIGHT (e.g. 32x8): {args.max_size}")
+    if not 1 <= args.quality <= 100:
+        raise ValueError("--quality must be between 1 and 100")
+    if not 2 <= args.colors <= 256:
+        raise ValueError("--colors must be between 2 and 256")
+    return awtrix_image.OptimizeOptions(int(match[1]), int(match[2]), args.max_bytes, args.quality, args.colors)
+
+
+def _print_savings(label: str, before: int, after: int) -> None:
+    saved = before - after
+    percent = 100 * saved / before if before else 0.0
+    print(f"{label}: {before} -> {after} bytes (saved {saved} bytes, {percent:.0f}%)")
+
+
+def _warn_over_budget(name: str, size: int, options: "awtrix_image.OptimizeOptions") -> None:
+    if options.max_bytes is not None and size > options.max_bytes:
+        eprint(f"warning: {name} is still {size} bytes after optimizing (--max-bytes {options.max_bytes})")
 
 
 def cmd_upload(args: argparse.Namespace) -> int:
-    client = AwtrixClient(args.host)
+    client = AwtrixClient(args.host, index=_fs_index(args))
     dest = require_leading_slash(args.dest)
-    with open(args.local, "rb") as f:
-        payload = f.read()
-
-    before = client.status()
-    free = _bytes_int(before.get("totalBytes")) - _bytes_int(before.get("usedBytes"))
-    if not args.force and free > 0 and len(payload) > free:
-        raise RuntimeError(f"Not enough free space: need {len(payload)} bytes, have {free} bytes (use --force to try anyway)")
-
-    client.upload_bytes(dest, payload)
-    after = client.status()
-    _print_space_delta(before, after)
-    print(f"uploaded {args.local} -> {dest} ({len(payload)} bytes)")
+    options = _optimize_options(args)
+    data: bytes | None = None
+    if options is not None:
+        out_format = _image_format_for_path(dest)
+        if out_format is None:
+            raise ValueError(f"--optimize needs a .gif or .jpg destination: {dest}")
+        with open(args.local, "rb") as f:
+            original = f.read()
+        data = _optimize_image(original, out_format, options)
+        _print_savings(f"optimized {args.local}", len(original), len(data))
+        _warn_over_budget(dest, len(data), options)
+    size = os.path.getsize(args.local) if data is None else len(data)
+
+    try:
+        # Tells the ledger what the upload replaces; within --index-ttl the index answers without a request.
+        client.list_dir(posixpath.dirname(dest) or "/")
+    except RuntimeError:
+        pass
+    client.ensure_free(size, args.force)
+    used_before = client.ledger.used
+    overwrite_unknown = client.ledger.known_size(dest) is None
+    if data is None:
+        client.upload_file(dest, args.local)
+    else:
+        client.upload_bytes(dest, data)
+    if overwrite_unknown:
+        # The ledger would charge the whole file even if it replaced one of the same size; ask the device instead.
+        client.status()
+    _print_space_delta(used_before, client.ledger)
+    print(f"uploaded {args.local} -> {dest} ({size} bytes)")
     return 0
 
 
 def cmd_create(args: argparse.Namespace) -> int:
-    client = AwtrixClient(args.host)
+    client = AwtrixClient(args.host, index=_fs_index(args))
     client.create_path(args.path)
     print(f"created {args.path}")
     return 0
 
 
 def cmd_rename(args: argparse.Namespace) -> int:
-    client = AwtrixClient(args.host)
+    client = AwtrixClient(args.host, index=_fs_index(args))
     client.rename(args.old, args.new)
     print(f"renamed {args.old} -> {args.new}")
     return 0
 
 
+def _read_path_list(source: str) -> list[str]:
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [require_leading_slash(line.strip()) for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _split_glob(pattern: str) -> tuple[str, str]:
+    pattern = require_leading_slash(pattern)
+    dir_path, name_pattern = posixpath.split(pattern)
+    if any(ch in dir_path for ch in "*?["):
+        raise ValueError(f"Wildcards are only supported in the last path component: {pattern}")
+    return dir_path or "/", name_pattern
+
+
+async def _expand_globs(client: AsyncAwtrixClient, patterns: list[str]) -> list[str]:
+    import asyncio
+    import fnmatch
+
+    split = [_split_glob(p) for p in patterns]
+    dirs = sorted({d for d, _ in split})
+    listings = dict(zip(dirs, await asyncio.gather(*(client.list_dir(d) for d in dirs))))
+    matched: list[str] = []
+    for dir_path, name_pattern in split:
+        for entry in listings[dir_path]:
+            path = _entry_path(dir_path, entry)
+            if entry.get("type") != "dir" and fnmatch.fnmatchcase(posixpath.basename(path), name_pattern):
+                matched.append(path)
+    return list(dict.fromkeys(matched))
+
+
 def cmd_delete(args: argparse.Namespace) -> int:
-    client = AwtrixClient(args.host)
-    client.delete(args.path)
-    print(f"deleted {args.path}")
+    paths: list[str] = [require_leading_slash(p) for p in args.path]
+    if args.from_file:
+        paths.extend(_read_path_list(args.from_file))
+    bulk = bool(args.glob or args.from_file)
+    if not paths and not args.glob:
+        raise ValueError("Nothing to delete: pass paths, --glob or --from-file")
+    if not bulk and len(paths) == 1:
+        # One delete gains nothing from the event loop, so skip importing and starting asyncio for it.
+        if not args.dry_run:
+            AwtrixClient(args.host, index=_fs_index(args)).delete(paths[0])
+        print(f"{'would delete' if args.dry_run else 'deleted'} {paths[0]}")
+        return 0
+
+    import asyncio
+
+    async def run() -> tuple[list[str], list[None | BaseException], float, float]:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            started = time.perf_counter()
+            targets = list(dict.fromkeys(paths + (await _expand_globs(client, args.glob) if args.glob else [])))
+            listed = time.perf_counter()
+            if args.dry_run:
+                return targets, [None] * len(targets), listed - started, 0.0
+            results = await _gather_settled(client.delete(p) for p in targets)
+            return targets, results, listed - started, time.perf_counter() - listed
+
+    targets, results, list_secs, delete_secs = asyncio.run(run())
+    if args.dry_run or not bulk:
+        verb = "would delete" if args.dry_run else "deleted"
+        for path, result in zip(targets, results):
+            if not isinstance(result, BaseException):
+                print(f"{verb} {path}")
+    if bulk and args.dry_run:
+        print(f"matched {len(targets)} files in {list_secs:.2f}s")
+    elif bulk:
+        ok = sum(1 for r in results if not isinstance(r, BaseException))
+        rate = ok / delete_secs if delete_secs > 0 else 0.0
+        print(
+            f"deleted {ok} of {len(targets)} files in {list_secs + delete_secs:.2f}s "
+            f"(list {list_secs:.2f}s, delete {delete_secs:.2f}s, {rate:.1f} files/s, concurrency {args.concurrency or 'adaptive'})"
+        )
+    _raise_failures("delete", results)
+    return 0
+
+
+class SyncPlan(NamedTuple):
+    upload: list[tuple[str, str, str, int]]
+    unchanged: list[str]
+    delete: list[str]
+
+
+def _plan_sync(
+    localdir: str,
+    remotedir: str,
+    remote: list[dict[str, str]],
+    manifest: dict[str, dict[str, object]],
+    delete_extras: bool,
+    optimize_key: str | None = None,
+) -> SyncPlan:
+    remote_sizes = {
+        posixpath.basename(_entry_path(remotedir, e)): _bytes_int(e.get("size")) for e in remote if e.get("type") != "dir"
+    }
+    upload: list[tuple[str, str, str, int]] = []
+    unchanged: list[str] = []
+    local_names: set[str] = set()
+    for name in sorted(os.listdir(localdir)):
+        local_path = os.path.join(localdir, name)
+        if name.startswith(".") or not os.path.isfile(local_path):
+            continue
+        local_names.add(name)
+        dest = posixpath.join(remotedir, name)
+        size = os.path.getsize(local_path)
+        digest = _sha256_file(local_path)
+        known = manifest.get(dest, {})
+        if optimize_key and _image_format_for_path(name):
+            # Optimized uploads differ from the local file; match on the source digest and the settings used.
+            same = known.get("source") == digest and known.get("optimize") == optimize_key and remote_sizes.get(name) == known.get("size")
+        else:
+            same = remote_sizes.get(name) == size and known.get("sha256") == digest and known.get("size") == size
+        if same:
+            unchanged.append(dest)
+        else:
+            upload.append((local_path, dest, digest, size))
+    extras = sorted(posixpath.join(remotedir, n) for n in remote_sizes if n not in local_names) if delete_extras else []
+    return SyncPlan(upload=upload, unchanged=unchanged, delete=extras)
+
+
+def cmd_sync(args: argparse.Namespace) -> int:
+    import asyncio
+    import hashlib
+
+    if not os.path.isdir(args.localdir):
+        raise ValueError(f"Not a directory: {args.localdir}")
+    remotedir = require_leading_slash(args.remotedir.rstrip("/") or "/")
+    manifest = _device_state(args.host)
+    options = _optimize_options(args)
+    optimize_key = options.key if options else None
+    optimized: dict[str, bytes] = {}
+
+    def upload_size(dest: str, size: int) -> int:
+        return len(optimized[dest]) if dest in optimized else size
+
+    async def run() -> tuple[SyncPlan, list[None | BaseException], list[None | BaseException], float]:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            started = time.perf_counter()
+            remote = await client.list_dir(remotedir)
+            plan = _plan_sync(args.localdir, remotedir, remote, manifest, args.delete, optimize_key)
+            if options is not None:
+                # Optimize before the free-space check so it is made against the bytes actually sent.
+                for local_path, dest, _, _ in plan.upload:
+                    out_format = _image_format_for_path(dest)
+                    if out_format:
+                        with open(local_path, "rb") as f:
+                            optimized[dest] = _optimize_image(f.read(), out_format, options)
+                        _warn_over_budget(dest, len(optimized[dest]), options)
+            if args.dry_run:
+                return plan, [], [], time.perf_counter() - started
+
+            async def upload(local_path: str, dest: str, digest: str, size: int) -> None:
+                data = optimized.get(dest)
+                if data is None:
+                    await client.upload_file(dest, local_path)
+                    manifest[dest] = {"sha256": digest, "size": size}
+                    return
+                await client.upload_bytes(dest, data)
+                manifest[dest] = {
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "size": len(data),
+                    "source": digest,
+                    "optimize": optimize_key,
+                }
+
+            async def delete(path: str) -> None:
+                await client.delete(path)
+                manifest.pop(path, None)
+
+            if not plan.upload and not plan.delete:
+                return plan, [], [], time.perf_counter() - started
+            used_before = _bytes_int((await client.status()).get("usedBytes"))
+            # Delete first so extras free space; the ledger then answers the free-space check without another /status.
+            deleted = await _gather_settled(delete(p) for p in plan.delete)
+            await client.ensure_free(sum(upload_size(dest, size) for _, dest, _, size in plan.upload), args.force)
+            uploaded = await _gather_settled(upload(*item) for item in plan.upload)
+            await client.status()
+            _print_space_delta(used_before, client.ledger)
+            return plan, uploaded, deleted, time.perf_counter() - started
+
+    try:
+        plan, uploaded, deleted, elapsed = asyncio.run(run())
+    finally:
+        if not args.dry_run:
+            _save_device_state(args.host)
+
+    if optimized:
+        before = sum(size for _, dest, _, size in plan.upload if dest in optimized)
+        _print_savings(f"optimized {len(optimized)} images", before, sum(len(d) for d in optimized.values()))
+    if args.dry_run:
+        for _, dest, _, size in plan.upload:
+            print(f"would upload {dest} ({upload_size(dest, size)} bytes)")
+        for path in plan.delete:
+            print(f"would delete {path}")
+        print(
+            f"dry run: {len(plan.upload)} to upload ({sum(upload_size(dest, size) for _, dest, _, size in plan.upload)} bytes), "
+            f"{len(plan.unchanged)} unchanged, {len(plan.delete)} to delete"
+        )
+        return 0
+    sent = sum(upload_size(dest, size) for (_, dest, _, size), r in zip(plan.upload, uploaded) if not isinstance(r, BaseException))
+    print(
+        f"synced {args.localdir} -> {remotedir}: "
+        f"{sum(1 for r in uploaded if not isinstance(r, BaseException))} uploaded ({sent} bytes), "
+        f"{len(plan.unchanged)} unchanged, "
+        f"{sum(1 for r in deleted if not isinstance(r, BaseException))} deleted in {elapsed:.2f}s"
+    )
+    _raise_failures("sync", uploaded + deleted)
+    return 0
+
+
+BACKUP_MANIFEST_NAME = ".awtrix-backup.json"
+
+
+class _ArchiveWriter:
+    def __init__(self, path: str) -> None:
+        import tarfile
+        import zipfile
+
+        lower = path.lower()
+        self._zip: zipfile.ZipFile | None = None
+        self._tar: tarfile.TarFile | None = None
+        if lower.endswith(".zip"):
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        elif lower.endswith((".tar.gz", ".tgz")):
+            self._tar = tarfile.open(path, "w:gz")
+        elif lower.endswith(".tar"):
+            self._tar = tarfile.open(path, "w")
+        else:
+            raise ValueError(f"Unsupported archive type (use .tar.gz, .tgz, .tar or .zip): {path}")
+        self._mtime = time.time()
+
+    def add(self, name: str, data: bytes) -> None:
+        import tarfile
+
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        elif self._tar is not None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(self._mtime)
+            self._tar.addfile(info, BytesIO(data))
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+def cmd_backup(args: argparse.Namespace) -> int:
+    import asyncio
+    import hashlib
+    from datetime import datetime, timezone
+
+    files: dict[str, dict[str, object]] = {}
+    results: list[None | BaseException] = []
+    archive = _ArchiveWriter(args.out)
+
+    async def run() -> int:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            pending = [(path, size) for path, kind, size in await _walk_tree(client, args.root, refresh=True) if kind == "file"][::-1]
+
+            async def worker() -> None:
+                # Each worker holds at most one file in memory, so peak RAM is bounded by the worker count.
+                while pending:
+                    path, _ = pending.pop()
+                    try:
+                        data = await client.read_file(path)
+                    except Exception as exc:
+                        results.append(exc)
+                        continue
+                    archive.add(path.lstrip("/"), data)
+                    files[path] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+                    results.append(None)
+
+            total = len(pending)
+            await asyncio.gather(*(worker() for _ in range(client.workers)))
+            return total
+
+    started = time.perf_counter()
+    try:
+        total = asyncio.run(run())
+        manifest = {
+            "host": args.host,
+            "root": args.root,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "files": files,
+        }
+        archive.add(BACKUP_MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    finally:
+        archive.close()
+
+    _device_state(args.host).update(files)
+    _save_device_state(args.host)
+
+    size = sum(_bytes_int(f["size"]) for f in files.values())
+    print(f"backed up {len(files)} of {total} files ({size} bytes) to {args.out} in {time.perf_counter() - started:.2f}s")
+    _raise_failures("download", results)
+    return 0
+
+
+def _iter_archive(path: str) -> Iterator[tuple[str, bytes]]:
+    import tarfile
+    import zipfile
+
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, zf.read(info)
+        return
+    with tarfile.open(path, "r|*") as tf:
+        for member in tf:
+            if member.isfile():
+                f = tf.extractfile(member)
+                if f is not None:
+                    yield member.name, f.read()
+
+
+def _restore_journal_path(host: str, archive: str) -> str:
+    import hashlib
+
+    st = os.stat(archive)
+    key = hashlib.sha256(f"{os.path.abspath(archive)}|{st.st_size}|{st.st_mtime_ns}".encode()).hexdigest()[:16]
+    return os.path.join(_cache_dir("restore"), f"{_host_slug(host)}-{key}.json")
+
+
+def cmd_restore(args: argparse.Namespace) -> int:
+    import asyncio
+    import hashlib
+
+    journal_path = _restore_journal_path(args.host, args.archive)
+    journal: dict[str, str] = _load_json_file(journal_path, {})  # type: ignore[assignment]
+    state = _device_state(args.host)
+    uploaded: list[tuple[str, int]] = []
+    skipped: list[str] = []
+    results: list[None | BaseException] = []
+
+    async def run() -> None:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            remote_sizes = {path: size for path, kind, size in await _walk_tree(client, "/", refresh=True) if kind == "file"}
+            queue: asyncio.Queue[tuple[str, bytes, str] | None] = asyncio.Queue(maxsize=client.workers)
+
+            async def worker() -> None:
+                while (item := await queue.get()) is not None:
+                    dest, data, digest = item
+                    try:
+                        if not args.dry_run:
+                            await client.upload_bytes(dest, data)
+                            journal[dest] = digest
+                            state[dest] = {"sha256": digest, "size": len(data)}
+                            _save_json_file(journal_path, journal)
+                    except Exception as exc:
+                        results.append(exc)
+                        continue
+                    uploaded.append((dest, len(data)))
+                    results.append(None)
+
+            workers = [asyncio.create_task(worker()) for _ in range(client.workers)]
+            try:
+                # Entries are read one at a time; the bounded queue keeps at most one file per worker in memory.
+                for name, data in _iter_archive(args.archive):
+                    if name == BACKUP_MANIFEST_NAME:
+                        continue
+                    dest = "/" + name.lstrip("/")
+                    digest = hashlib.sha256(data).hexdigest()
+                    known = state.get(dest, {})
+                    if journal.get(dest) == digest or (
+                        remote_sizes.get(dest) == len(data) and known.get("sha256") == digest
+                    ):
+                        skipped.append(dest)
+                        continue
+                    await queue.put((dest, data, digest))
+            finally:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+
+            if uploaded and not args.dry_run and not args.no_reboot and not any(isinstance(r, BaseException) for r in results):
+                await client.reboot()
+                print("rebooting device (POST /api/reboot)")
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        if not args.dry_run:
+            _save_device_state(args.host)
+
+    sent = sum(size for _, size in uploaded)
+    if args.dry_run:
+        for dest, size in uploaded:
+            print(f"would upload {dest} ({size} bytes)")
+        print(f"dry run: {len(uploaded)} to upload ({sent} bytes), {len(skipped)} already identical")
+        return 0
+    print(
+        f"restored {len(uploaded)} files ({sent} bytes), skipped {len(skipped)} identical "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    _raise_failures("upload", results)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    return 0
+
+
+def cmd_setup(args: argparse.Namespace) -> int:
+    if not args.upgrade:
+        try:
+            import PIL
+
+            print(f"Pillow {PIL.__version__} already importable from {os.path.dirname(PIL.__file__)}")
+            return 0
+        except ImportError:
+            pass
+        if _activate_pillow_venv(_pillow_venv_dir()):
+            import PIL
+
+            print(f"Pillow {PIL.__version__} ready in {_pillow_venv_dir()}")
+            return 0
+    version = provision_pillow(upgrade=args.upgrade)
+    print(f"Pillow {version} ready in {_pillow_venv_dir()}")
     return 0
 
 
 def cmd_icons_list(args: argparse.Namespace) -> int:
-    args.dir = "/ICONS"
+    args.dir = ["/ICONS"]
     return cmd_list(args)
 
 
-def cmd_icons_import_lametric(args: argparse.Namespace) -> int:
-    icon_id = str(args.id).strip()
-    if not icon_id.isdigit():
-        raise ValueError("Icon ID must be numeric")
-
-    url = LAMETRIC_THUMB_URL.format(id=icon_id)
-    req = urllib.request.Request(url, method="GET")
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        content_type = _parse_content_type(resp.headers.get("content-type"))
-        raw = resp.read()
+def _read_icon_ids(args: argparse.Namespace) -> list[str]:
+    raw_ids: list[str] = list(args.ids)
+    if args.from_file:
+        if args.from_file == "-":
+            text = sys.stdin.read()
+        else:
+            with open(args.from_file, "r", encoding="utf-8") as f:
+                text = f.read()
+        raw_ids.extend(line.split("#", 1)[0] for line in text.splitlines())
+    ids: list[str] = []
+    for value in raw_ids:
+        for icon_id in value.replace(",", " ").split():
+            if not icon_id.isdigit():
+                raise ValueError(f"Icon ID must be numeric: {icon_id}")
+            ids.append(icon_id)
+    if not ids:
+        raise ValueError("No icon IDs given (pass IDs, --from-file FILE or --from-file -)")
+    return list(dict.fromkeys(ids))
+
+
+def _open_lametric_icon(icon_id: str, cache: LametricCache | None, refresh: bool) -> LametricDownload:
+    if cache is not None:
+        return cache.open(icon_id, refresh=refresh)
+    import urllib.request
+
+    req = urllib.request.Request(LAMETRIC_THUMB_URL.format(id=icon_id), method="GET")
+    resp = urllib.request.urlopen(req, timeout=30)
+    return LametricDownload(resp, _parse_content_type(resp.headers.get("content-type")), _content_length(resp.headers.get("content-length")))
+
+
+def _read_lametric_icon(icon_id: str, cache: LametricCache | None) -> bytes:
+    with _open_lametric_icon(icon_id, cache, False) as download:
+        return download.read()
+
+
+def _lametric_passthrough(download: LametricDownload, out_format: str) -> bool:
+    # GIFs, and baseline JPEGs when JPEG output is wanted, go to the device byte for byte, so they can stream.
+    if download.length is None:
+        return False
+    if download.content_type == "image/gif":
+        return True
+    if download.content_type not in ("image/jpeg", "image/jpg") or out_format != "jpeg":
+        return False
+    import awtrix_image
+
+    size = 1024
+    while True:
+        head = download.peek(size)
+        if head[:2] != b"\xff\xd8":
+            return False
+        if awtrix_image.jpeg_is_baseline(head):
+            return True
+        if len(head) < size or size >= LAMETRIC_SNIFF_LIMIT:
+            return False
+        size *= 4
+
+
+def _convert_lametric_icon(
+    icon_id: str,
+    cache: LametricCache | None,
+    raw: bytes,
+    content_type: str,
+    out_format: str = "jpeg",
+    options: "awtrix_image.OptimizeOptions | None" = None,
+) -> tuple[str, bytes, str, int]:
+    def derived(key: str, produce: Callable[[], bytes]) -> bytes:
+        return produce() if cache is None else cache.derive(icon_id, key, produce)
 
     if content_type == "image/gif":
-        payload = raw
-        ext = ".gif"
-        out_type = "image/gif"
+        out_format, base = "gif", raw
     elif content_type in ("image/png", "image/jpeg", "image/jpg"):
-        payload = _convert_to_jpeg(raw)
-        ext = ".jpg"
-        out_type = "image/jpeg"
+        convert, key = (_convert_to_gif, GIF_CONVERSION_KEY) if out_format == "gif" else (_convert_to_jpeg, JPEG_CONVERSION_KEY)
+        base = derived(key, lambda: convert(raw))
     else:
-        raise RuntimeError(f"Unsupported LaMetric content-type: {content_type or 'unknown'}")
+        raise RuntimeError(f"Unsupported LaMetric content-type for {icon_id}: {content_type or 'unknown'}")
+    out_type = "image/gif" if out_format == "gif" else "image/jpeg"
+    if options is None:
+        return content_type, base, out_type, len(base)
+    # Optimize from the original download so JPEG output is not compressed twice.
+    payload = derived(f"{out_format}:{options.key}", lambda: _optimize_image(raw, out_format, options))
+    return content_type, payload, out_type, len(base)
 
-    dest = require_leading_slash(os.path.join(args.dest_dir, f"{icon_id}{ext}").replace("\\", "/"))
-    client = AwtrixClient(args.host)
 
-    before = client.status()
-    free = _bytes_int(before.get("totalBytes")) - _bytes_int(before.get("usedBytes"))
-    if not args.force and free > 0 and len(payload) > free:
-        raise RuntimeError(f"Not enough free space: need {len(payload)} bytes, have {free} bytes (use --force to try anyway)")
+def cmd_icons_import_lametric(args: argparse.Namespace) -> int:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    ids = _read_icon_ids(args)
+    dest_dir = require_leading_slash(args.dest_dir.rstrip("/") or "/")
+    options = _optimize_options(args)
+    cache = None if args.no_cache else _lametric_cache()
+    started = time.perf_counter()
+
+    def dest_for(icon_id: str, out_type: str) -> str:
+        return posixpath.join(dest_dir, f"{icon_id}{'.gif' if out_type == 'image/gif' else '.jpg'}")
+
+    async def run() -> tuple[int, list[None | BaseException]]:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            present: dict[str, str] = {}
+            if not args.overwrite:
+                try:
+                    entries = await client.list_dir(dest_dir)
+                except RuntimeError:
+                    entries = []
+                for entry in entries:
+                    path = _entry_path(dest_dir, entry)
+                    stem, ext = posixpath.splitext(posixpath.basename(path))
+                    if ext.lower() in (".gif", ".jpg") and stem.isdigit():
+                        present.setdefault(stem, path)
+            for icon_id in ids:
+                if icon_id in present:
+                    print(f"skipped LaMetric {icon_id}: already on device as {present[icon_id]}")
+            todo = [i for i in ids if i not in present]
+            if not todo:
+                return len(ids), []
+
+            slots = asyncio.Semaphore(max(1, args.workers))
+            savings: list[tuple[int, int]] = []
+            reserved = 0
+
+            async def upload(icon_id: str, content_type: str, out_type: str, size: int, send: Callable[[str], Awaitable[None]]) -> None:
+                nonlocal reserved
+                dest = dest_for(icon_id, out_type)
+                # Sizes are only known once each icon is open, so check against everything still in flight.
+                reserved += size
+                try:
+                    await client.ensure_free(reserved, args.force)
+                    await send(dest)
+                finally:
+                    reserved -= size
+                print(f"imported LaMetric {icon_id} ({content_type}) -> {dest} ({size} bytes)")
+
+            async def import_icon(pool: ThreadPoolExecutor, icon_id: str) -> None:
+                async with slots:
+                    try:
+                        download = await _run_in_executor(pool, _open_lametric_icon, icon_id, cache, args.refresh)
+                    except Exception as exc:
+                        raise RuntimeError(f"LaMetric {icon_id}: {exc}") from exc
+                    with download:
+                        if options is None and await _run_in_executor(pool, _lametric_passthrough, download, args.format):
+                            # Passthrough: the response body streams into the upload as it arrives.
+                            out_type = "image/gif" if download.content_type == "image/gif" else "image/jpeg"
+                            size = download.length or 0
+
+                            async def send(dest: str) -> None:
+                                try:
+                                    await client.upload_stream(dest, download, size, content_type=out_type)
+                                except RuntimeError as exc:
+                                    if not isinstance(exc.__cause__, (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError)):
+                                        raise
+                                    # A streamed body cannot be replayed after a reset. Finish the download so it lands in
+                                    # the cache, then resend the icon from memory, where the pool can retry it.
+                                    await _run_in_executor(pool, download.read)
+                                    download.close()
+                                    raw = await _run_in_executor(pool, _read_lametric_icon, icon_id, cache)
+                                    await client.upload_bytes(dest, raw, content_type=out_type)
+
+                            await upload(icon_id, download.content_type, out_type, size, send)
+                            return
+                        try:
+                            raw = await _run_in_executor(pool, download.read)
+                            # Closing commits the download to the cache, which derived conversions are keyed on.
+                            download.close()
+                            content_type, payload, out_type, base_size = await _run_in_executor(
+                                pool, _convert_lametric_icon, icon_id, cache, raw, download.content_type, args.format, options
+                            )
+                        except Exception as exc:
+                            raise RuntimeError(f"LaMetric {icon_id}: {exc}") from exc
+                    if options is not None:
+                        _warn_over_budget(dest_for(icon_id, out_type), len(payload), options)
+                        savings.append((base_size, len(payload)))
+                    await upload(
+                        icon_id, content_type, out_type, len(payload), lambda dest: client.upload_bytes(dest, payload, content_type=out_type)
+                    )
+
+            # One /status seeds the ledger for every free-space check, and one reconciles after the batch.
+            await client.ensure_free(0, args.force)
+            used_before = client.ledger.used
+            with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(todo)))) as pool:
+                results: list[None | BaseException] = await _gather_settled(import_icon(pool, i) for i in todo)
+            await client.status()
+            _print_space_delta(used_before, client.ledger)
+            if savings:
+                _print_savings(f"optimized {len(savings)} icons", sum(b for b, _ in savings), sum(a for _, a in savings))
+            return len(ids) - len(todo), results
+
+    skipped, results = asyncio.run(run())
+    if len(ids) > 1:
+        imported = sum(1 for r in results if r is None)
+        print(f"imported {imported} of {len(ids)} icons ({skipped} already present) in {time.perf_counter() - started:.2f}s")
+    _raise_failures("import", results)
+    return 0
+
+
+BATCH_OPS = ("status", "list", "upload", "delete", "rename", "import")
+
+
+def _batch_field(cmd: dict[str, object], name: str) -> str:
+    value = cmd.get(name)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"missing string field {name!r}")
+    return value
 
+
+def _batch_import(client: AwtrixClient, cache: LametricCache | None, cmd: dict[str, object]) -> dict[str, object]:
+    icon_id = str(cmd.get("icon", ""))
+    if not icon_id.isdigit():
+        raise ValueError(f"Icon ID must be numeric: {icon_id or '(missing)'}")
+    dest_dir = require_leading_slash(str(cmd.get("dest_dir", "/ICONS")).rstrip("/") or "/")
+    if not cmd.get("overwrite"):
+        try:
+            entries = client.list_dir(dest_dir)
+        except RuntimeError:
+            entries = []
+        for entry in entries:
+            path = _entry_path(dest_dir, entry)
+            stem, ext = posixpath.splitext(posixpath.basename(path))
+            if stem == icon_id and ext.lower() in (".gif", ".jpg"):
+                return {"icon": icon_id, "dest": path, "skipped": True}
+    out_format = str(cmd.get("format", "jpeg"))
+    if out_format not in ("jpeg", "gif"):
+        raise ValueError(f"format must be jpeg or gif: {out_format}")
+    try:
+        download = _open_lametric_icon(icon_id, cache, bool(cmd.get("refresh")))
+    except Exception as exc:
+        raise RuntimeError(f"LaMetric {icon_id}: {exc}") from exc
+    with download:
+        if _lametric_passthrough(download, out_format):
+            out_type = "image/gif" if download.content_type == "image/gif" else "image/jpeg"
+            dest = posixpath.join(dest_dir, f"{icon_id}{'.gif' if out_type == 'image/gif' else '.jpg'}")
+            size = download.length or 0
+            client.ensure_free(size, bool(cmd.get("force")))
+            try:
+                client.upload_stream(dest, download, size, content_type=out_type)
+            except RuntimeError as exc:
+                if not isinstance(exc.__cause__, ConnectionError):
+                    raise
+                # As in import-lametric: the streamed body cannot be replayed, so cache the icon and resend it from memory.
+                download.read()
+                download.close()
+                client.upload_bytes(dest, _read_lametric_icon(icon_id, cache), content_type=out_type)
+            return {"icon": icon_id, "dest": dest, "bytes": size, "source_type": download.content_type, "skipped": False}
+        try:
+            raw = download.read()
+            download.close()
+            content_type, payload, out_type, _ = _convert_lametric_icon(icon_id, cache, raw, download.content_type, out_format)
+        except Exception as exc:
+            raise RuntimeError(f"LaMetric {icon_id}: {exc}") from exc
+    dest = posixpath.join(dest_dir, f"{icon_id}{'.gif' if out_type == 'image/gif' else '.jpg'}")
+    client.ensure_free(len(payload), bool(cmd.get("force")))
     client.upload_bytes(dest, payload, content_type=out_type)
-    after = client.status()
-    _print_space_delta(before, after)
-    print(f"imported LaMetric {icon_id} ({content_type}) -> {dest} ({len(payload)} bytes)")
+    return {"icon": icon_id, "dest": dest, "bytes": len(payload), "source_type": content_type, "skipped": False}
+
+
+def _batch_run(client: AwtrixClient, no_cache: bool, cmd: dict[str, object]) -> object:
+    op = cmd.get("op")
+    if op == "status":
+        return client.status()
+    if op == "list":
+        return client.list_dir(require_leading_slash(_batch_field(cmd, "dir")), bool(cmd.get("refresh")))
+    if op == "upload":
+        local, dest = _batch_field(cmd, "local"), require_leading_slash(_batch_field(cmd, "dest"))
+        size = os.path.getsize(local)
+        client.ensure_free(size, bool(cmd.get("force")))
+        client.upload_file(dest, local)
+        return {"dest": dest, "bytes": size}
+    if op == "delete":
+        path = require_leading_slash(_batch_field(cmd, "path"))
+        client.delete(path)
+        return {"path": path}
+    if op == "rename":
+        old, new = require_leading_slash(_batch_field(cmd, "old")), require_leading_slash(_batch_field(cmd, "new"))
+        client.rename(old, new)
+        return {"old": old, "new": new}
+    if op == "import":
+        # The icon cache is only opened once a batch actually imports something.
+        return _batch_import(client, None if no_cache else _lametric_cache(), cmd)
+    raise ValueError(f"unknown op {op!r} (expected one of: {', '.join(BATCH_OPS)})")
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    client = AwtrixClient(args.host, index=_fs_index(args))
+    source = sys.stdin if args.from_file == "-" else open(args.from_file, "r", encoding="utf-8")
+    started = time.perf_counter()
+    done = failed = 0
+    try:
+        # Results are flushed line by line so a caller can pipe commands in and read answers as they complete.
+        for lineno, line in enumerate(source, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            op_started = time.perf_counter()
+            out: dict[str, object] = {"line": lineno}
+            try:
+                cmd = json.loads(line)
+                if not isinstance(cmd, dict):
+                    raise ValueError("command must be a JSON object")
+                if "id" in cmd:
+                    out["id"] = cmd["id"]
+                out["op"] = cmd.get("op")
+                out.update(ok=True, result=_batch_run(client, args.no_cache, cmd))
+            except (OSError, RuntimeError, ValueError) as exc:
+                failed += 1
+                out.update(ok=False, error=str(exc))
+            done += 1
+            out["ms"] = round((time.perf_counter() - op_started) * 1000, 1)
+            print(json.dumps(out, sort_keys=True), flush=True)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    eprint(f"batch: {done} commands, {failed} failed in {time.perf_counter() - started:.2f}s")
+    return 2 if failed else 0
+
+
+def _icon_name(path: str) -> str:
+    return posixpath.splitext(posixpath.basename(path))[0]
+
+
+def _group_duplicates(contents: dict[str, bytes], tolerance: float | None) -> list[tuple[str, list[tuple[str, float]]]]:
+    import awtrix_image
+    import hashlib
+
+    by_digest: dict[str, list[str]] = {}
+    for path, data in contents.items():
+        by_digest.setdefault(hashlib.sha256(data).hexdigest(), []).append(path)
+    # Identical bytes are decoded once; clusters are anchored on the first thumbnail that opened them.
+    thumbs: dict[str, bytes] = {}
+    clusters: list[tuple[bytes, list[str]]] = []
+    pillow: bool | None = None
+    bytes_only: list[str] = []
+    for members in by_digest.values():
+        thumb = b""
+        if tolerance is not None:
+            try:
+                try:
+                    anim = awtrix_image.decode(contents[members[0]])
+                except awtrix_image.UnsupportedImage:
+                    # Mostly JPEGs. Only use Pillow when it is already there; dedupe should never install it.
+                    pillow = _pillow_importable() if pillow is None else pillow
+                    if not pillow:
+                        raise
+                    anim = _pillow_animation(contents[members[0]], 128, 128)[0]
+                thumb = awtrix_image.thumbnail(anim)
+            except awtrix_image.UnsupportedImage:
+                bytes_only.extend(members)
+            except Exception as exc:
+                eprint(f"warning: cannot decode {members[0]}; comparing bytes only ({exc})")
+        thumbs.update((p, thumb) for p in members)
+        for anchor, found in clusters:
+            if thumb and anchor and awtrix_image.thumbnail_distance(anchor, thumb) <= (tolerance or 0):
+                found.extend(members)
+                break
+        else:
+            clusters.append((thumb, list(members)))
+    if bytes_only:
+        eprint(f"warning: {len(bytes_only)} files need Pillow to compare pixels (run the 'setup' command); compared bytes only")
+
+    groups: list[tuple[str, list[tuple[str, float]]]] = []
+    for _, found in clusters:
+        if len(found) > 1:
+            keep = min(found, key=lambda p: (len(contents[p]), p))
+            groups.append(
+                (
+                    keep,
+                    [
+                        (p, 0.0 if contents[p] == contents[keep] else awtrix_image.thumbnail_distance(thumbs[keep], thumbs[p]))
+                        for p in sorted(found)
+                        if p != keep
+                    ],
+                )
+            )
+    return sorted(groups)
+
+
+def cmd_icons_dedupe(args: argparse.Namespace) -> int:
+    import asyncio
+
+    dir_path = require_leading_slash(args.dir.rstrip("/") or "/")
+    tolerance = None if args.exact else args.tolerance
+    started = time.perf_counter()
+
+    async def run() -> tuple[int, list[tuple[str, list[tuple[str, float]]]], dict[str, bytes], list[BaseException], list[None | BaseException]]:
+        async with AsyncAwtrixClient(args.host, args.concurrency, _fs_index(args), args.max_concurrency) as client:
+            paths = [_entry_path(dir_path, e) for e in await client.list_dir(dir_path) if e.get("type") != "dir"]
+            # Downloads share the device pool, so its concurrency controller bounds how many are in flight.
+            fetched = await _gather_settled(client.read_file(p) for p in paths)
+            contents = {p: d for p, d in zip(paths, fetched) if not isinstance(d, BaseException)}
+            failures = [RuntimeError(f"{p}: {d}") for p, d in zip(paths, fetched) if isinstance(d, BaseException)]
+            groups = _group_duplicates(contents, tolerance)
+            deleted: list[None | BaseException] = []
+            drops = [p for _, members in groups for p, _ in members]
+            if args.delete and drops:
+                used_before = _bytes_int((await client.status()).get("usedBytes"))
+                deleted = await _gather_settled(client.delete(p) for p in drops)
+                await client.status()
+                if not args.json:
+                    _print_space_delta(used_before, client.ledger)
+            return len(paths), groups, contents, failures, deleted
+
+    total, groups, contents, failures, deleted = asyncio.run(run())
+    reclaimable = sum(len(contents[p]) for _, members in groups for p, _ in members)
+    rename_map = {
+        _icon_name(p): _icon_name(keep) for keep, members in groups for p, _ in members if _icon_name(p) != _icon_name(keep)
+    }
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "dir": dir_path,
+                    "files": total,
+                    "groups": [
+                        {
+                            "keep": keep,
+                            "duplicates": [{"path": p, "distance": round(d, 2), "size": len(contents[p])} for p, d in members],
+                            "reclaimable": sum(len(contents[p]) for p, _ in members),
+                        }
+                        for keep, members in groups
+                    ],
+                    "reclaimable": reclaimable,
+                    "rename_map": rename_map,
+                    "deleted": args.delete,
+                },
+                indent=2,
+                sort_keys=True,
+            )
+        )
+    else:
+        for keep, members in groups:
+            print(f"duplicates of {keep} ({len(contents[keep])} bytes):")
+            for path, distance in members:
+                match = "identical" if contents[path] == contents[keep] else f"similar, distance {distance:.1f}"
+                print(f"  {'deleted' if args.delete else 'duplicate'} {path} ({len(contents[path])} bytes, {match})")
+        duplicates = sum(len(members) for _, members in groups)
+        verb = "reclaimed" if args.delete else "reclaimable"
+        print(
+            f"{duplicates} duplicates in {len(groups)} groups among {len(contents)} files: "
+            f"{reclaimable} bytes {verb} in {time.perf_counter() - started:.2f}s"
+        )
+        if rename_map:
+            print("rename map (old icon name -> kept icon name):")
+            for old, new in sorted(rename_map.items()):
+                print(f"  {old} -> {new}")
+    _raise_failures("dedupe", [*failures, *deleted])
     return 0
 
 
+def _add_optimize_args(s: argparse.ArgumentParser) -> None:
+    s.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Shrink images before upload: fit the matrix, quantize GIF palettes, drop duplicate frames, strip metadata",
+    )
+    s.add_argument("--max-size", default="32x8", help="With --optimize: largest WIDTHxHEIGHT kept (default: 32x8, the matrix)")
+    s.add_argument(
+        "--max-bytes",
+        type=int,
+        help="With --optimize: per-file byte budget; JPEG quality and GIF colors are lowered until it fits",
+    )
+    s.add_argument("--quality", type=int, default=95, help="With --optimize: starting JPEG quality (default: 95)")
+    s.add_argument("--colors", type=int, default=256, help="With --optimize: maximum GIF palette size (default: 256)")
+
+
+def _host_netloc(host: str) -> str:
+    return urllib.parse.urlsplit(host if "://" in host else f"http://{host}").netloc
+
+
+def _read_hosts(args: argparse.Namespace) -> list[str]:
+    values: list[str] = [args.host] if args.host else []
+    values.extend(args.hosts or [])
+    if args.inventory:
+        with open(args.inventory, "r", encoding="utf-8") as f:
+            values.extend(line.split("#", 1)[0] for line in f.read().splitlines())
+    hosts = [host for value in values for host in value.replace(",", " ").split()]
+    return list(dict.fromkeys(hosts))
+
+
+class _ContextRoutedStream:
+    # Fleet workers capture into a context variable, which pool workers inherit via _run_in_executor; everything else passes through.
+    def __init__(self, stream: object) -> None:
+        self._stream = stream
+        self._buffer: contextvars.ContextVar[StringIO | None] = contextvars.ContextVar("buffer", default=None)
+
+    def capture(self) -> StringIO:
+        buffer = StringIO()
+        self._buffer.set(buffer)
+        return buffer
+
+    def release(self) -> None:
+        self._buffer.set(None)
+
+    def write(self, text: str) -> int:
+        buffer = self._buffer.get()
+        return (buffer if buffer is not None else self._stream).write(text)  # type: ignore[attr-defined]
+
+    def flush(self) -> None:
+        if self._buffer.get() is None:
+            self._stream.flush()  # type: ignore[attr-defined]
+
+    def isatty(self) -> bool:
+        return False
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._stream, name)
+
+
+# Arguments that name a local output file; on a fleet each device needs its own, so they must contain {host}.
+_PER_HOST_OUTPUTS = ("out", "record")
+
+
+def _fan_out(args: argparse.Namespace, hosts: list[str]) -> int:
+    if args.cmd == "screen" and (args.watch or args.serve):
+        raise ValueError("screen --watch/--serve show a single device; use --host")
+    for attr in _PER_HOST_OUTPUTS:
+        value = getattr(args, attr, None)
+        if value and "{host}" not in value:
+            raise ValueError(f"{value}: output paths must contain {{host}} when running against several devices")
+    if getattr(args, "from_file", None) != "-":
+        return _fan_out_hosts(args, hosts)
+    # Every device needs the same list, and stdin can only be read once.
+    import tempfile
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        f.write(sys.stdin.read())
+    args.from_file = f.name
+    try:
+        return _fan_out_hosts(args, hosts)
+    finally:
+        os.unlink(f.name)
+
+
+def _fan_out_hosts(args: argparse.Namespace, hosts: list[str]) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    stdout, stderr = _ContextRoutedStream(sys.stdout), _ContextRoutedStream(sys.stderr)
+
+    def run(host: str) -> dict[str, object]:
+        host_args = argparse.Namespace(**vars(args))
+        host_args.host = host
+        for key, value in vars(args).items():
+            if isinstance(value, str) and "{host}" in value:
+                setattr(host_args, key, value.replace("{host}", _host_slug(host)))
+        out, err = stdout.capture(), stderr.capture()
+        netloc = _host_netloc(host)
+        with _TRAFFIC_LOCK:
+            before = _TRAFFIC.get(netloc, (0, 0, 0))
+        error = None
+        started = time.perf_counter()
+        try:
+            code = int(args.func(host_args))
+        except Exception as exc:
+            code, error = 2, str(exc)
+        finally:
+            seconds = time.perf_counter() - started
+            stdout.release()
+            stderr.release()
+        with _TRAFFIC_LOCK:
+            after = _TRAFFIC.get(netloc, (0, 0, 0))
+        return {
+            "host": host,
+            "ok": code == 0,
+            "exit_code": code,
+            "error": error,
+            "requests": after[0] - before[0],
+            "bytes_sent": after[1] - before[1],
+            "bytes_received": after[2] - before[2],
+            "seconds": round(seconds, 3),
+            "output": out.getvalue(),
+            "stderr": err.getvalue(),
+        }
+
+    started = time.perf_counter()
+    sys.stdout, sys.stderr = stdout, stderr  # type: ignore[assignment]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(hosts), args.parallel_hosts))) as pool:
+            results = list(pool.map(run, hosts))
+    finally:
+        sys.stdout, sys.stderr = stdout._stream, stderr._stream  # type: ignore[assignment]
+    elapsed = time.perf_counter() - started
+    failed = [r for r in results if not r["ok"]]
+
+    if args.fleet_json:
+        print(json.dumps({"seconds": round(elapsed, 3), "ok": len(results) - len(failed), "failed": len(failed), "hosts": results}, indent=2))
+        return 2 if failed else 0
+    for r in results:
+        for line in str(r["output"]).splitlines():
+            print(f"[{r['host']}] {line}")
+        for line in str(r["stderr"]).splitlines():
+            eprint(f"[{r['host']}] {line}")
+        if r["error"]:
+            eprint(f"[{r['host']}] Error: {r['error']}")
+    width = max(len("host"), *(len(str(r["host"])) for r in results))
+    print(f"{'host':{width}}  {'result':6} {'requests':>8} {'sent':>10} {'received':>10} {'seconds':>8}")
+    for r in results:
+        result = "ok" if r["ok"] else "FAILED"
+        print(f"{r['host']:{width}}  {result:6} {r['requests']:8} {r['bytes_sent']:10} {r['bytes_received']:10} {r['seconds']:8.2f}")
+    slowest = max(results, key=lambda r: float(r["seconds"]))  # type: ignore[arg-type]
+    print(
+        f"{len(results)} devices: {len(results) - len(failed)} ok, {len(failed)} failed in {elapsed:.2f}s "
+        f"(slowest {slowest['host']} {float(slowest['seconds']):.2f}s)"  # type: ignore[arg-type]
+    )
+    return 2 if failed else 0
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="AWTRIX HTTP filesystem helper")
-    p.add_argument("--host", required=True, help="AWTRIX host or base URL (e.g., 10.10.20.112 or http://10.10.20.112)")
+    p.add_argument("--host", help="AWTRIX host or base URL (e.g., 10.10.20.112 or http://10.10.20.112); required except for setup")
+    p.add_argument(
+        "--hosts",
+        action="append",
+        metavar="HOST[,HOST...]",
+        help="Run the command against several devices concurrently (repeatable, comma separated)",
+    )
+    p.add_argument("--inventory", metavar="FILE", help="Read device hosts from a file (whitespace/comma separated, # comments)")
+    p.add_argument("--parallel-hosts", type=int, default=16, help="Devices handled at once with --hosts/--inventory (default: 16)")
+    p.add_argument(
+        "--trace",
+        action="store_true",
+        help="Write one JSON line per device request (timings, bytes, status) to stderr, then print per-endpoint percentiles",
+    )
+    p.add_argument("--trace-file", metavar="FILE", help="Like --trace, but append the JSON lines to FILE")
+    p.add_argument("--fleet-json", action="store_true", help="With --hosts/--inventory, print per-device results and output as one JSON document")
+    p.add_argument(
+        "--concurrency",
+        type=int,
+        help="Fixed number of in-flight requests per device for multi-target commands "
+        "(default: adapt between 1 and --max-concurrency, starting where the last run settled)",
+    )
+    p.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=AIMD_MAX_CONCURRENCY,
+        help=f"Ceiling for adaptive concurrency (default: {AIMD_MAX_CONCURRENCY})",
+    )
+    p.add_argument(
+        "--index-ttl",
+        type=float,
+        default=FS_INDEX_TTL,
+        help="Reuse directory listings cached under .cache/index/ for this many seconds (default: 60; 0 always asks the device)",
+    )
 
     sub = p.add_subparsers(dest="cmd", required=True)
 
+    s = sub.add_parser("setup", help="Provision Pillow for PNG/JPEG conversion ahead of time (no device access)")
+    s.add_argument("--upgrade", action="store_true", help="Reinstall/upgrade Pillow in the venv")
+    s.set_defaults(func=cmd_setup, needs_host=False)
+
     s = sub.add_parser("status", help="Print /status JSON")
     s.set_defaults(func=cmd_status)
 
-    s = sub.add_parser("list", help="List directory via /list?dir=...")
-    s.add_argument("--json", action="store_true", help="Output raw JSON")
-    s.add_argument("dir", help="Directory path on device (must start with /)")
+    s = sub.add_parser("list", help="List directories via /list?dir=...")
+    s.add_argument("--json", action="store_true", help="Output raw JSON (object keyed by directory when several are given)")
+    s.add_argument("dir", nargs="+", help="Directory path(s) on device (must start with /)")
     s.set_defaults(func=cmd_list)
 
+    s = sub.add_parser("tree", help="Recursively list a directory with sizes and per-directory totals")
+    s.add_argument("--refresh", action="store_true", help="Ignore the cached index and list every directory again")
+    s.add_argument("--json", action="store_true", help="Output entries and totals as JSON")
+    s.add_argument("root", nargs="?", default="/", help="Directory to walk (default: /)")
+    s.set_defaults(func=cmd_tree)
+
+    s = sub.add_parser("du", help="Show bytes and file counts per directory (recursive)")
+    s.add_argument("--depth", type=int, help="Only print directories up to this depth below the root")
+    s.add_argument("--refresh", action="store_true", help="Ignore the cached index and list every directory again")
+    s.add_argument("--json", action="store_true", help="Output totals as JSON")
+    s.add_argument("root", nargs="?", default="/", help="Directory to walk (default: /)")
+    s.set_defaults(func=cmd_du)
+
+    s = sub.add_parser("screen", help="Show the LiveView matrix (/api/screen) in the terminal")
+    s.add_argument("--watch", action="store_true", help="Keep polling and redraw changed cells until Ctrl-C")
+    s.add_argument("--record", metavar="PATH", help="Record to an animated .gif or .png (APNG) until --duration or Ctrl-C")
+    s.add_argument("--serve", metavar="[HOST]:PORT", help="Serve the screen over HTTP (MJPEG stream, PNG/JPEG snapshots) to any number of viewers")
+    s.add_argument("--scale", type=int, default=8, help="Pixel size of each matrix cell in --record/--serve output (default: 8)")
+    s.add_argument("--fps", type=float, default=5.0, help="Device polling rate for --watch/--record/--serve (default: 5; 0 = as fast as possible)")
+    s.add_argument("--duration", type=float, default=0.0, help="Stop --watch/--record/--serve after this many seconds (default: run until Ctrl-C)")
+    s.add_argument("--json", action="store_true", help="Print the raw frame as a JSON list of 0xRRGGBB ints")
+    s.set_defaults(func=cmd_screen)
+
     s = sub.add_parser("upload", help="Upload local file to device (POST /edit)")
     s.add_argument("--force", action="store_true", help="Skip free-space check")
     s.add_argument("local", help="Local file path")
     s.add_argument("dest", help="Destination path on device (must start with /)")
+    _add_optimize_args(s)
     s.set_defaults(func=cmd_upload)
 
     s = sub.add_parser("create", help="Create empty file/path (PUT /edit with path=...)")
@@ -375,10 +3360,43 @@ def build_parser() -> argparse.ArgumentParser:
     s.add_argument("new", help="New path (must start with /)")
     s.set_defaults(func=cmd_rename)
 
-    s = sub.add_parser("delete", help="Delete a file (DELETE /edit with path=...)")
-    s.add_argument("path", help="Path to delete (must start with /)")
+    s = sub.add_parser("delete", help="Delete files (DELETE /edit with path=...)")
+    s.add_argument(
+        "--glob",
+        action="append",
+        default=[],
+        help="Delete files matching a pattern in the last path component (e.g. '/ICONS/*.gif'); repeatable",
+    )
+    s.add_argument("--from-file", help="Read paths to delete from a file, one per line ('-' for stdin)")
+    s.add_argument("--dry-run", action="store_true", help="Print matching paths without deleting")
+    s.add_argument("path", nargs="*", help="Path(s) to delete (must start with /)")
     s.set_defaults(func=cmd_delete)
 
+    s = sub.add_parser("sync", help="Upload new/changed files from a local directory (skips unchanged files)")
+    s.add_argument("--delete", action="store_true", help="Delete remote files that do not exist locally")
+    s.add_argument("--force", action="store_true", help="Skip free-space check")
+    s.add_argument("--dry-run", action="store_true", help="Show what would change without uploading or deleting")
+    s.add_argument("localdir", help="Local directory (top-level files only)")
+    s.add_argument("remotedir", help="Directory on device (must start with /)")
+    _add_optimize_args(s)
+    s.set_defaults(func=cmd_sync)
+
+    s = sub.add_parser("batch", help="Run newline-delimited JSON commands (status, list, upload, delete, rename, import) over one connection")
+    s.add_argument("--from-file", default="-", help="Read commands from a file instead of stdin")
+    s.add_argument("--no-cache", action="store_true", help="Bypass the local LaMetric icon cache for import commands")
+    s.set_defaults(func=cmd_batch)
+
+    s = sub.add_parser("backup", help="Download the device filesystem into a .tar.gz/.tar/.zip archive")
+    s.add_argument("--root", default="/", help="Directory to back up (default: /)")
+    s.add_argument("out", help="Archive path (.tar.gz, .tgz, .tar or .zip)")
+    s.set_defaults(func=cmd_backup)
+
+    s = sub.add_parser("restore", help="Upload files from a backup archive, skipping identical ones, then reboot")
+    s.add_argument("--dry-run", action="store_true", help="Show what would be uploaded without changing the device")
+    s.add_argument("--no-reboot", action="store_true", help="Do not call /api/reboot after restoring")
+    s.add_argument("archive", help="Archive created by the backup command")
+    s.set_defaults(func=cmd_restore)
+
     icons = sub.add_parser("icons", help="Icon-specific helpers")
     icons_sub = icons.add_subparsers(dest="icons_cmd", required=True)
 
@@ -386,10 +3404,35 @@ def build_parser() -> argparse.ArgumentParser:
     s.add_argument("--json", action="store_true", help="Output raw JSON")
     s.set_defaults(func=cmd_icons_list)
 
-    s = icons_sub.add_parser("import-lametric", help="Download LaMetric icon and save to /ICONS/<id>.jpg (GIF preserved)")
+    s = icons_sub.add_parser("dedupe", help="Find duplicate icons (same bytes or same pixels) and optionally delete them")
+    s.add_argument("--dir", default="/ICONS", help="Directory to scan (default: /ICONS)")
+    s.add_argument("--exact", action="store_true", help="Only group byte-identical files (no image decoding)")
+    s.add_argument(
+        "--tolerance",
+        type=float,
+        default=8.0,
+        help="Largest mean per-channel difference (0-255) between 8x8 thumbnails to count as the same icon (default: 8)",
+    )
+    s.add_argument("--delete", action="store_true", help="Delete duplicates, keeping the smallest file of each group")
+    s.add_argument("--json", action="store_true", help="Output groups and the rename map as JSON")
+    s.set_defaults(func=cmd_icons_dedupe)
+
+    s = icons_sub.add_parser("import-lametric", help="Download LaMetric icons and save to /ICONS/<id>.jpg (GIF preserved)")
     s.add_argument("--dest-dir", default="/ICONS", help="Destination directory on device (default: /ICONS)")
     s.add_argument("--force", action="store_true", help="Skip free-space check")
-    s.add_argument("id", help="LaMetric icon ID (numeric)")
+    s.add_argument("--refresh", action="store_true", help="Revalidate the cached icon with LaMetric (ETag/Last-Modified)")
+    s.add_argument("--no-cache", action="store_true", help="Bypass the local icon cache")
+    s.add_argument("--from-file", help="Read icon IDs from a file, whitespace/comma separated ('-' for stdin)")
+    s.add_argument("--overwrite", action="store_true", help="Import IDs even if /ICONS already has <id>.gif or <id>.jpg")
+    s.add_argument("--workers", type=int, default=8, help="Parallel LaMetric downloads/conversions (default: 8)")
+    s.add_argument(
+        "--format",
+        choices=("jpeg", "gif"),
+        default="jpeg",
+        help="Output for PNG/JPEG sources: baseline JPEG (default) or lossless GIF; GIF sources are kept as-is",
+    )
+    _add_optimize_args(s)
+    s.add_argument("ids", nargs="*", metavar="id", help="LaMetric icon ID(s) (numeric)")
     s.set_defaults(func=cmd_icons_import_lametric)
 
     return p
@@ -398,7 +3441,19 @@ def build_parser() -> argparse.ArgumentParser:
 def main() -> int:
     parser = build_parser()
     args = parser.parse_args()
+    needs_host = getattr(args, "needs_host", True)
+    fleet = needs_host and bool(args.hosts or args.inventory)
+    if needs_host and not (args.host or fleet):
+        parser.error("the following arguments are required: --host (or --hosts/--inventory)")
+    global _TRACER
+    if args.trace or args.trace_file:
+        _TRACER = RequestTracer(args.trace_file or "-")
     try:
+        if fleet:
+            hosts = _read_hosts(args)
+            if not hosts:
+                raise ValueError("No hosts given in --hosts/--inventory")
+            return _fan_out(args, hosts)
         return int(args.func(args))
     except KeyboardInterrupt:
         eprint("Interrupted")
@@ -406,6 +3461,13 @@ def main() -> int:
     except Exception as exc:
         eprint(f"Error: {exc}")
         return 2
+    finally:
+        for index in _INDEXES.values():
+            index.save()
+        for host in _DEVICE_STATES:
+            _save_device_state(host)
+        if _TRACER is not None:
+            _TRACER.close()
 
 
 if __name__ == "__main__":
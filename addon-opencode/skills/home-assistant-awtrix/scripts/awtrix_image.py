@@ -0,0 +1,1040 @@
+#!/usr/bin/env python3
+import heapq
+import math
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Sequence
+
+
+# Larger inputs are left to Pillow; the pure-Python path is tuned for 8x8 / 32x8 matrix icons.
+MAX_PURE_PIXELS = 128 * 128
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+@dataclass
+class Bitmap:
+    width: int
+    height: int
+    rgba: bytearray
+
+    def to_rgb_on_black(self) -> bytes:
+        out = bytearray(self.width * self.height * 3)
+        src = self.rgba
+        for i in range(self.width * self.height):
+            r, g, b, a = src[4 * i : 4 * i + 4]
+            if a != 255:
+                r, g, b = (r * a + 127) // 255, (g * a + 127) // 255, (b * a + 127) // 255
+            out[3 * i : 3 * i + 3] = bytes((r, g, b))
+        return bytes(out)
+
+
+@dataclass
+class Animation:
+    width: int
+    height: int
+    # (RGB on black, delay in ms) per frame
+    frames: list[tuple[bytes, int]]
+
+
+def sniff(data: bytes) -> str:
+    if data.startswith(PNG_SIGNATURE):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return ""
+
+
+# --- PNG -------------------------------------------------------------------
+
+
+def _paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(raw: bytes, height: int, stride: int, bpp: int) -> bytearray:
+    out = bytearray(height * stride)
+    prev = bytearray(stride)
+    pos = 0
+    for y in range(height):
+        ftype = raw[pos]
+        line = bytearray(raw[pos + 1 : pos + 1 + stride])
+        pos += 1 + stride
+        if len(line) != stride:
+            raise UnsupportedImage("Truncated PNG image data")
+        if ftype == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif ftype == 2:
+            for i in range(stride):
+                line[i] = (line[i] + prev[i]) & 0xFF
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                up_left = prev[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + _paeth(left, prev[i], up_left)) & 0xFF
+        elif ftype != 0:
+            raise UnsupportedImage(f"Unknown PNG filter type {ftype}")
+        out[y * stride : (y + 1) * stride] = line
+        prev = line
+    return out
+
+
+def _samples(line: bytes, count: int, depth: int) -> list[int]:
+    if depth == 8:
+        return list(line[:count])
+    if depth == 16:
+        return [(line[2 * i] << 8) | line[2 * i + 1] for i in range(count)]
+    per_byte = 8 // depth
+    mask = (1 << depth) - 1
+    out = []
+    for i in range(count):
+        byte = line[i // per_byte]
+        shift = 8 - depth * (i % per_byte + 1)
+        out.append((byte >> shift) & mask)
+    return out
+
+
+def decode_png(data: bytes) -> Bitmap:
+    if not data.startswith(PNG_SIGNATURE):
+        raise UnsupportedImage("Not a PNG file")
+    pos = len(PNG_SIGNATURE)
+    header: tuple[int, ...] | None = None
+    palette = b""
+    trns = b""
+    idat = bytearray()
+    while pos + 8 <= len(data):
+        length, ctype = struct.unpack(">I4s", data[pos : pos + 8])
+        body = data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+        if ctype == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif ctype == b"PLTE":
+            palette = body
+        elif ctype == b"tRNS":
+            trns = body
+        elif ctype == b"IDAT":
+            idat += body
+        elif ctype == b"IEND":
+            break
+    if header is None:
+        raise UnsupportedImage("PNG has no IHDR chunk")
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace:
+        raise UnsupportedImage("Interlaced PNG")
+    if width * height > MAX_PURE_PIXELS:
+        raise UnsupportedImage(f"PNG too large for the built-in decoder ({width}x{height})")
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if channels is None or depth not in (1, 2, 4, 8, 16):
+        raise UnsupportedImage(f"Unsupported PNG color type {color_type} / bit depth {depth}")
+
+    stride = (width * channels * depth + 7) // 8
+    rows = _unfilter(zlib.decompress(bytes(idat)), height, stride, max(1, channels * depth // 8))
+    maxval = (1 << depth) - 1
+    scale = (lambda v: v >> 8) if depth == 16 else (lambda v: v * 255 // maxval)
+    trns_key: tuple[int, ...] | None = None
+    if trns and color_type in (0, 2):
+        trns_key = struct.unpack(">" + "H" * (len(trns) // 2), trns)
+
+    rgba = bytearray(width * height * 4)
+    for y in range(height):
+        samples = _samples(rows[y * stride : (y + 1) * stride], width * channels, depth)
+        for x in range(width):
+            px = samples[x * channels : (x + 1) * channels]
+            if color_type == 3:
+                idx = px[0]
+                if 3 * idx + 3 > len(palette):
+                    raise UnsupportedImage("PNG palette index out of range")
+                r, g, b = palette[3 * idx : 3 * idx + 3]
+                a = trns[idx] if idx < len(trns) else 255
+            elif color_type in (0, 4):
+                r = g = b = scale(px[0])
+                a = scale(px[1]) if color_type == 4 else (0 if trns_key == (px[0],) else 255)
+            else:
+                r, g, b = scale(px[0]), scale(px[1]), scale(px[2])
+                a = scale(px[3]) if color_type == 6 else (0 if trns_key == tuple(px) else 255)
+            o = 4 * (y * width + x)
+            rgba[o : o + 4] = bytes((r, g, b, a))
+    return Bitmap(width, height, rgba)
+
+
+def _png_chunk(ctype: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + ctype + body + struct.pack(">I", zlib.crc32(ctype + body))
+
+
+def _png_image_data(width: int, height: int, rgb: bytes) -> bytes:
+    stride = width * 3
+    return zlib.compress(b"".join(b"\x00" + rgb[y * stride : (y + 1) * stride] for y in range(height)), 9)
+
+
+def _png_header(width: int, height: int) -> bytes:
+    return PNG_SIGNATURE + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+
+def encode_png(width: int, height: int, rgb: bytes) -> bytes:
+    return _png_header(width, height) + _png_chunk(b"IDAT", _png_image_data(width, height, rgb)) + _png_chunk(b"IEND", b"")
+
+
+class ApngWriter:
+    def __init__(self, fp: BinaryIO, width: int, height: int, loop: int = 0) -> None:
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.frames = 0
+        self._sequence = 0
+        fp.write(_png_header(width, height))
+        # acTL must precede the image data but the frame count is only known at close(); it is patched in place.
+        self._actl_at = fp.tell()
+        fp.write(_png_chunk(b"acTL", struct.pack(">II", 0, loop)))
+
+    def add_frame(self, rgb: bytes, delay_ms: int, box: tuple[int, int, int, int] | None = None) -> None:
+        x, y, w, h = box or (0, 0, self.width, self.height)
+        if self.frames == 0 and (w, h) != (self.width, self.height):
+            raise ValueError("The first APNG frame must cover the whole canvas")
+        num, den = (delay_ms, 1000) if delay_ms <= 0xFFFF else (min(0xFFFF, delay_ms // 10), 100)
+        self.fp.write(_png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, w, h, x, y, num, den, 0, 0)))
+        self._sequence += 1
+        data = _png_image_data(w, h, rgb)
+        if self.frames == 0:
+            self.fp.write(_png_chunk(b"IDAT", data))
+        else:
+            self.fp.write(_png_chunk(b"fdAT", struct.pack(">I", self._sequence) + data))
+            self._sequence += 1
+        self.frames += 1
+
+    def close(self) -> None:
+        self.fp.write(_png_chunk(b"IEND", b""))
+        end = self.fp.tell()
+        self.fp.seek(self._actl_at)
+        self.fp.write(_png_chunk(b"acTL", struct.pack(">II", self.frames, self.loop)))
+        self.fp.seek(end)
+
+
+# --- JPEG ------------------------------------------------------------------
+
+
+def _zigzag() -> list[int]:
+    order = sorted(((x, y) for y in range(8) for x in range(8)), key=lambda p: (p[0] + p[1], p[1] if (p[0] + p[1]) % 2 else p[0]))
+    return [y * 8 + x for x, y in order]
+
+
+ZIGZAG = _zigzag()
+
+_LUMA_QUANT = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]  # fmt: skip
+
+_CHROMA_QUANT = [
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+] + [99] * 32  # fmt: skip
+
+
+def _huffman_codes(bits: Sequence[int], values: Sequence[int]) -> dict[int, tuple[int, int]]:
+    codes: dict[int, tuple[int, int]] = {}
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        for _ in range(bits[length - 1]):
+            codes[values[k]] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+
+_DCT = [[(math.sqrt(0.5) if u == 0 else 1.0) / 2 * math.cos((2 * x + 1) * u * math.pi / 16) for x in range(8)] for u in range(8)]
+
+
+def _scaled_quant(table: Sequence[int], quality: int) -> list[int]:
+    quality = min(100, max(1, quality))
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return [min(255, max(1, (q * scale + 50) // 100)) for q in table]
+
+
+class _BitWriter:
+    def __init__(self) -> None:
+        self.out = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, code: int, length: int) -> None:
+        self._acc = (self._acc << length) | (code & ((1 << length) - 1))
+        self._bits += length
+        while self._bits >= 8:
+            self._bits -= 8
+            byte = (self._acc >> self._bits) & 0xFF
+            self.out.append(byte)
+            if byte == 0xFF:
+                self.out.append(0)
+        self._acc &= (1 << self._bits) - 1
+
+    def flush(self) -> bytes:
+        if self._bits:
+            self.write((1 << (8 - self._bits)) - 1, 8 - self._bits)
+        return bytes(self.out)
+
+
+def _quantize_block(block: list[float], quant: list[int]) -> list[int]:
+    if min(block) == max(block):
+        # Flat blocks (icon backgrounds, upscaled LiveView cells) only have a DC term: 64 * v / 8.
+        return [int(round(8 * block[0] / quant[0]))] + [0] * 63
+    rows = [[sum(_DCT[v][x] * block[y * 8 + x] for x in range(8)) for v in range(8)] for y in range(8)]
+    coeffs = [sum(_DCT[u][y] * rows[y][v] for y in range(8)) for u in range(8) for v in range(8)]
+    return [int(round(coeffs[n] / quant[n])) for n in ZIGZAG]
+
+
+def _block_symbols(zz: list[int], prev_dc: int) -> Iterator[tuple[int, int, int, int]]:
+    # Yields (table, symbol, extra bits, extra length) with table 0 = DC and 1 = AC.
+    diff = zz[0] - prev_dc
+    size = abs(diff).bit_length()
+    yield 0, size, diff if diff > 0 else diff + (1 << size) - 1, size
+    run = 0
+    for k in range(1, 64):
+        value = zz[k]
+        if value == 0:
+            run += 1
+            continue
+        while run > 15:
+            yield 1, 0xF0, 0, 0
+            run -= 16
+        size = abs(value).bit_length()
+        yield 1, (run << 4) | size, value if value > 0 else value + (1 << size) - 1, size
+        run = 0
+    if run:
+        yield 1, 0x00, 0, 0
+
+
+def _optimal_huffman(counts: dict[int, int]) -> tuple[list[int], list[int]]:
+    # Annex K.2: a reserved pseudo-symbol keeps real codes from being all 1-bits, K.3 caps lengths at 16.
+    items = sorted(counts.items(), key=lambda item: -item[1]) + [(256, 1)]
+    heap = [(n, i, [sym]) for i, (sym, n) in enumerate(items)]
+    heapq.heapify(heap)
+    lengths = dict.fromkeys(counts, 0)
+    lengths[256] = 0
+    tie = len(heap)
+    while len(heap) > 1:
+        n1, _, s1 = heapq.heappop(heap)
+        n2, _, s2 = heapq.heappop(heap)
+        for sym in s1 + s2:
+            lengths[sym] += 1
+        heapq.heappush(heap, (n1 + n2, tie, s1 + s2))
+        tie += 1
+    bits = [0] * (max(17, max(lengths.values())) + 1)
+    for length in lengths.values():
+        bits[length] += 1
+    for i in range(len(bits) - 1, 16, -1):
+        while bits[i] > 0:
+            j = i - 2
+            while bits[j] == 0:
+                j -= 1
+            bits[i] -= 2
+            bits[i - 1] += 1
+            bits[j + 1] += 2
+            bits[j] -= 1
+    longest = max(i for i in range(17) if bits[i])
+    bits[longest] -= 1
+    values = [sym for sym, _ in sorted(items, key=lambda item: (lengths[item[0]], item[0] == 256)) if sym != 256]
+    return bits[1:17], values
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack(">HH", marker, len(payload) + 2) + payload
+
+
+def encode_jpeg(width: int, height: int, rgb: bytes, quality: int = 95) -> bytes:
+    luma_q = _scaled_quant(_LUMA_QUANT, quality)
+    chroma_q = _scaled_quant(_CHROMA_QUANT, quality)
+
+    planes: list[list[float]] = [[], [], []]
+    for i in range(width * height):
+        r, g, b = rgb[3 * i], rgb[3 * i + 1], rgb[3 * i + 2]
+        planes[0].append(0.299 * r + 0.587 * g + 0.114 * b - 128)
+        planes[1].append(-0.168736 * r - 0.331264 * g + 0.5 * b)
+        planes[2].append(0.5 * r - 0.418688 * g - 0.081312 * b)
+
+    blocks: list[tuple[int, list[int]]] = []
+    for by in range(0, height, 8):
+        for bx in range(0, width, 8):
+            for c in range(3):
+                # Edge pixels are replicated into the padding so partial blocks do not ring.
+                block = [
+                    planes[c][min(by + y, height - 1) * width + min(bx + x, width - 1)] for y in range(8) for x in range(8)
+                ]
+                blocks.append((c, _quantize_block(block, luma_q if c == 0 else chroma_q)))
+
+    # Two passes: gather symbol statistics, then code with per-image optimal tables (like libjpeg's optimize).
+    counts: list[dict[int, int]] = [{}, {}, {}, {}]
+    prev = [0, 0, 0]
+    for c, zz in blocks:
+        for table, symbol, _, _ in _block_symbols(zz, prev[c]):
+            slot = 2 * min(c, 1) + table
+            counts[slot][symbol] = counts[slot].get(symbol, 0) + 1
+        prev[c] = zz[0]
+    specs = [_optimal_huffman(n) for n in counts]
+    codes = [_huffman_codes(bits, values) for bits, values in specs]
+
+    writer = _BitWriter()
+    prev = [0, 0, 0]
+    for c, zz in blocks:
+        for table, symbol, extra, extra_len in _block_symbols(zz, prev[c]):
+            writer.write(*codes[2 * min(c, 1) + table][symbol])
+            if extra_len:
+                writer.write(extra, extra_len)
+        prev[c] = zz[0]
+
+    out = bytearray(b"\xff\xd8")
+    out += _segment(0xFFE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+    out += _segment(0xFFDB, b"\x00" + bytes(luma_q[n] for n in ZIGZAG) + b"\x01" + bytes(chroma_q[n] for n in ZIGZAG))
+    out += _segment(0xFFC0, struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x11\x00\x02\x11\x01\x03\x11\x01")
+    for slot, (bits, values) in enumerate(specs):
+        out += _segment(0xFFC4, bytes([((slot & 1) << 4) | (slot >> 1)]) + bytes(bits) + bytes(values))
+    out += _segment(0xFFDA, b"\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00")
+    out += writer.flush()
+    out += b"\xff\xd9"
+    return bytes(out)
+
+
+def jpeg_is_baseline(data: bytes) -> bool:
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xC0:
+            return True
+        if marker in (0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF, 0xDA):
+            return False
+        pos += 2 + struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+    return False
+
+
+def jpeg_size(data: bytes) -> tuple[int, int]:
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[pos + 5 : pos + 9])
+            return width, height
+        pos += 2 + struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+    raise UnsupportedImage("JPEG has no frame header")
+
+
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    # Drops EXIF/XMP/ICC (APP1-APP15) and comments; the entropy-coded data after SOS is copied verbatim.
+    out = bytearray(data[:2])
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            out += data[pos:]
+            return bytes(out)
+        end = pos + 2 + struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+        if not (0xE1 <= marker <= 0xEF or marker == 0xFE):
+            out += data[pos:end]
+        pos = end
+    return data
+
+
+# --- GIF -------------------------------------------------------------------
+
+
+def _lzw_encode(indices: bytes, min_code_size: int) -> bytes:
+    clear = 1 << min_code_size
+    eoi = clear + 1
+    out = bytearray()
+    acc = 0
+    bits = 0
+
+    def emit(code: int, width: int) -> None:
+        nonlocal acc, bits
+        acc |= code << bits
+        bits += width
+        while bits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+
+    width = min_code_size + 1
+    table: dict[tuple[int, int], int] = {}
+    next_code = eoi + 1
+    emit(clear, width)
+    prefix = -1
+    for value in indices:
+        if prefix < 0:
+            prefix = value
+            continue
+        key = (prefix, value)
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix, width)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << width) and width < 12:
+                width += 1
+        else:
+            emit(clear, width)
+            table.clear()
+            next_code = eoi + 1
+            width = min_code_size + 1
+        prefix = value
+    if prefix >= 0:
+        emit(prefix, width)
+    emit(eoi, width)
+    if bits:
+        out.append(acc & 0xFF)
+    return bytes(out)
+
+
+def _sub_blocks(data: bytes) -> bytes:
+    out = bytearray()
+    for i in range(0, len(data), 255):
+        chunk = data[i : i + 255]
+        out.append(len(chunk))
+        out += chunk
+    out.append(0)
+    return bytes(out)
+
+
+def _color_table(palette: Sequence[tuple[int, int, int]]) -> tuple[bytes, int]:
+    size_bits = max(1, (len(palette) - 1).bit_length())
+    table = bytearray()
+    for r, g, b in palette:
+        table += bytes((r, g, b))
+    table += b"\x00" * (3 * (1 << size_bits) - len(table))
+    return bytes(table), size_bits
+
+
+def _lzw_decode(data: bytes, min_code_size: int, count: int) -> bytes:
+    clear = 1 << min_code_size
+    eoi = clear + 1
+    table = [bytes((i,)) for i in range(clear)] + [b"", b""]
+    width = min_code_size + 1
+    out = bytearray()
+    prev = b""
+    acc = 0
+    bits = 0
+    pos = 0
+    while len(out) < count:
+        while bits < width:
+            if pos >= len(data):
+                return bytes(out.ljust(count, b"\0"))
+            acc |= data[pos] << bits
+            pos += 1
+            bits += 8
+        code = acc & ((1 << width) - 1)
+        acc >>= width
+        bits -= width
+        if code == clear:
+            del table[eoi + 1 :]
+            width = min_code_size + 1
+            prev = b""
+            continue
+        if code == eoi:
+            break
+        if code < len(table):
+            entry = table[code]
+            if prev and len(table) < 4096:
+                table.append(prev + entry[:1])
+        elif code == len(table) and prev:
+            entry = prev + prev[:1]
+            table.append(entry)
+        else:
+            raise UnsupportedImage("Corrupt GIF LZW data")
+        out += entry
+        prev = entry
+        if len(table) == (1 << width) and width < 12:
+            width += 1
+    return bytes(out[:count].ljust(count, b"\0"))
+
+
+def _read_sub_blocks(data: bytes, pos: int) -> tuple[bytes, int]:
+    chunks = []
+    while pos < len(data):
+        size = data[pos]
+        pos += 1
+        if not size:
+            break
+        chunks.append(data[pos : pos + size])
+        pos += size
+    return b"".join(chunks), pos
+
+
+def _deinterlace(indices: bytes, width: int, height: int) -> bytes:
+    rows = [y for start, step in ((0, 8), (4, 8), (2, 4), (1, 2)) for y in range(start, height, step)]
+    out = bytearray(len(indices))
+    for i, y in enumerate(rows):
+        out[y * width : (y + 1) * width] = indices[i * width : (i + 1) * width]
+    return bytes(out)
+
+
+def decode_gif(data: bytes) -> Animation:
+    if data[:6] not in (b"GIF87a", b"GIF89a"):
+        raise UnsupportedImage("Not a GIF file")
+    width, height, flags = struct.unpack("<HHB", data[6:11])
+    if width * height > MAX_PURE_PIXELS:
+        raise UnsupportedImage(f"GIF too large for the built-in decoder ({width}x{height})")
+    pos = 13
+    global_palette = b""
+    if flags & 0x80:
+        global_palette = data[pos : pos + 3 * (2 << (flags & 7))]
+        pos += len(global_palette)
+
+    # Frames are composited onto a black canvas, which is what the matrix shows behind transparent pixels.
+    canvas = bytearray(width * height * 3)
+    frames: list[tuple[bytes, int]] = []
+    delay, transparent, disposal = 0, -1, 0
+    while pos < len(data):
+        block = data[pos]
+        pos += 1
+        if block == 0x3B:
+            break
+        if block == 0x21:
+            label = data[pos]
+            body, pos = _read_sub_blocks(data, pos + 1)
+            if label == 0xF9 and len(body) >= 4:
+                packed, delay_cs, index = struct.unpack("<BHB", body[:4])
+                disposal = (packed >> 2) & 7
+                transparent = index if packed & 1 else -1
+                delay = delay_cs * 10
+            continue
+        if block != 0x2C:
+            raise UnsupportedImage("Corrupt GIF block")
+        x0, y0, fw, fh, fflags = struct.unpack("<HHHHB", data[pos : pos + 9])
+        pos += 9
+        palette = global_palette
+        if fflags & 0x80:
+            palette = data[pos : pos + 3 * (2 << (fflags & 7))]
+            pos += len(palette)
+        min_code_size = data[pos]
+        lzw, pos = _read_sub_blocks(data, pos + 1)
+        if not palette or not 2 <= min_code_size <= 11:
+            raise UnsupportedImage("GIF frame without a usable palette")
+        indices = _lzw_decode(lzw, min_code_size, fw * fh)
+        if fflags & 0x40:
+            indices = _deinterlace(indices, fw, fh)
+
+        saved = bytes(canvas) if disposal == 3 else b""
+        for y in range(max(0, min(fh, height - y0))):
+            for x in range(max(0, min(fw, width - x0))):
+                idx = indices[y * fw + x]
+                if idx == transparent or 3 * idx + 3 > len(palette):
+                    continue
+                o = 3 * ((y0 + y) * width + x0 + x)
+                canvas[o : o + 3] = palette[3 * idx : 3 * idx + 3]
+        frames.append((bytes(canvas), delay))
+        if disposal == 2:
+            for y in range(max(0, min(fh, height - y0))):
+                o = 3 * ((y0 + y) * width + x0)
+                canvas[o : o + 3 * max(0, min(fw, width - x0))] = bytes(3 * max(0, min(fw, width - x0)))
+        elif disposal == 3:
+            canvas[:] = saved
+        delay, transparent, disposal = 0, -1, 0
+    if not frames:
+        raise UnsupportedImage("GIF has no frames")
+    return Animation(width, height, frames)
+
+
+class GifWriter:
+    def __init__(self, fp: BinaryIO, width: int, height: int, palette: Sequence[tuple[int, int, int]] | None = None, loop: int | None = 0) -> None:
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self._global = bool(palette)
+        flags = 0
+        table = b""
+        if palette:
+            table, size_bits = _color_table(palette)
+            flags = 0x80 | ((size_bits - 1) << 4) | (size_bits - 1)
+        fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, flags, 0, 0) + table)
+        if loop is not None:
+            fp.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    def add_frame(
+        self,
+        indices: bytes,
+        delay_ms: int = 0,
+        palette: Sequence[tuple[int, int, int]] | None = None,
+        transparent: int | None = None,
+        box: tuple[int, int, int, int] | None = None,
+    ) -> None:
+        x, y, w, h = box or (0, 0, self.width, self.height)
+        if delay_ms or transparent is not None:
+            packed = (1 << 2) | (1 if transparent is not None else 0)
+            delay_cs = max(0, min(0xFFFF, (delay_ms + 5) // 10))
+            self.fp.write(b"\x21\xf9\x04" + struct.pack("<BHB", packed, delay_cs, transparent or 0) + b"\x00")
+        flags = 0
+        table = b""
+        size_bits = 0
+        if palette:
+            table, size_bits = _color_table(palette)
+            flags = 0x80 | (size_bits - 1)
+        elif not self._global:
+            raise ValueError("GIF frame needs a palette when no global color table was written")
+        min_code_size = max(2, size_bits or max(indices, default=0).bit_length())
+        self.fp.write(b"\x2c" + struct.pack("<HHHHB", x, y, w, h, flags) + table)
+        self.fp.write(bytes([min_code_size]) + _sub_blocks(_lzw_encode(indices, min_code_size)))
+
+    def close(self) -> None:
+        self.fp.write(b"\x3b")
+
+
+def exact_palette(rgb: bytes) -> tuple[list[tuple[int, int, int]], bytes] | None:
+    lookup: dict[tuple[int, int, int], int] = {}
+    indices = bytearray(len(rgb) // 3)
+    for i in range(len(indices)):
+        color = (rgb[3 * i], rgb[3 * i + 1], rgb[3 * i + 2])
+        idx = lookup.get(color)
+        if idx is None:
+            if len(lookup) == 256:
+                return None
+            idx = lookup[color] = len(lookup)
+        indices[i] = idx
+    return list(lookup), bytes(indices)
+
+
+def encode_gif(width: int, height: int, rgb: bytes) -> bytes:
+    from io import BytesIO
+
+    exact = exact_palette(rgb)
+    if exact is None:
+        raise UnsupportedImage("Image has more than 256 colors")
+    palette, indices = exact
+    out = BytesIO()
+    writer = GifWriter(out, width, height, palette, loop=None)
+    writer.add_frame(indices)
+    writer.close()
+    return out.getvalue()
+
+
+# --- Conversions used by awtrix_fs ------------------------------------------
+
+
+def to_jpeg(data: bytes, quality: int = 95) -> bytes:
+    kind = sniff(data)
+    if kind == "jpeg":
+        # AWTRIX decodes baseline JPEG natively; re-encoding would only lose quality.
+        if jpeg_is_baseline(data):
+            return data
+        raise UnsupportedImage("Progressive or non-baseline JPEG")
+    if kind != "png":
+        raise UnsupportedImage(f"Unsupported input format: {kind or 'unknown'}")
+    image = decode_png(data)
+    return encode_jpeg(image.width, image.height, image.to_rgb_on_black(), quality=quality)
+
+
+def to_gif(data: bytes) -> bytes:
+    if sniff(data) != "png":
+        raise UnsupportedImage("Only PNG input can be converted to GIF without Pillow")
+    image = decode_png(data)
+    return encode_gif(image.width, image.height, image.to_rgb_on_black())
+
+
+# --- Optimizer --------------------------------------------------------------
+
+JPEG_MIN_QUALITY = 20
+
+
+@dataclass(frozen=True)
+class OptimizeOptions:
+    max_width: int = 32
+    max_height: int = 8
+    max_bytes: int | None = None
+    quality: int = 95
+    colors: int = 256
+
+    @property
+    def key(self) -> str:
+        return f"opt:{self.max_width}x{self.max_height}:q{self.quality}:c{self.colors}:b{self.max_bytes or 0}"
+
+
+def fit_size(width: int, height: int, max_width: int, max_height: int) -> tuple[int, int]:
+    scale = min(1.0, max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize(width: int, height: int, rgb: bytes, new_width: int, new_height: int) -> bytes:
+    if (new_width, new_height) == (width, height):
+        return rgb
+    out = bytearray(new_width * new_height * 3)
+    for ny in range(new_height):
+        y0 = ny * height // new_height
+        y1 = max(y0 + 1, (ny + 1) * height // new_height)
+        for nx in range(new_width):
+            x0 = nx * width // new_width
+            x1 = max(x0 + 1, (nx + 1) * width // new_width)
+            sums = [0, 0, 0]
+            for y in range(y0, y1):
+                row = 3 * y * width
+                for x in range(x0, x1):
+                    o = row + 3 * x
+                    sums[0] += rgb[o]
+                    sums[1] += rgb[o + 1]
+                    sums[2] += rgb[o + 2]
+            n = (y1 - y0) * (x1 - x0)
+            o = 3 * (ny * new_width + nx)
+            out[o : o + 3] = bytes((s + n // 2) // n for s in sums)
+    return bytes(out)
+
+
+def upscale(width: int, height: int, data: bytes, factor: int, channels: int = 3) -> bytes:
+    if factor == 1:
+        return bytes(data)
+    stride = width * channels
+    out = bytearray()
+    for y in range(height):
+        row = data[y * stride : (y + 1) * stride]
+        out += b"".join(row[x * channels : (x + 1) * channels] * factor for x in range(width)) * factor
+    return bytes(out)
+
+
+def quantize(frames: Sequence[bytes], colors: int) -> tuple[list[tuple[int, int, int]], list[bytes]]:
+    counts: dict[tuple[int, int, int], int] = {}
+    for rgb in frames:
+        for i in range(0, len(rgb), 3):
+            color = (rgb[i], rgb[i + 1], rgb[i + 2])
+            counts[color] = counts.get(color, 0) + 1
+
+    if len(counts) <= colors:
+        palette = list(counts)
+        mapping = {c: i for i, c in enumerate(palette)}
+    else:
+        # Median cut: repeatedly split the box with the widest channel range at its pixel-weighted median.
+        boxes = [list(counts.items())]
+        while len(boxes) < colors:
+            best, best_range, channel = -1, 0, 0
+            for b, box in enumerate(boxes):
+                for ch in range(3):
+                    values = [c[ch] for c, _ in box]
+                    if max(values) - min(values) > best_range:
+                        best, best_range, channel = b, max(values) - min(values), ch
+            if best < 0:
+                break
+            box = sorted(boxes.pop(best), key=lambda item: item[0][channel])
+            half = sum(n for _, n in box) / 2
+            running = 0
+            cut = 1
+            for cut, (_, n) in enumerate(box[:-1], start=1):
+                running += n
+                if running >= half:
+                    break
+            boxes += [box[:cut], box[cut:]]
+        palette = []
+        for box in boxes:
+            total = sum(n for _, n in box)
+            palette.append(tuple((sum(c[ch] * n for c, n in box) + total // 2) // total for ch in range(3)))  # type: ignore[misc]
+        mapping = {}
+        for color in counts:
+            mapping[color] = min(
+                range(len(palette)),
+                key=lambda i: sum((color[ch] - palette[i][ch]) ** 2 for ch in range(3)),
+            )
+    indexed = [bytes(mapping[(rgb[i], rgb[i + 1], rgb[i + 2])] for i in range(0, len(rgb), 3)) for rgb in frames]
+    return palette, indexed
+
+
+def _changed_box(prev: bytes, cur: bytes, width: int, height: int) -> tuple[int, int, int, int] | None:
+    xs = []
+    ys = []
+    for i in range(len(cur)):
+        if prev[i] != cur[i]:
+            ys.append(i // width)
+            xs.append(i % width)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1
+
+
+def _encode_gif_frames(anim: Animation, colors: int) -> bytes:
+    from io import BytesIO
+
+    palette, indexed = quantize([rgb for rgb, _ in anim.frames], colors)
+    merged: list[tuple[bytes, int]] = []
+    for indices, (_, delay) in zip(indexed, anim.frames):
+        if merged and merged[-1][0] == indices:
+            merged[-1] = (indices, merged[-1][1] + delay)
+        else:
+            merged.append((indices, delay))
+    animated = len(merged) > 1
+
+    out = BytesIO()
+    writer = GifWriter(out, anim.width, anim.height, palette, loop=0 if animated else None)
+    prev = b""
+    for indices, delay in merged:
+        box = _changed_box(prev, indices, anim.width, anim.height) if prev else None
+        if box is None:
+            writer.add_frame(indices, delay if animated else 0)
+        else:
+            x, y, w, h = box
+            crop = b"".join(indices[(y + r) * anim.width + x : (y + r) * anim.width + x + w] for r in range(h))
+            writer.add_frame(crop, delay, box=box)
+        prev = indices
+    writer.close()
+    return out.getvalue()
+
+
+def _encode_jpeg_budget(width: int, height: int, rgb: bytes, quality: int, max_bytes: int | None) -> bytes:
+    data = encode_jpeg(width, height, rgb, quality)
+    if max_bytes is None or len(data) <= max_bytes:
+        return data
+    lo, hi = JPEG_MIN_QUALITY, quality - 1
+    best = b""
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = encode_jpeg(width, height, rgb, mid)
+        if len(candidate) <= max_bytes:
+            best, lo = candidate, mid + 1
+        else:
+            hi = mid - 1
+    return best or encode_jpeg(width, height, rgb, JPEG_MIN_QUALITY)
+
+
+def encode_optimized(anim: Animation, out_format: str, options: OptimizeOptions, original: bytes = b"") -> bytes:
+    width, height = fit_size(anim.width, anim.height, options.max_width, options.max_height)
+    scaled = Animation(width, height, [(resize(anim.width, anim.height, rgb, width, height), d) for rgb, d in anim.frames])
+
+    if out_format == "gif":
+        result = b""
+        colors = options.colors
+        while True:
+            result = _encode_gif_frames(scaled, colors)
+            if options.max_bytes is None or len(result) <= options.max_bytes or colors <= 2:
+                break
+            colors //= 2
+    else:
+        result = _encode_jpeg_budget(width, height, scaled.frames[0][0], options.quality, options.max_bytes)
+
+    # An input that already fits and is smaller than the re-encode is kept (GIF LZW or JPEG tables may beat ours).
+    fits = (anim.width, anim.height) == (width, height) and (options.max_bytes is None or len(original) <= options.max_bytes)
+    if original and fits and sniff(original) == out_format and len(original) <= len(result):
+        return original
+    return result
+
+
+def decode(data: bytes) -> Animation:
+    kind = sniff(data)
+    if kind == "png":
+        image = decode_png(data)
+        return Animation(image.width, image.height, [(image.to_rgb_on_black(), 0)])
+    if kind == "gif":
+        return decode_gif(data)
+    raise UnsupportedImage(f"Cannot decode {kind or 'unknown'} input without Pillow")
+
+
+def optimize(data: bytes, out_format: str, options: OptimizeOptions) -> bytes:
+    if sniff(data) == "jpeg" and out_format == "jpeg" and jpeg_is_baseline(data):
+        width, height = jpeg_size(data)
+        stripped = strip_jpeg_metadata(data)
+        if fit_size(width, height, options.max_width, options.max_height) == (width, height) and (
+            options.max_bytes is None or len(stripped) <= options.max_bytes
+        ):
+            return stripped
+        raise UnsupportedImage("JPEG must be decoded to resize or recompress")
+    return encode_optimized(decode(data), out_format, options, original=data)
+
+
+def thumbnail(anim: Animation, size: int = 8) -> bytes:
+    # Distinct frames scaled to size x size, so the same artwork compares equal across formats and scales.
+    out = bytearray()
+    previous = b""
+    for rgb, _ in anim.frames:
+        thumb = resize(anim.width, anim.height, rgb, size, size)
+        if thumb != previous:
+            out += thumb
+            previous = thumb
+    return bytes(out)
+
+
+def thumbnail_distance(a: bytes, b: bytes) -> float:
+    if len(a) != len(b):
+        return math.inf
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+# --- Streaming animation output ----------------------------------------------
+
+
+# Encodes RGB frames to an animated GIF or APNG as they arrive; only the previous frame is kept.
+class AnimationStream:
+    def __init__(self, fp: BinaryIO, width: int, height: int, out_format: str, scale: int = 1, loop: int = 0) -> None:
+        if out_format not in ("gif", "png"):
+            raise ValueError(f"Unsupported animation format: {out_format}")
+        self.width = width
+        self.height = height
+        self.format = out_format
+        self.scale = scale
+        self.frames = 0
+        self._previous: list[bytes] = []
+        self._elapsed_ms = 0
+        self._written_cs = 0
+        if out_format == "gif":
+            self._gif = GifWriter(fp, width * scale, height * scale, None, loop)
+        else:
+            self._apng = ApngWriter(fp, width * scale, height * scale, loop)
+
+    def add_frame(self, rgb: bytes, delay_ms: int) -> None:
+        pixels = [rgb[i : i + 3] for i in range(0, len(rgb), 3)]
+        box = (0, 0, self.width, self.height)
+        if self._previous:
+            # An unchanged frame still needs a (1x1) image to carry its delay.
+            box = _changed_box(self._previous, pixels, self.width, self.height) or (0, 0, 1, 1)
+        x, y, w, h = box
+        crop = b"".join(b"".join(pixels[(y + r) * self.width + x : (y + r) * self.width + x + w]) for r in range(h))
+        s = self.scale
+        scaled_box = (x * s, y * s, w * s, h * s)
+        if self.format == "gif":
+            exact = exact_palette(crop)
+            if exact is not None:
+                palette, indices = exact
+            else:
+                palette, (indices,) = quantize([crop], 256)
+            # GIF delays are centiseconds; round the running total so long recordings do not drift.
+            self._elapsed_ms += delay_ms
+            delay_cs = max(2, round(self._elapsed_ms / 10) - self._written_cs)
+            self._written_cs += delay_cs
+            self._gif.add_frame(upscale(w, h, indices, s, 1), delay_cs * 10, palette, box=scaled_box)
+        else:
+            self._apng.add_frame(upscale(w, h, crop, s), delay_ms, box=scaled_box)
+        self._previous = pixels
+        self.frames += 1
+
+    def close(self) -> None:
+        if self.format == "gif":
+            self._gif.close()
+        else:
+            self._apng.close()
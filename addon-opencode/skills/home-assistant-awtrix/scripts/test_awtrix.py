@@ -0,0 +1,901 @@
+#!/usr/bin/env python3
+# Run from this directory: python3 -m unittest test_awtrix (or python3 -m pytest test_awtrix.py)
+import argparse
+import asyncio
+import contextlib
+import http.server
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+import zlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import awtrix_bench
+import awtrix_fs
+import awtrix_image
+from awtrix_emulator import AwtrixEmulator, DeviceProfile
+
+_CACHE_DIR = ""
+
+
+def setUpModule() -> None:
+    # Keep indexes, manifests and device state out of the skill's own .cache; coldstart subprocesses inherit this too.
+    global _CACHE_DIR
+    _CACHE_DIR = tempfile.mkdtemp(prefix="awtrix-test-")
+    os.environ["AWTRIX_FS_CACHE_DIR"] = _CACHE_DIR
+    os.environ["AWTRIX_FS_VENV_DIR"] = os.path.join(_CACHE_DIR, "venv")
+
+
+def tearDownModule() -> None:
+    os.environ.pop("AWTRIX_FS_CACHE_DIR", None)
+    os.environ.pop("AWTRIX_FS_VENV_DIR", None)
+    shutil.rmtree(_CACHE_DIR, ignore_errors=True)
+
+
+def _filter_rows(raw: bytes, height: int, stride: int, bpp: int, types: list[int]) -> bytes:
+    out = bytearray()
+    prev = bytes(stride)
+    for y in range(height):
+        line = raw[y * stride : (y + 1) * stride]
+        ftype = types[y % len(types)]
+        out.append(ftype)
+        for x in range(stride):
+            a = line[x - bpp] if x >= bpp else 0
+            b = prev[x]
+            c = prev[x - bpp] if x >= bpp else 0
+            predictor = (0, a, b, (a + b) // 2, awtrix_image._paeth(a, b, c))[ftype]
+            out.append((line[x] - predictor) & 0xFF)
+        prev = line
+    return bytes(out)
+
+
+def _png(width: int, height: int, depth: int, color_type: int, rows: bytes, extra: bytes = b"") -> bytes:
+    header = awtrix_image._png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0))
+    idat = awtrix_image._png_chunk(b"IDAT", zlib.compress(rows))
+    return awtrix_image.PNG_SIGNATURE + header + extra + idat + awtrix_image._png_chunk(b"IEND", b"")
+
+
+def _device(files: dict[str, bytes] | None = None, **profile: object) -> AwtrixEmulator:
+    return AwtrixEmulator(DeviceProfile(**{"latency": 0.0, "write_bandwidth": 0.0, "accept_delay": 0.0, **profile}), files or {})
+
+
+def _run(host: str, *argv: str, stdin: str | None = None, env: dict[str, str] | None = None) -> tuple[int, str, list[str]]:
+    # Runs awtrix_fs.py as the user would and returns its exit code, output and "METHOD /endpoint" per device request.
+    # A comma-separated `host` runs the command as a fleet.
+    fd, trace = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".jsonl")
+    os.close(fd)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "awtrix_fs.py")
+    proc = subprocess.run(
+        [sys.executable, script, "--hosts" if "," in host else "--host", host, "--trace-file", trace, *argv],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+    )
+    with open(trace, encoding="utf-8") as f:
+        requests = [f"{e['method']} {e['path'].split('?', 1)[0]}" for e in map(json.loads, f)]
+    return proc.returncode, proc.stdout + proc.stderr, requests
+
+
+class _LametricServer:
+    # Stands in for the LaMetric thumbnail endpoint: serves `icons`, answers If-None-Match with 304, or fails with 503.
+    def __init__(self, icons: dict[str, tuple[str, bytes]]) -> None:
+        self.icons = icons
+        self.fail = False
+        self.requests: list[str] = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                icon_id = self.path.rsplit("/", 1)[1]
+                server.requests.append(icon_id)
+                content_type, data = server.icons[icon_id]
+                etag = f'"{zlib.crc32(data)}"'
+                status = 503 if server.fail else 304 if self.headers.get("If-None-Match") == etag else 200
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(data) if status == 200 else 0))
+                self.end_headers()
+                if status == 200:
+                    self.wfile.write(data)
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    def __enter__(self) -> "_LametricServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._url = awtrix_fs.LAMETRIC_THUMB_URL
+        awtrix_fs.LAMETRIC_THUMB_URL = f"http://127.0.0.1:{self._server.server_address[1]}/{{id}}"
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        awtrix_fs.LAMETRIC_THUMB_URL = self._url
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _gif_icons(count: int) -> dict[str, tuple[str, bytes]]:
+    return {str(i): ("image/gif", awtrix_image.encode_gif(8, 8, bytes((i, 255 - i, 7)) * 64)) for i in range(1, count + 1)}
+
+
+def _fresh_lametric_cache(test: unittest.TestCase) -> str:
+    root = tempfile.mkdtemp(dir=_CACHE_DIR)
+    awtrix_fs._LAMETRIC_CACHE = awtrix_fs.LametricCache(root)
+    test.addCleanup(setattr, awtrix_fs, "_LAMETRIC_CACHE", None)
+    return root
+
+
+class ColdstartTest(unittest.TestCase):
+    def test_status_and_list_stay_within_budget(self) -> None:
+        args = argparse.Namespace(coldstart_runs=3, import_budget_ms=120.0)
+        for result in awtrix_bench.bench_coldstart(DeviceProfile(), args):
+            self.assertIsNone(result.error, f"{result.name}: {result.error}")
+
+    def test_forbidden_modules_not_imported(self) -> None:
+        with AwtrixEmulator(DeviceProfile(), {}) as device:
+            _, _, modules = awtrix_bench.import_profile(["--host", device.host, "status"])
+        self.assertEqual(modules & set(awtrix_bench.COLDSTART_FORBIDDEN), set())
+
+
+class LzwTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        rng = random.Random(7)
+        cases = [
+            (2, bytes(rng.randrange(4) for _ in range(5000))),
+            # Enough distinct runs to fill the 4096-entry table and force a clear code.
+            (8, bytes(rng.randrange(256) for _ in range(20000))),
+            (4, bytes([3]) * 3000),
+            (2, b"\x01"),
+        ]
+        for min_code_size, indices in cases:
+            encoded = awtrix_image._lzw_encode(indices, min_code_size)
+            self.assertEqual(awtrix_image._lzw_decode(encoded, min_code_size, len(indices)), indices)
+
+    def test_gif_round_trip(self) -> None:
+        rgb = bytes(c for i in range(32 * 8) for c in ((i * 37) % 256, (i * 11) % 7 * 30, 200 if i % 3 else 0))
+        anim = awtrix_image.decode_gif(awtrix_image.encode_gif(32, 8, rgb))
+        self.assertEqual((anim.width, anim.height, len(anim.frames)), (32, 8, 1))
+        self.assertEqual(anim.frames[0][0], rgb)
+
+
+class PngDecodeTest(unittest.TestCase):
+    def test_encode_png_round_trip(self) -> None:
+        rgb = bytes(range(256)) * 3
+        bitmap = awtrix_image.decode_png(awtrix_image.encode_png(16, 16, rgb))
+        self.assertEqual((bitmap.width, bitmap.height), (16, 16))
+        self.assertEqual(bitmap.to_rgb_on_black(), rgb)
+
+    def test_every_filter_type_rgba(self) -> None:
+        rng = random.Random(3)
+        width, height = 7, 10
+        rgba = bytes(rng.randrange(256) for _ in range(width * height * 4))
+        png = _png(width, height, 8, 6, _filter_rows(rgba, height, width * 4, 4, [0, 1, 2, 3, 4]))
+        self.assertEqual(bytes(awtrix_image.decode_png(png).rgba), rgba)
+
+    def test_low_depth_palette_with_transparency(self) -> None:
+        palette = bytes((255, 0, 0, 0, 255, 0, 0, 0, 255, 9, 9, 9))
+        # 2-bit indices 0,1,2,3 then 3,2,1,0, packed four to a byte.
+        rows = b"\x00\x1b\x00\xe4"
+        extra = awtrix_image._png_chunk(b"PLTE", palette) + awtrix_image._png_chunk(b"tRNS", b"\xff\xff\x80")
+        bitmap = awtrix_image.decode_png(_png(4, 2, 2, 3, rows, extra))
+        pixels = [tuple(bitmap.rgba[i : i + 4]) for i in range(0, len(bitmap.rgba), 4)]
+        self.assertEqual(
+            pixels,
+            [(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 128), (9, 9, 9, 255)]
+            + [(9, 9, 9, 255), (0, 0, 255, 128), (0, 255, 0, 255), (255, 0, 0, 255)],
+        )
+
+    def test_rejects_non_png(self) -> None:
+        with self.assertRaises(awtrix_image.UnsupportedImage):
+            awtrix_image.decode_png(b"GIF89a")
+
+
+class MultipartTest(unittest.TestCase):
+    def test_file_parts_stream_from_disk(self) -> None:
+        local = os.path.join(_CACHE_DIR, "big.bin")
+        data = random.Random(5).randbytes(300_000)
+        with open(local, "wb") as f:
+            f.write(data)
+        part = awtrix_fs.MultipartFile("data", "/big.bin", "application/octet-stream", path=local)
+        body = awtrix_fs._encode_multipart({"path": "/big.bin"}, [part])
+        chunks = list(body)
+        self.assertEqual(len(b"".join(chunks)), len(body))
+        self.assertLessEqual(max(map(len, chunks)), body.chunk_size)
+        self.assertIn(data, b"".join(chunks))
+        # A file part is read again on replay; only a one-shot stream is not.
+        self.assertTrue(body.replayable)
+        self.assertEqual(b"".join(body), b"".join(chunks))
+        stream = awtrix_fs._encode_multipart({}, [part._replace(path=None, stream=io.BytesIO(data), length=len(data))])
+        self.assertEqual(len(b"".join(stream)), len(stream))
+        self.assertFalse(stream.replayable)
+
+    def test_short_sources_are_rejected(self) -> None:
+        local = os.path.join(_CACHE_DIR, "shrinks.bin")
+        with open(local, "wb") as f:
+            f.write(b"x" * 100)
+        body = awtrix_fs._encode_multipart({}, [awtrix_fs.MultipartFile("data", "/a", "text/plain", path=local)])
+        with open(local, "wb") as f:
+            f.write(b"x" * 10)
+        with self.assertRaisesRegex(RuntimeError, "changed size"):
+            b"".join(body)
+        part = awtrix_fs.MultipartFile("data", "/a", "text/plain", stream=io.BytesIO(b"x" * 10), length=100)
+        with self.assertRaisesRegex(RuntimeError, "ended after 10 of 100"):
+            b"".join(awtrix_fs._encode_multipart({}, [part]))
+
+    def test_upload_reaches_the_device_intact(self) -> None:
+        local = os.path.join(_CACHE_DIR, "upload.bin")
+        data = random.Random(6).randbytes(200_000)
+        with open(local, "wb") as f:
+            f.write(data)
+        with _device() as device:
+            code, out, requests = _run(device.host, "upload", local, "/big.bin")
+            self.assertEqual((code, requests), (0, ["GET /list", "GET /status", "POST /edit"]), out)
+            self.assertEqual(device.files["/big.bin"], data)
+
+
+class FsIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = awtrix_fs.FsIndex("test", ttl=60, path=os.path.join(_CACHE_DIR, "index.json"))
+        self.index.store("/", [{"type": "dir", "size": "0", "name": "ICONS"}, {"type": "file", "size": "1", "name": "a.txt"}])
+
+    def names(self, dir_path: str) -> list[str]:
+        return [e["name"] for e in self.index.lookup(dir_path) or []]
+
+    def test_upload_into_listed_new_dir_updates_parent(self) -> None:
+        # sync lists the destination first, so the new directory has a cached (empty) listing of its own.
+        self.index.store("/NEW2", [])
+        self.index.uploaded("/NEW2/f.txt", 2)
+        self.assertIn("NEW2", self.names("/"))
+        self.assertEqual(self.names("/NEW2"), ["f.txt"])
+
+    def test_upload_into_unlisted_nested_dirs(self) -> None:
+        self.index.uploaded("/N3/deep/f.txt", 2)
+        self.assertIn("N3", self.names("/"))
+        self.assertIsNone(self.index.lookup("/N3/deep"))
+
+    def test_upload_into_existing_dir_adds_no_duplicate(self) -> None:
+        self.index.store("/ICONS", [])
+        self.index.uploaded("/ICONS/1.gif", 10)
+        self.assertEqual(self.names("/").count("ICONS"), 1)
+        self.assertEqual(self.index.totals()["/"], {"bytes": 11, "files": 2})
+
+    def test_full_path_listings_keep_full_paths(self) -> None:
+        self.index.store("/", [{"type": "dir", "size": "0", "name": "/ICONS"}])
+        self.index.uploaded("/NEW/f.txt", 2)
+        self.assertIn("/NEW", self.names("/"))
+
+    def test_delete_and_rename(self) -> None:
+        self.index.store("/ICONS", [{"type": "file", "size": "4", "name": "1.gif"}])
+        self.index.renamed("/ICONS/1.gif", "/MOVED/1.gif")
+        self.assertEqual(self.names("/ICONS"), [])
+        self.assertIn("MOVED", self.names("/"))
+        self.index.deleted("/ICONS")
+        self.assertNotIn("ICONS", self.names("/"))
+        self.assertIsNone(self.index.lookup("/ICONS"))
+
+
+class DeviceStateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.device = AwtrixEmulator(DeviceProfile(), {"/a.txt": b"a", "/b.txt": b"b", "/c.txt": b"c"}).__enter__()
+        self.addCleanup(self.device.__exit__, None, None, None)
+        self.state = awtrix_fs._device_state(self.device.host)
+        self.state.update({p: {"sha256": "x", "size": 1} for p in ("/a.txt", "/b.txt", "/c.txt")})
+        self.addCleanup(awtrix_fs._DEVICE_STATES.pop, self.device.host, None)
+        self.client = awtrix_fs.AwtrixClient(self.device.host)
+
+    def test_upload_forgets_hash(self) -> None:
+        self.client.upload_bytes("/a.txt", b"changed")
+        self.assertNotIn("/a.txt", self.state)
+
+    def test_rename_moves_hash_and_drops_overwritten(self) -> None:
+        self.client.rename("/b.txt", "/c.txt")
+        self.assertNotIn("/b.txt", self.state)
+        self.assertEqual(self.state["/c.txt"], {"sha256": "x", "size": 1})
+
+    def test_delete_forgets_hash(self) -> None:
+        self.client.delete("/c.txt")
+        self.assertNotIn("/c.txt", self.state)
+
+    def test_restore_reuploads_after_same_size_upload(self) -> None:
+        archive = os.path.join(_CACHE_DIR, "backup.tar")
+        with tarfile.open(archive, "w") as tf:
+            info = tarfile.TarInfo("a.txt")
+            info.size = 1
+            tf.addfile(info, io.BytesIO(b"a"))
+        args = awtrix_fs.build_parser().parse_args(["--host", self.device.host, "restore", "--no-reboot", archive])
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(args.func(args), 0)
+            # Same size as the archived copy, so only the invalidated hash can tell restore it changed.
+            self.client.upload_bytes("/a.txt", b"z")
+            self.assertEqual(args.func(args), 0)
+        self.assertEqual(self.device.files["/a.txt"], b"a")
+        self.assertIn("restored 1 files", out.getvalue().splitlines()[-1])
+
+
+class StatusTest(unittest.TestCase):
+    def test_status_leaves_index_unread(self) -> None:
+        with _device() as device, mock.patch.object(awtrix_fs, "FsIndex", side_effect=AssertionError("index loaded")):
+            args = argparse.Namespace(host=device.host, index_ttl=60.0)
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(awtrix_fs.cmd_status(args), 0)
+        self.assertIn("totalBytes", json.loads(out.getvalue()))
+
+
+class FlashLedgerTest(unittest.TestCase):
+    def test_overwrite_charges_only_growth(self) -> None:
+        ledger = awtrix_fs.FlashLedger()
+        ledger.seed({"totalBytes": 100000, "usedBytes": 8192})
+        ledger.observe("/ICONS", [{"type": "file", "name": "a.gif", "size": "100"}])
+        ledger.uploaded("/ICONS/a.gif", 200)
+        self.assertEqual(ledger.used, 8192)
+        ledger.uploaded("/ICONS/b.gif", 5000)
+        self.assertEqual(ledger.used, 8192 + 8192)
+        ledger.deleted("/ICONS/a.gif")
+        self.assertEqual(ledger.used, 8192 + 4096)
+        self.assertIsNone(ledger.known_size("/OTHER/x.gif"))
+
+    def test_upload_requests(self) -> None:
+        local = os.path.join(_CACHE_DIR, "icon.gif")
+        with open(local, "wb") as f:
+            f.write(b"y" * 100)
+        with _device({"/ICONS/a.gif": b"x" * 100}) as device:
+            self.assertEqual(_run(device.host, "list", "/ICONS")[2], ["GET /list"])
+            # The cached listing tells the ledger what the upload replaces: no second /status, and no growth.
+            code, out, requests = _run(device.host, "upload", local, "/ICONS/a.gif")
+            self.assertEqual((code, requests), (0, ["GET /status", "POST /edit"]))
+            self.assertIn("used 4096 -> 4096 bytes", out)
+            code, out, requests = _run(device.host, "--index-ttl", "0", "upload", local, "/ICONS/b.gif")
+            self.assertEqual((code, requests), (0, ["GET /list", "GET /status", "POST /edit"]))
+            self.assertIn("used 4096 -> 8192 bytes", out)
+
+
+class ConcurrencyControllerTest(unittest.TestCase):
+    def _controller(self, fixed: int | None = None) -> awtrix_fs.ConcurrencyController:
+        return awtrix_fs.ConcurrencyController(f"http://aimd-{self.id()}", fixed, maximum=6)
+
+    def _release(self, controller: awtrix_fs.ConcurrencyController, healthy: bool, started: float | None = None) -> None:
+        async def run() -> None:
+            start = await controller.acquire()
+            await controller.release("POST", start if started is None else started, healthy)
+
+        asyncio.run(run())
+
+    def test_grows_on_healthy_responses_up_to_the_maximum(self) -> None:
+        controller = self._controller()
+        self.assertEqual(controller.window, 2)
+        # Each healthy response adds 1/limit: 2 -> 2.5 -> 2.9 -> 3.24.
+        for _ in range(2):
+            self._release(controller, True)
+        self.assertEqual(controller.window, 2)
+        self._release(controller, True)
+        self.assertEqual(controller.window, 3)
+        # Within one of the ceiling the probe slows down, so it takes many more responses to reach it.
+        for _ in range(20):
+            self._release(controller, True)
+        self.assertLess(controller.limit, 6.0)
+        for _ in range(200):
+            self._release(controller, True)
+        self.assertEqual((controller.limit, controller.peak), (6.0, 6.0))
+
+    def test_halves_once_per_burst_of_failures(self) -> None:
+        controller = self._controller()
+        controller.limit = 6.0
+        burst = time.monotonic()
+        self._release(controller, False, burst)
+        self.assertEqual(controller.limit, 3.0)
+        # Failures from requests sent before the cut are the same burst.
+        self._release(controller, False, burst)
+        self.assertEqual((controller.limit, controller.cuts, controller.failures), (3.0, 1, 2))
+        self._release(controller, False)
+        self.assertEqual(controller.limit, 1.5)
+        for _ in range(3):
+            self._release(controller, False)
+        self.assertEqual(controller.limit, 1.0)
+
+    def test_fixed_concurrency_never_moves(self) -> None:
+        controller = self._controller(fixed=3)
+        for healthy in (True, True, True, False, True):
+            self._release(controller, healthy)
+        self.assertEqual(controller.limit, 3.0)
+
+    def test_settled_limit_is_reused(self) -> None:
+        controller = self._controller()
+        for _ in range(awtrix_fs.AIMD_REPORT_MIN_REQUESTS):
+            self._release(controller, True)
+        with contextlib.redirect_stderr(io.StringIO()):
+            controller.finish()
+        self.assertEqual(self._controller().limit, round(controller.limit, 2))
+
+    def test_sync_survives_a_device_that_resets_extra_sockets(self) -> None:
+        local = tempfile.mkdtemp(dir=_CACHE_DIR)
+        for i in range(30):
+            with open(os.path.join(local, f"{i}.txt"), "wb") as f:
+                f.write(bytes([i]) * 50)
+        with _device(max_connections=2) as device:
+            code, out, requests = _run(device.host, "--max-concurrency", "6", "sync", local, "/S")
+            files = dict(device.files)
+        self.assertEqual(code, 0, out)
+        self.assertEqual(len([p for p in files if p.startswith("/S/")]), 30)
+        self.assertGreaterEqual(requests.count("POST /edit"), 30)
+
+
+class TraceTest(unittest.TestCase):
+    def test_percentile(self) -> None:
+        values = [5.0, 1.0, 4.0, 2.0, 3.0]
+        self.assertEqual([awtrix_fs._percentile(values, p) for p in (0, 50, 90, 100)], [1.0, 3.0, 5.0, 5.0])
+        self.assertEqual(awtrix_fs._percentile([], 50), 0.0)
+
+    def test_one_line_per_request_and_a_summary(self) -> None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "awtrix_fs.py")
+        with _device({"/ICONS/a.gif": b"x" * 300}) as device:
+            proc = subprocess.run(
+                [sys.executable, script, "--host", device.host, "--index-ttl", "0", "--trace", "list", "/ICONS"],
+                capture_output=True,
+                text=True,
+            )
+            code, deleted, _ = _run(device.host, "delete", "/ICONS/none.gif")
+            self.assertEqual(code, 2)
+            code, backup, requests = _run(device.host, "backup", "--root", "/ICONS", os.path.join(_CACHE_DIR, "icons.tar"))
+            self.assertEqual(code, 0, backup)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        entry = json.loads(proc.stderr.splitlines()[0])
+        self.assertEqual((entry["method"], entry["path"], entry["status"], entry["host"]), ("GET", "/list?dir=/ICONS", 200, device.host))
+        self.assertGreater(entry["response_bytes"], 0)
+        self.assertFalse(entry["reused"])
+        self.assertLessEqual(entry["first_byte_ms"], entry["total_ms"])
+        self.assertRegex(proc.stderr, r"GET /list\s+1\s+0\s")
+        # A failed request counts as an error, and file reads share one row instead of one per path.
+        self.assertRegex(deleted, r"DELETE /edit\s+1\s+1\s")
+        self.assertIn("GET /ICONS/a.gif", requests)
+        self.assertRegex(backup, r"GET <file>\s+1\s+0\s")
+
+
+class SyncTest(unittest.TestCase):
+    def test_second_run_skips_unchanged_files(self) -> None:
+        local = tempfile.mkdtemp(dir=_CACHE_DIR)
+        for name, data in {"a.txt": b"aaa", "b.txt": b"bb"}.items():
+            with open(os.path.join(local, name), "wb") as f:
+                f.write(data)
+        with _device({"/S/b.txt": b"bb", "/S/old.txt": b"o"}) as device:
+            code, out, requests = _run(device.host, "sync", "--delete", "--dry-run", local, "/S")
+            self.assertEqual((code, requests), (0, ["GET /list"]))
+            self.assertIn("dry run: 2 to upload (5 bytes), 0 unchanged, 1 to delete", out)
+            self.assertEqual(set(device.files), {"/S/b.txt", "/S/old.txt"})
+            # b.txt has no recorded hash yet, so the first run uploads it too.
+            code, out, requests = _run(device.host, "sync", "--delete", local, "/S")
+            self.assertEqual((code, requests), (0, ["GET /status", "DELETE /edit", "POST /edit", "POST /edit", "GET /status"]))
+            self.assertIn("2 uploaded (5 bytes), 0 unchanged, 1 deleted", out)
+            # Within --index-ttl the plan comes from the index and the recorded hashes: no requests at all.
+            code, out, requests = _run(device.host, "sync", "--delete", local, "/S")
+            self.assertEqual((code, requests), (0, []))
+            self.assertIn("0 uploaded (0 bytes), 2 unchanged, 0 deleted", out)
+            code, out, requests = _run(device.host, "--index-ttl", "0", "sync", "--delete", local, "/S")
+            self.assertEqual((code, requests), (0, ["GET /list"]))
+            with open(os.path.join(local, "a.txt"), "wb") as f:
+                f.write(b"AAA")
+            code, out, requests = _run(device.host, "sync", local, "/S")
+            self.assertEqual((code, requests), (0, ["GET /status", "POST /edit", "GET /status"]))
+            self.assertIn("1 uploaded (3 bytes), 1 unchanged", out)
+            self.assertEqual(device.files, {"/S/a.txt": b"AAA", "/S/b.txt": b"bb"})
+
+
+class DeleteTest(unittest.TestCase):
+    def test_single_path_skips_asyncio(self) -> None:
+        with _device({"/ICONS/a.gif": b"x", "/ICONS/b.gif": b"y"}) as device:
+            code, out, requests = _run(device.host, "delete", "/ICONS/a.gif")
+            self.assertEqual((code, out.splitlines()[0], requests), (0, "deleted /ICONS/a.gif", ["DELETE /edit"]))
+            self.assertEqual(set(device.files), {"/ICONS/b.gif"})
+            _, _, modules = awtrix_bench.import_profile(["--host", device.host, "delete", "--dry-run", "/ICONS/b.gif"])
+        self.assertNotIn("asyncio", modules)
+
+    def test_glob_deletes_only_matches(self) -> None:
+        files = {"/ICONS/a.gif": b"x", "/ICONS/b.gif": b"y", "/ICONS/c.jpg": b"z", "/MELODIES/d.gif": b"w"}
+        with _device(files) as device:
+            code, _, requests = _run(device.host, "delete", "--glob", "/ICONS/*.gif", "--dry-run")
+            self.assertEqual((code, requests), (0, ["GET /list"]))
+            self.assertEqual(len(device.files), 4)
+            code, _, requests = _run(device.host, "--index-ttl", "0", "delete", "--glob", "/ICONS/*.gif")
+            self.assertEqual((code, requests), (0, ["GET /list", "DELETE /edit", "DELETE /edit"]))
+            self.assertEqual(set(device.files), {"/ICONS/c.jpg", "/MELODIES/d.gif"})
+
+    def test_missing_path_fails(self) -> None:
+        with _device() as device:
+            code, out, _ = _run(device.host, "delete", "/ICONS/none.gif")
+        self.assertEqual(code, 2)
+        self.assertIn("Error:", out)
+
+
+class BatchTest(unittest.TestCase):
+    def test_failed_commands_do_not_stop_the_batch(self) -> None:
+        local = os.path.join(_CACHE_DIR, "batch.gif")
+        with open(local, "wb") as f:
+            f.write(b"z" * 10)
+        ops = [
+            {"op": "status"},
+            {"op": "list", "dir": "/ICONS"},
+            {"op": "upload", "local": local, "dest": "/ICONS/b.gif", "id": "u"},
+            {"op": "rename", "old": "/ICONS/b.gif", "new": "/ICONS/c.gif"},
+            {"op": "delete", "path": "/ICONS/a.gif"},
+            {"op": "frobnicate"},
+            {"op": "delete"},
+            {"op": "delete", "path": "/ICONS/none.gif"},
+        ]
+        stdin = "\n".join(map(json.dumps, ops)) + "\nnot json\n# comment\n\n"
+        with _device({"/ICONS/a.gif": b"x"}) as device:
+            code, out, requests = _run(device.host, "batch", stdin=stdin)
+            files = dict(device.files)
+        results = [json.loads(line) for line in out.splitlines() if line.startswith("{")]
+        self.assertEqual(code, 2)
+        self.assertEqual([r["ok"] for r in results], [True] * 5 + [False] * 4)
+        self.assertEqual(results[2]["id"], "u")
+        self.assertIn("unknown op", results[5]["error"])
+        self.assertIn("404", results[7]["error"])
+        self.assertEqual(results[8]["line"], 9)
+        self.assertIn("batch: 9 commands, 4 failed", out)
+        # One /status seeds the ledger for the whole batch and the listing answers the upload's overwrite check.
+        self.assertEqual(requests, ["GET /status", "GET /list", "POST /edit", "PUT /edit", "DELETE /edit", "DELETE /edit"])
+        self.assertEqual(files, {"/ICONS/c.gif": b"z" * 10})
+
+    def _batch(self, host: str, *ops: dict[str, object]) -> list[dict[str, object]]:
+        fd, path = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            f.writelines(json.dumps(op) + "\n" for op in ops)
+        args = argparse.Namespace(host=host, index_ttl=60.0, from_file=path, no_cache=False)
+        with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(awtrix_fs.cmd_batch(args), 0)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_icon_cache_opens_only_for_imports(self) -> None:
+        icons = _gif_icons(1)
+        with _device() as device, _LametricServer(icons) as lametric:
+            with mock.patch.object(awtrix_fs, "LametricCache", side_effect=AssertionError("cache opened")):
+                self._batch(device.host, {"op": "status"}, {"op": "list", "dir": "/"})
+            _fresh_lametric_cache(self)
+            results = self._batch(device.host, {"op": "import", "icon": "1", "format": "gif"}, {"op": "import", "icon": "1"})
+            files = dict(device.files)
+        self.assertEqual(results[0]["result"]["dest"], "/ICONS/1.gif")
+        self.assertTrue(results[1]["result"]["skipped"])
+        self.assertEqual(files["/ICONS/1.gif"], icons["1"][1])
+        self.assertEqual(lametric.requests, ["1"])
+
+
+class DedupeTest(unittest.TestCase):
+    def test_groups_without_provisioning_pillow(self) -> None:
+        rgb = bytes(c for i in range(64) for c in (i * 4, 255 - i * 4, 60))
+        gif = awtrix_image.encode_gif(8, 8, rgb)
+        big_gif = awtrix_image.encode_gif(16, 16, awtrix_image.upscale(8, 8, rgb, 2))
+        jpg = awtrix_image.encode_jpeg(8, 8, rgb)
+        files = {
+            "/ICONS/1.gif": gif,
+            "/ICONS/2.gif": gif,
+            "/ICONS/6.gif": big_gif,
+            "/ICONS/3.jpg": jpg,
+            "/ICONS/4.jpg": jpg,
+            "/ICONS/5.jpg": awtrix_image.encode_jpeg(8, 8, bytes(192)),
+        }
+        provisioned: list[bool] = []
+        with _device(files) as device, mock.patch.object(awtrix_fs, "provision_pillow", lambda upgrade=False: provisioned.append(upgrade) or "0"):
+            args = awtrix_fs.build_parser().parse_args(["--host", device.host, "icons", "dedupe", "--json"])
+            with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()) as err:
+                self.assertEqual(args.func(args), 0)
+        self.assertEqual(provisioned, [])
+        groups = {g["keep"]: sorted(d["path"] for d in g["duplicates"]) for g in json.loads(out.getvalue())["groups"]}
+        self.assertEqual(groups["/ICONS/1.gif"], ["/ICONS/2.gif", "/ICONS/6.gif"])
+        self.assertEqual(groups["/ICONS/3.jpg"], ["/ICONS/4.jpg"])
+        if not awtrix_fs._pillow_importable():
+            self.assertIn("3 files need Pillow", err.getvalue())
+
+    def test_failed_provisioning_is_not_retried(self) -> None:
+        calls: list[bool] = []
+
+        def fail(upgrade: bool = False) -> str:
+            calls.append(upgrade)
+            raise RuntimeError("offline")
+
+        self.addCleanup(setattr, awtrix_fs, "_PILLOW_ERROR", None)
+        with mock.patch.object(awtrix_fs, "_pillow_importable", lambda: False), mock.patch.object(awtrix_fs, "provision_pillow", fail):
+            with contextlib.redirect_stderr(io.StringIO()):
+                for _ in range(3):
+                    with self.assertRaises(RuntimeError):
+                        awtrix_fs._ensure_pillow()
+        self.assertEqual(calls, [False])
+
+
+class ScreenTest(unittest.TestCase):
+    def test_malformed_payloads_raise_runtime_error(self) -> None:
+        pixels = awtrix_fs.SCREEN_WIDTH * awtrix_fs.SCREEN_HEIGHT
+        for payload in ([-1] * pixels, [1 << 40] * pixels, ["red"] * pixels, [0] * 3, {"screen": []}):
+            with self.assertRaises(RuntimeError):
+                awtrix_fs._decode_screen(payload)
+
+    def test_poller_survives_bad_frames(self) -> None:
+        frame = awtrix_fs._decode_screen([0xFF0000] * (awtrix_fs.SCREEN_WIDTH * awtrix_fs.SCREEN_HEIGHT))
+        replies: list[object] = [OverflowError("unsigned int is greater than maximum"), TypeError("bad"), frame]
+
+        class Client:
+            def screen(self) -> object:
+                reply = replies.pop(0) if len(replies) > 1 else replies[0]
+                if isinstance(reply, Exception):
+                    raise reply
+                return reply
+
+        hub = awtrix_fs.ScreenHub(Client(), 0.0, 1)  # type: ignore[arg-type]
+        poller = threading.Thread(target=hub.poll_forever, daemon=True)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            poller.start()
+            hub.fresh(timeout=5)
+            hub.stop()
+            poller.join(5)
+        self.assertEqual(hub.frame, frame)
+        self.assertEqual(hub.errors, 2)
+        self.assertIn("screen poll failed", err.getvalue())
+
+    def test_snapshot_and_watch(self) -> None:
+        with _device() as device:
+            code, out, requests = _run(device.host, "screen", "--json")
+            self.assertEqual((code, requests), (0, ["GET /api/screen"]))
+            self.assertEqual(len(json.loads(out.splitlines()[0])), awtrix_fs.SCREEN_WIDTH * awtrix_fs.SCREEN_HEIGHT)
+            code, out, requests = _run(device.host, "screen", "--watch", "--fps", "20", "--duration", "0.3")
+        self.assertEqual(code, 0, out)
+        self.assertIn(f"watched {len(requests)} frames", out)
+        self.assertEqual(set(requests), {"GET /api/screen"})
+
+
+    def test_record_gif_and_apng(self) -> None:
+        width, height = awtrix_fs.SCREEN_WIDTH, awtrix_fs.SCREEN_HEIGHT
+        gif, apng = os.path.join(_CACHE_DIR, "screen.gif"), os.path.join(_CACHE_DIR, "screen.png")
+        with _device() as device:
+            code, out, requests = _run(device.host, "screen", "--record", gif, "--scale", "1", "--fps", "20", "--duration", "1.2")
+            self.assertEqual(code, 0, out)
+            self.assertIn(f"recorded {len(requests)} polls", out)
+            self.assertEqual(set(requests), {"GET /api/screen"})
+            code, out, _ = _run(device.host, "screen", "--record", apng, "--scale", "2", "--fps", "20", "--duration", "1.2")
+            self.assertEqual(code, 0, out)
+        with open(gif, "rb") as f:
+            anim = awtrix_image.decode_gif(f.read())
+        # The emulator's dot moves twice a second, so 1.2s of polling yields at least two distinct frames.
+        self.assertEqual((anim.width, anim.height), (width, height))
+        self.assertGreaterEqual(len(anim.frames), 2)
+        self.assertEqual(len({rgb for rgb, _ in anim.frames}), len(anim.frames))
+        with open(apng, "rb") as f:
+            data = f.read()
+        image = awtrix_image.decode_png(data)
+        self.assertEqual((image.width, image.height), (width * 2, height * 2))
+        self.assertIn(b"acTL", data)
+        self.assertGreaterEqual(data.count(b"fcTL"), 2)
+
+    def test_serve_polls_once_for_every_viewer(self) -> None:
+        fd, trace = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".jsonl")
+        os.close(fd)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "awtrix_fs.py")
+        with _device() as device:
+            argv = ["--host", device.host, "--trace-file", trace, "screen", "--serve", "127.0.0.1:0", "--fps", "5", "--duration", "2"]
+            proc = subprocess.Popen([sys.executable, script, *argv], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            banner = proc.stderr.readline()  # type: ignore[union-attr]
+            base = banner.split()[1].rstrip("/")
+            replies: list[tuple[str, bytes]] = []
+
+            def view() -> None:
+                for path in ("/snapshot.png", "/snapshot.jpg", "/screen.json"):
+                    with urllib.request.urlopen(base + path, timeout=5) as resp:
+                        replies.append((path, resp.read()))
+
+            viewers = [threading.Thread(target=view) for _ in range(8)]
+            for viewer in viewers:
+                viewer.start()
+            for viewer in viewers:
+                viewer.join()
+            out, _ = proc.communicate(timeout=10)
+        with open(trace, encoding="utf-8") as f:
+            polls = [e["path"] for e in map(json.loads, f)]
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(len(replies), 24)
+        png = next(data for path, data in replies if path == "/snapshot.png")
+        image = awtrix_image.decode_png(png)
+        self.assertEqual((image.width, image.height), (awtrix_fs.SCREEN_WIDTH * 8, awtrix_fs.SCREEN_HEIGHT * 8))
+        self.assertTrue(all(len(json.loads(data)) == awtrix_fs.SCREEN_WIDTH * awtrix_fs.SCREEN_HEIGHT for path, data in replies if path == "/screen.json"))
+        # 24 requests in 2s at 5 fps: the device sees the poller's rate, not the viewers'.
+        self.assertEqual(set(polls), {"/api/screen"})
+        self.assertLessEqual(len(polls), 12)
+        self.assertIn("16 snapshots", out)
+
+class LametricCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.icons = _gif_icons(3)
+        self.root = tempfile.mkdtemp(dir=_CACHE_DIR)
+        self.lametric = self.enterContext(_LametricServer(self.icons))
+
+    def read(self, cache: awtrix_fs.LametricCache, icon_id: str, refresh: bool = False) -> bytes:
+        with cache.open(icon_id, refresh) as download:
+            return download.read()
+
+    def test_fresh_hit_skips_network_and_refresh_revalidates(self) -> None:
+        cache = awtrix_fs.LametricCache(self.root)
+        self.assertEqual(self.read(cache, "1"), self.icons["1"][1])
+        self.assertEqual(self.read(awtrix_fs.LametricCache(self.root), "1"), self.icons["1"][1])
+        self.assertEqual(self.lametric.requests, ["1"])
+        # --refresh sends the ETag back; the 304 serves the blob already on disk.
+        self.assertEqual(self.read(cache, "1", refresh=True), self.icons["1"][1])
+        self.assertEqual(self.lametric.requests, ["1", "1"])
+
+    def test_stale_entry_survives_failed_revalidation(self) -> None:
+        self.read(awtrix_fs.LametricCache(self.root), "2")
+        self.lametric.fail = True
+        cache = awtrix_fs.LametricCache(self.root, max_age=0)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(self.read(cache, "2"), self.icons["2"][1])
+        self.assertIn("using the cached copy", err.getvalue())
+        with self.assertRaises(OSError):
+            self.read(cache, "3")
+
+    def test_least_recently_used_blobs_are_evicted(self) -> None:
+        size = max(len(data) for _, data in self.icons.values())
+        cache = awtrix_fs.LametricCache(self.root, max_bytes=2 * size)
+        for icon_id in ("1", "2", "1", "3"):
+            self.read(cache, icon_id)
+        with open(os.path.join(self.root, "index.json"), encoding="utf-8") as f:
+            self.assertEqual(set(json.load(f)["icons"]), {"1", "3"})
+
+    def test_derived_conversions_are_cached(self) -> None:
+        cache = awtrix_fs.LametricCache(self.root)
+        self.read(cache, "1")
+        calls: list[str] = []
+        for _ in range(2):
+            self.assertEqual(cache.derive("1", "jpeg:q95", lambda: calls.append("x") or b"converted"), b"converted")
+        self.assertEqual(calls, ["x"])
+
+
+class LametricFleetTest(unittest.TestCase):
+    def test_fleet_import_shares_one_cache(self) -> None:
+        root = _fresh_lametric_cache(self)
+        icons = _gif_icons(40)
+        devices = [_device() for _ in range(6)]
+        for device in devices:
+            self.enterContext(device)
+        with _LametricServer(icons) as lametric:
+            args = awtrix_fs.build_parser().parse_args(
+                ["--hosts", ",".join(d.host for d in devices), "icons", "import-lametric", *icons]
+            )
+            with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()):
+                code = awtrix_fs._fan_out(args, awtrix_fs._read_hosts(args))
+        self.assertEqual(code, 0, out.getvalue())
+        for device in devices:
+            self.assertEqual({p: d for p, d in device.files.items() if p.startswith("/ICONS/")}, {f"/ICONS/{i}.gif": icons[i][1] for i in icons})
+        with open(os.path.join(root, "index.json"), encoding="utf-8") as f:
+            self.assertEqual(set(json.load(f)["icons"]), set(icons))
+        self.assertEqual([n for n in os.listdir(root) if n.endswith(".tmp")], [])
+        self.assertGreaterEqual(len(lametric.requests), len(icons))
+
+
+class PassthroughTest(unittest.TestCase):
+    def test_streamed_icons_need_one_request_each(self) -> None:
+        icons = _gif_icons(3)
+        with _device() as device, _LametricServer(icons):
+            _fresh_lametric_cache(self)
+            args = awtrix_fs.build_parser().parse_args(["--host", device.host, "icons", "import-lametric", *icons])
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(args.func(args), 0)
+            stats = device.stats
+            files = dict(device.files)
+        # One listing, one /status to seed the ledger and one to reconcile after the batch, then one POST per icon.
+        self.assertEqual(stats.requests, {"GET": 3, "POST": 3})
+        self.assertEqual(files, {f"/ICONS/{i}.gif": icons[i][1] for i in icons})
+
+    def test_reset_streams_are_resent_from_memory(self) -> None:
+        root = _fresh_lametric_cache(self)
+        icons = _gif_icons(30)
+        # More sockets than the device accepts: some streamed uploads are reset after their body was consumed.
+        with _device() as device, _LametricServer(icons) as lametric:
+            args = awtrix_fs.build_parser().parse_args(
+                ["--host", device.host, "--concurrency", "8", "icons", "import-lametric", "--workers", "8", *icons]
+            )
+            with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(args.func(args), 0, out.getvalue())
+            files = dict(device.files)
+        self.assertEqual(files, {f"/ICONS/{i}.gif": icons[i][1] for i in icons})
+        # Resends come from the cache, not from LaMetric.
+        self.assertEqual(sorted(lametric.requests), sorted(icons))
+        self.assertEqual([n for n in os.listdir(os.path.join(root, "blobs")) if n.endswith(".tmp")], [])
+
+    def test_batch_resends_after_a_dropped_socket(self) -> None:
+        icons = _gif_icons(1)
+        def drop(self: awtrix_fs.AwtrixClient, dest: str, download: awtrix_fs.LametricDownload, length: int, content_type: str | None = None) -> None:
+            download.read(8)
+            raise RuntimeError("Request failed POST /edit") from ConnectionResetError("reset")
+
+        with _device() as device, _LametricServer(icons):
+            _fresh_lametric_cache(self)
+            client = awtrix_fs.AwtrixClient(device.host)
+            with mock.patch.object(awtrix_fs.AwtrixClient, "upload_stream", drop):
+                result = awtrix_fs._batch_import(client, awtrix_fs._lametric_cache(), {"icon": "1", "format": "gif"})
+            files = dict(device.files)
+        self.assertEqual(result["dest"], "/ICONS/1.gif")
+        self.assertEqual(files["/ICONS/1.gif"], icons["1"][1])
+
+
+class FleetTest(unittest.TestCase):
+    def test_sync_writes_per_host_state_concurrently(self) -> None:
+        local = tempfile.mkdtemp(dir=_CACHE_DIR)
+        for i in range(12):
+            with open(os.path.join(local, f"{i}.txt"), "wb") as f:
+                f.write(bytes([i]) * (i + 1))
+        with contextlib.ExitStack() as stack:
+            devices = [stack.enter_context(_device()) for _ in range(4)]
+            code, out, requests = _run(",".join(d.host for d in devices), "sync", local, "/S")
+            self.assertEqual(code, 0, out)
+            for device in devices:
+                self.assertEqual(len([p for p in device.files if p.startswith("/S/")]), 12)
+                slug = awtrix_fs._host_slug(device.host)
+                with open(os.path.join(_CACHE_DIR, "sync", f"{slug}.json"), encoding="utf-8") as f:
+                    self.assertEqual(len([p for p in json.load(f) if p.startswith("/S/")]), 12)
+                with open(os.path.join(_CACHE_DIR, "index", f"{slug}.json"), encoding="utf-8") as f:
+                    self.assertEqual(len(json.load(f)["dirs"]["/S"]["entries"]), 12)
+                self.assertIn(f"[{device.host}] synced", out)
+        leftovers = [n for _, _, names in os.walk(_CACHE_DIR) for n in names if n.endswith(".tmp")]
+        self.assertEqual(leftovers, [])
+
+    def test_shared_stdin_list_is_removed(self) -> None:
+        tmp = tempfile.mkdtemp(dir=_CACHE_DIR)
+        with _device({"/a.txt": b"a"}) as one, _device({"/a.txt": b"a"}) as two:
+            code, out, _ = _run(f"{one.host},{two.host}", "delete", "--from-file", "-", stdin="/a.txt\n", env={"TMPDIR": tmp})
+            self.assertEqual((code, one.files, two.files), (0, {}, {}), out)
+        self.assertEqual(os.listdir(tmp), [])
+
+    def test_executor_output_keeps_host_prefix(self) -> None:
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        stream = awtrix_fs._ContextRoutedStream(io.StringIO())
+
+        def host() -> str:
+            buffer = stream.capture()
+
+            async def convert() -> None:
+                with ThreadPoolExecutor(2) as pool:
+                    await awtrix_fs._run_in_executor(pool, stream.write, "from worker\n")
+
+            asyncio.run(convert())
+            stream.release()
+            return buffer.getvalue()
+
+        with ThreadPoolExecutor(1) as pool:
+            self.assertEqual(pool.submit(host).result(), "from worker\n")
+        self.assertEqual(stream._stream.getvalue(), "")  # type: ignore[attr-defined]
+
+    def test_concurrent_pillow_provisioning_runs_once(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        installed: list[bool] = []
+
+        def provision(upgrade: bool = False) -> str:
+            time.sleep(0.05)
+            installed.append(upgrade)
+            return "0"
+
+        with mock.patch.object(awtrix_fs, "_pillow_importable", lambda: bool(installed)), mock.patch.object(
+            awtrix_fs, "provision_pillow", provision
+        ), contextlib.redirect_stderr(io.StringIO()):
+            with ThreadPoolExecutor(6) as pool:
+                list(pool.map(lambda _: awtrix_fs._ensure_pillow(), range(6)))
+        self.assertEqual(installed, [False])
+
+
+if __name__ == "__main__":
+    unittest.main()